@@ -0,0 +1,853 @@
+"""
+asyncio versions of the Kernel event bus and the Collab server/client.
+
+`AsyncKernel` has the Kernel's semantics (per-service queues,
+backpressure policies, topic routing, metrics) with worker tasks instead of
+threads: coroutine handlers are awaited, plain handlers run on the loop
+(`mode='inline'`, they must not block), in the loop's thread pool
+(`mode='thread'`) or in a process pool (`mode='process'`).
+
+`AsyncCollabServer` serves every peer from one event loop via
+`asyncio.start_server` (optionally TLS); `AsyncCollabClient` is its
+counterpart. Both speak the framed protocol in `Pluto.protocol`. Besides
+broadcasts the server keeps named rooms (join/leave, presence) and routes
+direct messages by peer id; the room and peer indexes mean a message only
+costs work for the peers it is addressed to. The blocking
+`CollabServer`/`CollabClient` run these on the shared `background_loop()`
+thread.
+"""
+import asyncio
+import hmac
+import inspect
+import itertools
+import json
+import logging
+import socket
+import threading
+import time
+from collections import deque
+
+from Pluto.collab import client_ssl_context, server_ssl_context
+from Pluto.kernel import ServiceQueue, _Bus, _call, topic_of
+from Pluto.protocol import (AUTH, BINARY, DIRECT, ERROR, HELLO, JOIN, LEAVE, MAX_FRAME, PRESENCE, ROOM, TEXT,
+                            FrameDecoder, ProtocolError, encode_frame, encode_message, encode_routed, parse_routed,
+                            routed_frame)
+
+READ_SIZE = 256 << 10
+SLOW_CONSUMER = ('drop', 'coalesce', 'disconnect')
+
+log = logging.getLogger(__name__)
+
+
+class LoopThread:
+    """An event loop running forever in a daemon thread."""
+
+    def __init__(self, name='pluto-aio'):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name=name, daemon=True)
+        self.thread.start()
+
+    def run(self, coro, timeout=None):
+        """Run `coro` on the loop and return its result.
+
+        Raises RuntimeError when called from the loop thread itself (e.g.
+        inside an `on_message` callback), where waiting would deadlock; use
+        `run_or_schedule` for fire-and-forget work or await the coroutine.
+        """
+        if threading.current_thread() is self.thread:
+            coro.close()
+            raise RuntimeError("LoopThread.run() cannot wait on its own loop thread "
+                               "(e.g. from an on_message callback); await the coroutine instead")
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def run_or_schedule(self, coro, timeout=None):
+        """`run(coro)` for coroutines run for their effect; on the loop thread it is only scheduled."""
+        if threading.current_thread() is self.thread:
+            self.loop.create_task(coro)
+            return
+        self.run(coro, timeout)
+
+    def run_sync(self, fn, *args, timeout=None):
+        """Call `fn(*args)` on the loop and return its result (directly when already on the loop)."""
+        if threading.current_thread() is self.thread:
+            return fn(*args)
+
+        async def call():
+            return fn(*args)
+        return self.run(call(), timeout)
+
+    def call(self, fn, *args):
+        """Schedule `fn(*args)` on the loop; calls keep their order."""
+        self.loop.call_soon_threadsafe(fn, *args)
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+_background = None
+_background_lock = threading.Lock()
+
+
+def background_loop():
+    """The process-wide `LoopThread` used by the blocking wrappers."""
+    global _background
+    with _background_lock:
+        if _background is None:
+            _background = LoopThread()
+        return _background
+
+
+async def _wait(waiters):
+    fut = asyncio.get_running_loop().create_future()
+    waiters.append(fut)
+    try:
+        await fut
+    except asyncio.CancelledError:
+        if not fut.cancelled():
+            _wake(waiters, 1)  # woken just before being cancelled: pass the wakeup on
+        raise
+
+
+def _wake(waiters, n=None):
+    """Wake up to `n` (default: all) waiting futures."""
+    n = len(waiters) if n is None else n
+    while waiters and n > 0:
+        fut = waiters.popleft()
+        if not fut.done():
+            fut.set_result(None)
+            n -= 1
+
+
+class AsyncServiceQueue(ServiceQueue):
+    """`ServiceQueue` whose waits are futures on the owning event loop."""
+
+    MODES = ('inline', 'thread', 'process')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._get_waiters = deque()
+        self._put_waiters = deque()
+        self._idle_waiters = deque()
+
+    async def put(self, event, offset=None):
+        return await self.put_many((event,), (offset,)) == 1
+
+    async def put_many(self, events, offsets=None):
+        now = time.perf_counter()
+        items = [(now, e, o) for e, o in zip(events, offsets)] if offsets else [(now, e, None) for e in events]
+        accepted, i = 0, 0
+        while i < len(items) and not self._closed:
+            i, n = self._offer(items, i)
+            accepted += n
+            if not n and i < len(items):
+                await _wait(self._put_waiters)
+        return accepted
+
+    def _current(self):
+        try:
+            return asyncio.current_task()
+        except RuntimeError:
+            return None
+
+    def _wake_getters(self):
+        _wake(self._get_waiters)
+
+    async def get_batch(self):
+        while not self._items:
+            if self._closed:
+                return []
+            await _wait(self._get_waiters)
+        batch = self._take()
+        _wake(self._put_waiters, len(batch))
+        return batch
+
+    def done(self, n, wait, latency, errors=0, last_error=None):
+        idle = super().done(n, wait, latency, errors, last_error)
+        if idle:
+            _wake(self._idle_waiters)
+        return idle
+
+    async def join(self, timeout=None):
+        async def idle():
+            while self._items or self._busy:
+                await _wait(self._idle_waiters)
+        try:
+            await asyncio.wait_for(idle(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def close(self):
+        super().close()
+        _wake(self._get_waiters)
+        _wake(self._put_waiters)
+
+
+class AsyncKernel(_Bus):
+    def __init__(self, name="PlutoOS", queue_size=None, backpressure='drop-new', processes=None):
+        super().__init__(name, queue_size, backpressure, processes)
+        self._tasks = {}   # name#id -> [tasks]
+
+    def register_service(self, name, handler, queue_size=None, backpressure=None, workers=1, mode='inline',
+                         topics=None):
+        """Register a handler (a coroutine function or a plain one, see `mode`)."""
+        sq = AsyncServiceQueue(name, handler, queue_size or self.queue_size, backpressure or self.backpressure,
+                               workers, mode, topics)
+        with self._lock:
+            old = self._add(sq)
+            if self._running:
+                self._start_workers(sq)
+        if old is not None:
+            self._retire(old)
+
+    def unregister_service(self, name):
+        with self._lock:
+            sq = self.services.pop(name, None)
+            self._rebuild_routes()
+        if sq is not None:
+            self._retire(sq)
+
+    def _retire(self, sq):
+        sq.close()  # its workers drain what is queued and exit
+        self._tasks.pop(sq.name + '#' + str(id(sq)), None)
+
+    async def emit_event(self, event, topic=None):
+        """Queue `event` for every subscribed service; returns how many accepted it."""
+        if topic is None:
+            topic = topic_of(event)
+        accepted = 0
+        for sq in self._route(topic):
+            accepted += await sq.put(event)
+        return accepted
+
+    async def emit_many(self, events, topic=None):
+        """Queue a batch of events (all on `topic`, or each on its own); returns total acceptances."""
+        if topic is not None:
+            events = events if isinstance(events, list) else list(events)
+            groups = [(sq, (events, None)) for sq in self._route(topic)]
+        else:
+            groups = self._group(events).items()
+        accepted = 0
+        for sq, (batch, _) in groups:
+            accepted += await sq.put_many(batch)
+        return accepted
+
+    async def _worker(self, sq):
+        sq.worker_ids.add(sq._current())
+        try:
+            await self._work(sq)
+        finally:
+            sq.worker_ids.discard(sq._current())
+
+    async def _work(self, sq):
+        loop = asyncio.get_running_loop()
+        clock = time.perf_counter
+        handler = sq.handler
+        while True:
+            batch = await sq.get_batch()
+            if not batch:
+                return
+            started = clock()
+            errors, last_error = 0, None
+            for _, event, _ in batch:
+                try:
+                    if sq.mode == 'thread':
+                        await loop.run_in_executor(None, handler, event)
+                    elif sq.mode == 'process':
+                        await loop.run_in_executor(self._process_pool(), _call, handler, event)
+                    else:
+                        result = handler(event)
+                        if inspect.isawaitable(result):
+                            await result
+                except Exception as e:
+                    errors += 1
+                    last_error = e
+            sq.done(len(batch), started - batch[0][0], (clock() - started) / len(batch), errors, last_error)
+            await asyncio.sleep(0)  # let producers and other services run between batches
+
+    def _start_workers(self, sq):
+        sq.reopen()
+        loop = asyncio.get_running_loop()
+        self._tasks[sq.name + '#' + str(id(sq))] = [
+            loop.create_task(self._worker(sq), name=f"kernel-{sq.name}-{i}") for i in range(sq.workers)]
+
+    async def join(self, timeout=None):
+        """Wait until all queued events have been handled."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for sq in list(self.services.values()):
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not await sq.join(remaining):
+                return False
+        return True
+
+    async def start(self):
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+            for sq in self.services.values():
+                self._start_workers(sq)
+
+    async def stop(self, timeout=1.0):
+        """Stop the workers; events still queued are handled first (up to `timeout` seconds)."""
+        with self._lock:
+            self._running = False
+            services = list(self.services.values())
+            tasks, self._tasks = self._tasks, {}
+            pool, self._pool = self._pool, None
+        for sq in services:
+            sq.close()
+        pending = [t for ts in tasks.values() for t in ts]
+        if pending:
+            _, late = await asyncio.wait(pending, timeout=timeout)
+            for t in late:
+                t.cancel()
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+
+class _Peer:
+    """Server-side state of one connected client: its bounded outbound queue."""
+
+    __slots__ = ('id', 'rooms', 'limit', 'policy', 'writer', 'transport', 'addr', 'queue', 'queued', 'dropped',
+                 'waiter', 'task')
+
+    def __init__(self, writer, peer_id, limit, policy):
+        self.id = peer_id
+        self.rooms = set()
+        self.limit = limit     # bytes `queue` may hold before the slow-consumer policy applies
+        self.policy = policy   # one of SLOW_CONSUMER
+        self.writer = writer
+        self.transport = writer.transport
+        self.addr = writer.get_extra_info('peername')
+        self.queue = deque()   # framed buffers, shared with the other recipients
+        self.queued = 0        # bytes in `queue`
+        self.dropped = 0       # frames lost to the slow-consumer policy
+        self.waiter = None
+        self.task = None
+
+
+class AsyncCollabServer:
+    """Collab server on one event loop.
+
+    Frames are written straight to a client's transport while its buffer is
+    below `write_buffer` bytes; beyond that they wait in the client's own
+    queue, which a per-client writer task drains as the peer catches up, so
+    a stalled peer never holds up the others. A queue over
+    `send_queue_bytes` triggers `slow_consumer`: 'drop' discards the new
+    frame, 'coalesce' discards the oldest queued ones so the peer skips
+    ahead to the latest messages, and 'disconnect' drops the peer.
+
+    `rooms` maps a room name to its members and `peers` a peer id to its
+    peer, so a room message is framed once and handed to the members only,
+    and a direct message is one dict lookup. Peers get an id `peerN` unless
+    they ask for a free name (HELLO) before joining a room. Room members
+    see PRESENCE join/leave events, including for peers that disconnect.
+    """
+
+    def __init__(self, host='127.0.0.1', port=6000, use_ssl=False, certfile=None, keyfile=None, auth_token=None,
+                 backlog=1024, max_frame=MAX_FRAME, send_queue_bytes=1 << 20, slow_consumer='drop',
+                 write_buffer=64 << 10):
+        if slow_consumer not in SLOW_CONSUMER:
+            raise ValueError(f"slow_consumer must be one of {SLOW_CONSUMER}, not {slow_consumer!r}")
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.certfile = certfile
+        self.keyfile = keyfile
+        self.auth_token = auth_token
+        self.backlog = backlog
+        self.max_frame = max_frame
+        self.send_queue_bytes = send_queue_bytes
+        self.slow_consumer = slow_consumer
+        self.write_buffer = write_buffer
+        self.clients = {}   # writer -> _Peer, in connection order
+        self.peers = {}     # peer id -> _Peer
+        self.rooms = {}     # room -> {_Peer: None}, in join order
+        self.id_prefix = 'peer'
+        self._ids = itertools.count(1)
+        self.dropped = 0
+        self.slow_disconnects = 0
+        self._server = None
+        self._ssl_context = None
+        if self.use_ssl:
+            self._ssl_context, self.certfile, self.keyfile = server_ssl_context(certfile, keyfile)
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._client_loop, self.host, self.port, ssl=self._ssl_context,
+                                                  backlog=self.backlog, reuse_address=True)
+        if not self.port:
+            self.port = self._server.sockets[0].getsockname()[1]
+
+    def _new_peer(self, writer, peer_id, limit, policy=None):
+        peer = _Peer(writer, peer_id, limit, policy or self.slow_consumer)
+        peer.transport.set_write_buffer_limits(high=self.write_buffer)
+        peer.task = asyncio.get_running_loop().create_task(self._writer_loop(peer))
+        return peer
+
+    def _join(self, writer):
+        peer_id = f"{self.id_prefix}{next(self._ids)}"
+        while self._name_taken(peer_id):
+            peer_id = f"{self.id_prefix}{next(self._ids)}"
+        peer = self._new_peer(writer, peer_id, self.send_queue_bytes)
+        self.clients[writer] = peer
+        self.peers[peer_id] = peer
+        return peer
+
+    def _name_taken(self, name):
+        return name in self.peers
+
+    def _rename(self, peer, name):
+        del self.peers[peer.id]
+        peer.id = name
+        self.peers[name] = peer
+
+    def _leave_all(self, peer):
+        self.peers.pop(peer.id, None)
+        for room in list(peer.rooms):
+            self.leave_room(peer, room)
+
+    async def _client_loop(self, reader, writer):
+        decoder = FrameDecoder(self.max_frame)
+        token = self.auth_token.encode() if self.auth_token else None
+        if token is None:
+            self._join(writer)
+        try:
+            while True:
+                raw = await reader.read(READ_SIZE)
+                if not raw:
+                    break
+                try:
+                    frames = decoder.feed(raw)
+                except ProtocolError:
+                    writer.write(encode_frame(ERROR, b'protocol'))
+                    break
+                out = []
+                for ftype, payload in frames:
+                    peer = self.clients.get(writer)
+                    if peer is None:
+                        # the first frame must carry the token
+                        if ftype != AUTH or not hmac.compare_digest(payload.strip(), token):
+                            writer.write(encode_frame(ERROR, b'auth'))
+                            return
+                        self._join(writer)
+                    elif ftype in (TEXT, BINARY):
+                        out.append(encode_frame(ftype, payload))
+                    else:
+                        if out:
+                            # keep this sender's broadcasts and routed messages in order
+                            self._publish(TEXT, None, b''.join(out), peer)
+                            out = []
+                        try:
+                            self._handle(peer, ftype, payload)
+                        except ProtocolError:
+                            writer.write(encode_frame(ERROR, b'protocol'))
+                            return
+                if out:
+                    # everything this read produced goes out as one write per peer
+                    self._publish(TEXT, None, b''.join(out), self.clients.get(writer))
+        except OSError:
+            pass
+        finally:
+            peer = self.clients.pop(writer, None)
+            if peer is not None:
+                peer.task.cancel()
+                self._leave_all(peer)
+            writer.close()
+
+    def _handle(self, peer, ftype, payload):
+        if ftype == ROOM:
+            kind, room, _, body = parse_routed(payload)
+            self._publish(ROOM, room, routed_frame(ROOM, kind, room, peer.id, body), peer)
+        elif ftype == DIRECT:
+            kind, target, _, body = parse_routed(payload)
+            if not self._publish(DIRECT, target, routed_frame(DIRECT, kind, target, peer.id, body)):
+                self._deliver(peer, encode_frame(ERROR, f"no such peer: {target}".encode()))
+        elif ftype == JOIN:
+            self.join_room(peer, payload.decode('utf-8', 'replace'))
+        elif ftype == LEAVE:
+            self.leave_room(peer, payload.decode('utf-8', 'replace'))
+        elif ftype == HELLO:
+            name = payload.decode('utf-8', 'replace').strip()
+            if name and name != peer.id:
+                if self._name_taken(name):
+                    self._deliver(peer, encode_frame(ERROR, f"peer name taken: {name}".encode()))
+                elif peer.rooms:
+                    self._deliver(peer, encode_frame(ERROR, b"cannot rename after joining rooms"))
+                else:
+                    self._rename(peer, name)
+            self._deliver(peer, encode_frame(HELLO, peer.id.encode()))
+
+    # -- rooms -----------------------------------------------------------------
+
+    def join_room(self, peer, room):
+        """Add `peer` to `room`; returns False if it already was a member."""
+        members = self.rooms.setdefault(room, {})
+        if peer in members:
+            return False
+        self._presence(room, {'event': 'join', 'room': room, 'peer': peer.id})
+        members[peer] = None
+        peer.rooms.add(room)
+        self._deliver(peer, self._presence_frame({'event': 'members', 'room': room, 'peers': self.members(room)}))
+        return True
+
+    def leave_room(self, peer, room):
+        """Remove `peer` from `room`; returns False if it was not a member."""
+        members = self.rooms.get(room)
+        if members is None or peer not in members:
+            return False
+        del members[peer]
+        peer.rooms.discard(room)
+        if not members:
+            del self.rooms[room]
+        self._presence(room, {'event': 'leave', 'room': room, 'peer': peer.id})
+        return True
+
+    def members(self, room):
+        """Peer ids in `room`, in join order."""
+        return [p.id for p in self.rooms.get(room, ())]
+
+    @staticmethod
+    def _presence_frame(event):
+        return encode_frame(PRESENCE, json.dumps(event).encode())
+
+    def _presence(self, room, event):
+        members = self.rooms.get(room)
+        if members:
+            self._send_room(members, self._presence_frame(event))
+
+    def send_to_room(self, room, msg):
+        """Send `msg` to every member of `room`, with an empty sender."""
+        self._publish(ROOM, room, encode_routed(ROOM, room, msg))
+
+    def send_direct(self, peer_id, msg):
+        """Send `msg` to one peer; returns False if there is no such peer."""
+        return self._publish(DIRECT, peer_id, encode_routed(DIRECT, peer_id, msg))
+
+    def broadcast(self, msg, exclude=None):
+        """Send `msg` (str as TEXT, bytes as BINARY) to every client but `exclude`; framed once for all."""
+        self._publish(TEXT, None, encode_message(msg), exclude)
+
+    def _publish(self, kind, target, data, exclude=None):
+        """Deliver framed `data`: to every client (TEXT), the members of room `target` (ROOM) or
+        peer `target` (DIRECT, returns False if it is unknown)."""
+        if kind == ROOM:
+            members = self.rooms.get(target)
+            if members:
+                self._send_room(members, data, exclude)
+        elif kind == DIRECT:
+            peer = self.peers.get(target)
+            if peer is None:
+                return False
+            self._deliver(peer, data)
+        else:
+            self._send_all(data, exclude)
+        return True
+
+    def _send_room(self, members, data, exclude=None):
+        for peer in members:
+            if peer is not exclude:
+                self._deliver(peer, data)
+
+    def _send_all(self, data, exclude=None):
+        # nothing here removes clients synchronously (abort() reports back later);
+        # `exclude` may be the peer or its writer
+        for w, peer in self.clients.items():
+            if peer is not exclude and w is not exclude:
+                self._deliver(peer, data)
+
+    def _deliver(self, peer, data):
+        transport = peer.transport
+        if transport.is_closing():
+            return
+        if not peer.queue and transport.get_write_buffer_size() < self.write_buffer:
+            transport.write(data)
+            return
+        if peer.queued + len(data) > peer.limit:
+            if peer.policy == 'disconnect':
+                self.slow_disconnects += 1
+                transport.abort()
+                return
+            if peer.policy == 'drop':
+                peer.dropped += 1
+                self.dropped += 1
+                return
+            while peer.queue and peer.queued + len(data) > peer.limit:
+                old = peer.queue.popleft()
+                peer.queued -= len(old)
+                peer.dropped += 1
+                self.dropped += 1
+        peer.queue.append(data)
+        peer.queued += len(data)
+        if peer.waiter is not None and not peer.waiter.done():
+            peer.waiter.set_result(None)
+
+    async def _writer_loop(self, peer):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                if not peer.queue:
+                    peer.waiter = loop.create_future()
+                    await peer.waiter
+                    peer.waiter = None
+                    continue
+                await peer.writer.drain()  # returns once the transport is below its low-water mark
+                if peer.queue:
+                    bufs = list(peer.queue)
+                    peer.queue.clear()
+                    peer.queued = 0
+                    peer.transport.writelines(bufs)
+        except (OSError, RuntimeError):
+            pass  # connection lost; _client_loop cleans up
+
+    def stats(self):
+        return {'clients': len(self.clients), 'rooms': len(self.rooms), 'queued_bytes': sum(p.queued for p in self.clients.values()),
+                'dropped': self.dropped, 'slow_disconnects': self.slow_disconnects}
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+        peers, self.clients = list(self.clients.values()), {}
+        self.peers = {}
+        self.rooms = {}
+        for peer in peers:
+            peer.task.cancel()
+            peer.writer.close()
+        if self._server is not None:
+            try:
+                await asyncio.wait_for(self._server.wait_closed(), 2)
+            except asyncio.TimeoutError:
+                pass
+            self._server = None
+
+
+class AsyncCollabClient:
+    """Collab client; callbacks may be coroutine functions.
+
+    Room and direct messages go to `on_room_message`/`on_direct_message`
+    when set, else to `on_message` with just the body. `peer_id` is filled
+    in once the server has answered the HELLO sent on connect.
+
+    `nodes` lists `(host, port)` of clustered servers to fall back on:
+    `connect()` takes the first that answers and `reconnect()` moves on to
+    the next one, asking for the same peer id and rejoining the rooms.
+
+    Outbound batching: with `batch_delay` (seconds) frames are collected
+    until the delay has passed or `batch_bytes` are waiting and then go out
+    in one write; `flush()` sends them at once and `send_many()` writes a
+    list of messages together in any mode. `nodelay=False` turns Nagle's
+    algorithm back on (asyncio disables it), and `cork=True` sets TCP_CORK
+    (Linux) while a batch is written, so it leaves in full segments even
+    when TLS splits it into records. With `on_messages` set, the TEXT and
+    BINARY messages of each read are handed over as one list instead of
+    one `on_message` call each.
+
+    When the connection ends other than through `close()`, `on_disconnect`
+    gets None for a clean close by the server, or the exception that
+    stopped the receive loop (a socket error, a bad frame or a callback
+    that raised); the exception is also logged and kept in `recv_error`.
+    """
+
+    def __init__(self, host='127.0.0.1', port=6000, use_ssl=False, cafile=None, token=None, max_frame=MAX_FRAME,
+                 name=None, nodes=None, batch_delay=0, batch_bytes=64 << 10, nodelay=True, cork=False):
+        self.host = host
+        self.port = port
+        self.nodes = [tuple(n) for n in nodes] if nodes else [(host, port)]
+        self.rooms = set()
+        self.use_ssl = use_ssl
+        self.cafile = cafile
+        self.token = token
+        self.max_frame = max_frame
+        self.name = name
+        self.peer_id = None
+        self.batch_delay = batch_delay
+        self.batch_bytes = batch_bytes
+        self.nodelay = nodelay
+        self.cork = cork and hasattr(socket, 'TCP_CORK')
+        self.on_message = None          # fn(str for TEXT, bytes for BINARY)
+        self.on_messages = None         # fn(list of those), instead of on_message
+        self.on_room_message = None     # fn(room, sender, msg)
+        self.on_direct_message = None   # fn(sender, msg)
+        self.on_presence = None         # fn(event dict)
+        self.on_error = None            # fn(str) for an ERROR frame from the server
+        self.on_disconnect = None       # fn(exception or None) once the server side is gone
+        self.last_error = None
+        self.recv_error = None          # exception that ended the receive loop, if any
+        self._reader = self._writer = None
+        self._recv_task = None
+        self._sock = None
+        self._out = []          # frames waiting for the batch to be flushed
+        self._out_bytes = 0
+        self._flush_handle = None
+
+    async def connect(self):
+        ctx = client_ssl_context(self.cafile) if self.use_ssl else None
+        start = self.nodes.index((self.host, self.port)) if (self.host, self.port) in self.nodes else 0
+        for i in range(len(self.nodes)):
+            host, port = self.nodes[(start + i) % len(self.nodes)]
+            try:
+                self._reader, self._writer = await asyncio.open_connection(
+                    host, port, ssl=ctx, server_hostname=host if ctx else None)
+                break
+            except OSError:
+                if i == len(self.nodes) - 1:
+                    raise
+        self.host, self.port = host, port
+        self._sock = self._writer.get_extra_info('socket')
+        if self._sock is not None and self._sock.family in (socket.AF_INET, socket.AF_INET6):
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(self.nodelay))
+        # send auth token first if provided
+        if self.token:
+            self._writer.write(encode_frame(AUTH, self.token.encode()))
+        self._writer.write(encode_frame(HELLO, (self.name or self.peer_id or '').encode()))
+        for room in self.rooms:
+            self._writer.write(encode_frame(JOIN, room.encode('utf-8')))
+        self._recv_task = asyncio.get_running_loop().create_task(self._recv_loop())
+
+    async def _recv_loop(self):
+        decoder = FrameDecoder(self.max_frame)
+        error = None
+        try:
+            while True:
+                raw = await self._reader.read(READ_SIZE)
+                if not raw:
+                    break
+                batch = [] if self.on_messages else None
+                for ftype, payload in decoder.feed(raw):
+                    if batch is not None and ftype in (TEXT, BINARY):
+                        batch.append(payload.decode('utf-8', 'replace') if ftype == TEXT else payload)
+                        continue
+                    if batch:
+                        # keep the order of the batch and the other callbacks
+                        result = self.on_messages(batch)
+                        if inspect.isawaitable(result):
+                            await result
+                        batch = []
+                    result = self._dispatch(ftype, payload)
+                    if inspect.isawaitable(result):
+                        await result
+                if batch:
+                    result = self.on_messages(batch)
+                    if inspect.isawaitable(result):
+                        await result
+        except Exception as e:
+            # a broken connection, a bad frame or a failing callback: either way
+            # nothing more is received on this connection
+            log.warning('collab client %s: receive loop stopped', self.peer_id or self.name, exc_info=True)
+            self.recv_error = error = e
+        if self.on_disconnect:
+            result = self.on_disconnect(error)
+            if inspect.isawaitable(result):
+                await result
+
+    def _dispatch(self, ftype, payload):
+        if ftype in (TEXT, BINARY):
+            if self.on_message:
+                return self.on_message(payload.decode('utf-8', 'replace') if ftype == TEXT else payload)
+        elif ftype in (ROOM, DIRECT):
+            kind, target, sender, body = parse_routed(payload)
+            msg = body.decode('utf-8', 'replace') if kind == TEXT else body
+            if ftype == ROOM and self.on_room_message:
+                return self.on_room_message(target, sender, msg)
+            if ftype == DIRECT and self.on_direct_message:
+                return self.on_direct_message(sender, msg)
+            if self.on_message:
+                return self.on_message(msg)
+        elif ftype == PRESENCE:
+            if self.on_presence:
+                return self.on_presence(json.loads(payload))
+        elif ftype == HELLO:
+            self.peer_id = payload.decode('utf-8', 'replace')
+        elif ftype == ERROR:
+            self.last_error = payload.decode('utf-8', 'replace')
+            if self.on_error:
+                return self.on_error(self.last_error)
+
+    def send(self, msg):
+        """Queue `msg` (str or bytes) for sending; `drain()` waits until the transport buffer is flushed."""
+        self._write(encode_message(msg))
+
+    def send_many(self, msgs):
+        """Send several messages with one write (or as part of the current batch)."""
+        self._write(b''.join([encode_message(msg) for msg in msgs]))
+
+    async def sendall(self, msg):
+        """`send` and wait until the message has been handed to the socket."""
+        self.send(msg)
+        await self.drain()
+
+    def _write(self, data):
+        if self._writer is None:
+            return
+        if not self.batch_delay:
+            self._writer.write(data)
+            return
+        self._out.append(data)
+        self._out_bytes += len(data)
+        if self._out_bytes >= self.batch_bytes:
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.batch_delay, self.flush)
+
+    def flush(self):
+        """Write out the batched frames now, in one write."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._out or self._writer is None:
+            return
+        data = b''.join(self._out) if len(self._out) > 1 else self._out[0]
+        self._out = []
+        self._out_bytes = 0
+        if self.cork and self._sock is not None:
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1)
+            self._writer.write(data)
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 0)
+        else:
+            self._writer.write(data)
+
+    def join(self, room):
+        self.rooms.add(room)
+        self._write(encode_frame(JOIN, room.encode('utf-8')))
+
+    def leave(self, room):
+        self.rooms.discard(room)
+        self._write(encode_frame(LEAVE, room.encode('utf-8')))
+
+    def send_to_room(self, room, msg):
+        """Send `msg` to the other members of `room`."""
+        self._write(encode_routed(ROOM, room, msg))
+
+    def send_direct(self, peer_id, msg):
+        """Send `msg` to one peer; an unknown id comes back as an ERROR frame."""
+        self._write(encode_routed(DIRECT, peer_id, msg))
+
+    async def drain(self):
+        self.flush()
+        if self._writer is not None:
+            await self._writer.drain()
+
+    async def close(self):
+        self.flush()
+        if self._recv_task is not None:
+            if self._recv_task is not asyncio.current_task():  # e.g. reconnect() from on_disconnect
+                self._recv_task.cancel()
+            self._recv_task = None
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except (OSError, asyncio.CancelledError):
+                pass
+            self._writer = None
+            self._sock = None
+
+    async def reconnect(self):
+        """Close the connection and connect to the next of `nodes` that answers."""
+        await self.close()
+        if len(self.nodes) > 1:
+            i = self.nodes.index((self.host, self.port)) if (self.host, self.port) in self.nodes else -1
+            self.host, self.port = self.nodes[(i + 1) % len(self.nodes)]
+        await self.connect()
@@ -0,0 +1,1104 @@
+"""
+Micro-benchmarks for Pluto components.
+Usage:
+  - Cipher backends: `python -m Pluto.bench cipher [--max-size 1G]`
+  - Vault write durability modes: `python -m Pluto.bench durability`
+  - Crash injection (SIGKILL mid-write, then verify): `python -m Pluto.bench crash`
+  - CLI cold start and vault construction: `python -m Pluto.bench startup [--importtime]`
+  - Supervisor with many dummy services: `python -m Pluto.bench supervisor [--services 1000] [--depth 4]`
+  - Service log capture and search: `python -m Pluto.bench logs [--lines 2000000]`
+  - Zygote vs exec spawning of Python services: `python -m Pluto.bench zygote [--services 50]`
+  - Kernel event dispatch, events/s by handler count: `python -m Pluto.bench kernel [--work io]`
+  - Kernel topic routing vs broadcast: `python -m Pluto.bench routing [--services 300]`
+  - Kernel event journal append/replay: `python -m Pluto.bench journal`
+  - Collab framing throughput by message size: `python -m Pluto.bench frames`
+  - Collab load, thread per client vs asyncio: `python -m Pluto.bench collab [--clients 500]`
+  - Collab room fan-out latency vs broadcast: `python -m Pluto.bench rooms [--clients 5000] [--rooms 500]`
+  - Collab cluster, cross-node fan-out: `python -m Pluto.bench cluster [--nodes 3]`
+  - Collab client write batching, Nagle/cork: `python -m Pluto.bench batching [--tls]`
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import shutil
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from Pluto import ciphers
+
+
+def _parse_size(text):
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+    text = text.strip().upper().rstrip('B')
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def _fmt_size(n):
+    for unit, size in (('G', 1 << 30), ('M', 1 << 20), ('K', 1 << 10)):
+        if n >= size:
+            return f"{n // size}{unit}"
+    return str(n)
+
+
+def _timeit(fn, min_time=0.2):
+    """Run `fn` until `min_time` has passed; return seconds per call."""
+    runs, start = 0, time.perf_counter()
+    while True:
+        fn()
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return elapsed / runs
+
+
+def _bytewise_xor(key, data):
+    # the original PrivacyVault._xor, kept as the baseline
+    return bytes(b ^ key[i % len(key)] for i, b in enumerate(data))
+
+
+def bench_cipher(args):
+    key = ciphers.FALLBACK_KEY
+    backends = {}
+    for name in ciphers.available():
+        cls = ciphers.CIPHERS[name]
+        backends[name] = cls(cls.generate_key() if name == 'fernet' else key)
+    sizes = [s for s in (1 << 10, 64 << 10, 1 << 20, 16 << 20, 256 << 20, 1 << 30)
+             if s <= _parse_size(args.max_size)]
+    print(f"{'backend':<12}" + ''.join(f"{_fmt_size(s):>12}" for s in sizes) + '   (MB/s, encrypt)')
+    rows = [('bytewise', lambda d: _bytewise_xor(key, d))]
+    rows += [(name, c.encrypt) for name, c in backends.items()]
+    for name, fn in rows:
+        cells = []
+        for size in sizes:
+            if name == 'bytewise' and size > 1 << 20:
+                cells.append(f"{'-':>12}")  # takes minutes per call
+                continue
+            data = os.urandom(size)
+            secs = _timeit(lambda: fn(data))
+            cells.append(f"{size / secs / 1e6:>12.1f}")
+        print(f"{name:<12}" + ''.join(cells))
+
+
+def _tmp_vault(root, backend, durability, **kw):
+    from Pluto.privacy import PrivacyVault
+    return PrivacyVault(key_path=os.path.join(root, 'key.key'), storage_dir=os.path.join(root, 'data'),
+                        backend=backend, durability=durability, **kw)
+
+
+def bench_durability(args):
+    payload = os.urandom(args.size)
+    print(f"{args.threads} threads x {args.writes} writes of {args.size} bytes")
+    for backend in ('file', 'pack'):
+        for mode in ('none', 'fsync', 'group'):
+            root = tempfile.mkdtemp(prefix='pluto-bench-')
+            try:
+                vault = _tmp_vault(root, backend, mode)
+
+                def writer(t):
+                    for i in range(args.writes):
+                        vault.store(f"t{t}-{i % 64}", payload)
+                threads = [threading.Thread(target=writer, args=(t,)) for t in range(args.threads)]
+                start = time.perf_counter()
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+                secs = time.perf_counter() - start
+                vault.close()
+                print(f"  {backend:<5} {mode:<6} {args.threads * args.writes / secs:>10.0f} writes/s")
+            finally:
+                shutil.rmtree(root, ignore_errors=True)
+
+
+def _crash_payload():
+    body = os.urandom(random.choice((10, 1000, 100000)))
+    return hashlib.sha256(body).digest() + body
+
+
+def _crash_child(root, backend, durability):
+    # keep overwriting a small set of names from several threads until killed
+    vault = _tmp_vault(root, backend, durability, cipher='xor')
+
+    def loop():
+        while True:
+            vault.store(f"blob{random.randrange(32)}", _crash_payload())
+    for _ in range(4):
+        threading.Thread(target=loop, daemon=True).start()
+    while True:
+        time.sleep(1)
+
+
+def bench_crash(args):
+    if args.child:
+        _crash_child(*args.child)
+        return
+    failures = 0
+    for backend in ('file', 'pack'):
+        for mode in ('none', 'fsync', 'group'):
+            root = tempfile.mkdtemp(prefix='pluto-crash-')
+            checked = torn = 0
+            try:
+                for _ in range(args.rounds):
+                    child = subprocess.Popen([sys.executable, '-m', 'Pluto.bench', 'crash',
+                                              '--child', root, backend, mode])
+                    time.sleep(random.uniform(0.2, 0.6))
+                    child.send_signal(signal.SIGKILL)
+                    child.wait()
+                    vault = _tmp_vault(root, backend, mode, cipher='xor')
+                    for name in vault.names():
+                        checked += 1
+                        try:
+                            blob = vault.retrieve(name)
+                            ok = hashlib.sha256(blob[32:]).digest() == blob[:32]
+                        except Exception:
+                            ok = False
+                        torn += not ok
+                    vault.close()
+                leftovers = [f for f in os.listdir(os.path.join(root, 'data')) if f.endswith('.tmp')]
+            finally:
+                shutil.rmtree(root, ignore_errors=True)
+            failures += torn + len(leftovers)
+            print(f"  {backend:<5} {mode:<6} rounds={args.rounds} blobs checked={checked} "
+                  f"torn={torn} stale tmp files={len(leftovers)}")
+    print('PASS' if not failures else 'FAIL')
+    if failures:
+        sys.exit(1)
+
+
+STARTUP_MODULES = ('Pluto.os', 'Pluto.shell', 'Pluto.cli')
+
+
+def _cold_start(code, runs):
+    """Median wall time in ms of a fresh interpreter running `code`."""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], check=True)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def _slowest_imports(module, top):
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                         capture_output=True, text=True, check=True).stderr
+    rows = []
+    for line in out.splitlines():
+        parts = line.split('|')
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            rows.append((int(parts[1]), parts[2].strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def bench_startup(args):
+    base = _cold_start('pass', args.runs)
+    print(f"interpreter alone: {base:.1f} ms (median of {args.runs})")
+    for module in STARTUP_MODULES:
+        ms = _cold_start(f'import {module}', args.runs)
+        print(f"  import {module:<12} {ms:>7.1f} ms  (+{ms - base:.1f} ms over bare python)")
+        if args.importtime:
+            for us, name in _slowest_imports(module, args.importtime):
+                print(f"      {us / 1000:>7.1f} ms  {name}")
+    ms = _cold_start('import tempfile; from Pluto.vfs import VFS; '
+                     'VFS(storage_dir=tempfile.mkdtemp(), key_path=tempfile.mktemp())', args.runs)
+    print(f"  import + first VFS()   {ms:>7.1f} ms")
+    from Pluto.vfs import VFS
+    root = tempfile.mkdtemp(prefix='pluto-bench-')
+    try:
+        key_path = os.path.join(root, 'key.key')
+        VFS(storage_dir=os.path.join(root, 'vfs0'), key_path=key_path).close()
+        n = [0]
+
+        def construct():
+            n[0] += 1
+            VFS(storage_dir=os.path.join(root, f'vfs{n[0] % 8}'), key_path=key_path).close()
+        print(f"  VFS() with cached key  {_timeit(construct) * 1000:>7.2f} ms")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def _raise_nofile(need):
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and soft < need:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (need if hard == resource.RLIM_INFINITY else min(need, hard), hard))
+
+
+def _wait_until(pred, timeout):
+    deadline = time.monotonic() + timeout
+    while not pred():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.001)
+    return True
+
+
+def bench_supervisor(args):
+    from Pluto.supervisor import Supervisor, RestartPolicy
+    _raise_nofile(args.services * 4 + 256)
+    sup = Supervisor()
+    cmd = ['/bin/sh', '-c', 'echo up; exec sleep 3600']
+    # ignores SIGTERM, so stop_all has to wait out the stage timeout and kill it
+    stubborn = ['/bin/sh', '-c', 'trap "" TERM; echo up; exec sleep 3600']
+    policy = RestartPolicy(jitter=0, max_restarts=None)
+    per_stage = -(-args.services // args.depth)
+    for i in range(args.services):
+        deps = [f"dummy{i - per_stage}"] if i >= per_stage else []
+        sup.register_service(f"dummy{i}", stubborn if i < args.stubborn else cmd, restart=True,
+                             policy=policy, depends_on=deps)
+    boot = sup.start_all()
+    services = list(sup.services.values())
+    ok = _wait_until(lambda: all(svc.get_logs(1) for svc in services), 60)
+    print(f"{args.services} services in {boot['stages']} stages: start_all {boot['seconds']:.2f}s "
+          f"({len(boot['failed'])} failed), all output seen{'' if ok else ' (TIMEOUT)'}, "
+          f"threads={threading.active_count()}")
+    start = time.perf_counter()
+    for svc in services:
+        svc.sample()
+    print(f"one /proc resource sampling pass: {(time.perf_counter() - start) * 1000:.1f} ms")
+    latencies = []
+    for svc in random.sample(services, min(args.kills, len(services))):
+        old = svc.process
+        t0 = time.perf_counter()
+        old.send_signal(signal.SIGKILL)
+        if _wait_until(lambda: svc.process is not old and svc.process is not None, 10):
+            latencies.append((time.perf_counter() - t0) * 1000 - policy.backoff * 1000)
+    if latencies:
+        latencies.sort()
+        print(f"crash -> restart ({len(latencies)} kills, excluding the {policy.backoff * 1000:.0f} ms "
+              f"restart delay): median {statistics.median(latencies):.1f} ms, max {latencies[-1]:.1f} ms")
+    down = sup.stop_all()
+    print(f"stop_all: {down['seconds']:.2f}s, {len(down['killed'])} killed after the "
+          f"{sup.stop_timeout:g}s stage timeout, threads={threading.active_count()}")
+
+
+def _list_log(lines, keep=1000):
+    # the original Service._read_output buffer, kept as the baseline
+    buf, lock = [], threading.Lock()
+    for line in lines:
+        with lock:
+            buf.append(line)
+            if len(buf) > keep:
+                buf.pop(0)
+
+
+def bench_logs(args):
+    from Pluto.servicelog import ServiceLog
+    lines = [f"2024-01-01T00:00:00 worker[{i % 97}] request {i} handled in {i % 1000} ms"
+             for i in range(args.lines)]
+    root = tempfile.mkdtemp(prefix='pluto-bench-')
+    try:
+        for label, make in (('list+pop(0)', None),
+                            ('ring', lambda: ServiceLog(args.keep)),
+                            ('ring+spill', lambda: ServiceLog(args.keep, spill_dir=os.path.join(root, 'spill')))):
+            start = time.perf_counter()
+            if make is None:
+                _list_log(lines, args.keep)
+            else:
+                log = make()
+                t0 = 1_700_000_000.0
+                for i, line in enumerate(lines):
+                    log.append(line, ts=t0 + i * 0.001)
+                log.flush()
+            secs = time.perf_counter() - start
+            print(f"  append {label:<12} {len(lines) / secs / 1e3:>8.0f} k lines/s")
+        print(f"  spilled: {log.stats()['segments']} segments, {_fmt_size(log.stats()['spilled_bytes'])}B")
+        reopened = ServiceLog(args.keep, spill_dir=os.path.join(root, 'spill'))
+        mid = t0 + len(lines) * 0.001 * 0.9
+        queries = (('tail 50', dict(tail=50)),
+                   ('tail 5000', dict(tail=5000)),
+                   ('since last 10%', dict(tail=None, since=mid)),
+                   ('grep oldest hit', dict(tail=1, grep='request 0 ')),
+                   ('regex, all hits', dict(tail=None, regex=r'in 99[0-9] ms')))
+        for label, kw in queries:
+            start = time.perf_counter()
+            found = len(reopened.query(**kw))
+            print(f"  query {label:<16} {(time.perf_counter() - start) * 1000:>8.1f} ms  ({found} lines)")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def _mem_kb(pid, field):
+    """`field` (e.g. 'Rss', 'Pss') of /proc/<pid>/smaps_rollup in KiB, 0 if unreadable."""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for row in f:
+                if row.startswith(field + ':'):
+                    return int(row.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def bench_zygote(args):
+    from Pluto.supervisor import Supervisor
+    cmd = [sys.executable, '-m', 'Pluto.services.worker', '--imports', args.imports]
+    print(f"{args.services} x {' '.join(cmd[1:])}")
+    for label, zygote in (('exec', False), ('zygote', True)):
+        sup = Supervisor(zygote=zygote, sample_interval=None)
+        if zygote:
+            t0 = time.perf_counter()
+            sup.zygote.spawn([sys.executable, '-m', 'this']).wait()  # warm the helper up front
+            print(f"  zygote helper started in {time.perf_counter() - t0:.2f}s")
+        for i in range(args.services):
+            sup.register_service(f"w{i}", cmd + ['--name', f"w{i}"])
+        services = list(sup.services.values())
+        start = time.perf_counter()
+        sup.start_all()
+        _wait_until(lambda: all(svc.get_logs(1) for svc in services), 120)
+        boot = time.perf_counter() - start
+        latencies = []
+        for svc in services[:args.restarts]:
+            old, seen = svc.process, len(svc.get_logs(None))
+            t0 = time.perf_counter()
+            old.kill()
+            _wait_until(lambda: svc.process is not old and len(svc.get_logs(None)) > seen, 30)
+            latencies.append((time.perf_counter() - t0) * 1000 - svc.policy.backoff * 1000)
+        pids = [svc.process.pid for svc in services]
+        if zygote:
+            pids.append(sup.zygote.helper.pid)
+        rss = sum(_mem_kb(pid, 'Rss') for pid in pids) / 1024
+        pss = sum(_mem_kb(pid, 'Pss') for pid in pids) / 1024
+        print(f"  {label:<7} all up in {boot:.2f}s, restart to first output: median "
+              f"{statistics.median(latencies):.0f} ms; total RSS {rss:.0f} MiB, PSS {pss:.0f} MiB")
+        sup.stop_all()
+        if zygote:
+            sup.zygote.close()
+
+
+def _kernel_work(kind):
+    if kind == 'io':
+        return lambda ev: time.sleep(0.0005)
+    if kind == 'cpu':
+        return _cpu_handler
+    return lambda ev: None
+
+
+def _cpu_handler(ev):
+    # module-level so Kernel(mode='process') can pickle it
+    return sum(range(2000))
+
+
+def _serial_dispatch(handlers, events):
+    # the original Kernel._loop: one thread, every handler called in turn
+    import queue
+    q = queue.Queue()
+
+    def loop():
+        while True:
+            ev = q.get()
+            if ev is None:
+                return
+            for h in handlers:
+                try:
+                    h(ev)
+                except Exception:
+                    pass
+    t = threading.Thread(target=loop)
+    t.start()
+    for i in range(events):
+        q.put(i)
+    q.put(None)
+    t.join()
+
+
+def bench_kernel(args):
+    from Pluto.kernel import Kernel
+    mode = 'process' if args.work == 'cpu' and args.processes else 'thread'
+    print(f"{args.events} events, '{args.work}' handlers ({mode} mode); events/s fully delivered")
+    print(f"{'handlers':>8} {'serial':>10} {'per-service queues':>20}   p95 handler ms / max queue depth")
+    for n in (1, 2, 4, 8, 16):
+        if n > args.max_handlers:
+            break
+        handlers = [_kernel_work(args.work) for _ in range(n)]
+        start = time.perf_counter()
+        _serial_dispatch(handlers, args.events)
+        serial = args.events / (time.perf_counter() - start)
+        kernel = Kernel(queue_size=args.queue_size, backpressure='block', processes=args.processes or None)
+        for i, h in enumerate(handlers):
+            kernel.register_service(f"s{i}", h, workers=args.workers, mode=mode)
+        kernel.start()
+        start = time.perf_counter()
+        for i in range(args.events):
+            kernel.emit_event(i)
+        kernel.join()
+        queued = args.events / (time.perf_counter() - start)
+        m = kernel.metrics()['s0']
+        kernel.stop()
+        print(f"{n:>8} {serial:>10.0f} {queued:>20.0f}   {m['latency']['p95_ms']:.2f} / {m['max_depth']}")
+
+
+def _routing_run(kernel, events, emit, batch):
+    kernel.start()
+    start = time.perf_counter()
+    if emit == 'many':
+        for i in range(0, len(events), batch):
+            kernel.emit_many(events[i:i + batch])
+    else:
+        for ev in events:
+            kernel.emit_event(ev)
+    kernel.join()
+    elapsed = time.perf_counter() - start
+    kernel.stop()
+    return len(events) / elapsed
+
+
+def bench_routing(args):
+    import fnmatch
+    from Pluto.kernel import Kernel
+    n = args.services
+    # a third each of exact, prefix and glob subscribers; events spread over all of them
+    patterns = [(f"svc{i}.state" if i % 3 == 0 else f"svc{i}.*" if i % 3 == 1 else f"svc{i}.*.crash")
+                for i in range(n)]
+    topics = [(f"svc{i}.state" if i % 3 == 0 else f"svc{i}.log" if i % 3 == 1 else f"svc{i}.w.crash")
+              for i in range(n)]
+    events = [{'topic': topics[i % n], 'n': i} for i in range(args.events)]
+    print(f"{n} services, {args.events} events over {n} topics; events/s fully delivered")
+
+    def filtered(pattern, counts):
+        match = re.compile(fnmatch.translate(pattern)).match
+
+        def handler(ev):
+            if match(ev['topic']):
+                counts.append(1)
+        return handler
+
+    runs = [('broadcast + filter in handler', 'one', True), ('topic routing, emit_event', 'one', False),
+            ('topic routing, emit_many', 'many', False)]
+    for label, emit, broadcast in runs:
+        counts = []
+        kernel = Kernel(queue_size=args.queue_size, backpressure='block')
+        for i, pattern in enumerate(patterns):
+            if broadcast:
+                kernel.register_service(f"s{i}", filtered(pattern, counts))
+            else:
+                kernel.register_service(f"s{i}", lambda ev, c=counts: c.append(1), topics=[pattern])
+        rate = _routing_run(kernel, events, emit, args.batch)
+        print(f"  {label:<32} {rate:>10.0f}   delivered {len(counts)}")
+
+
+def bench_journal(args):
+    from Pluto.journal import EventJournal
+    from Pluto.kernel import Kernel
+    root = tempfile.mkdtemp(prefix='pluto-journal-', dir=args.dir)
+    n = args.events
+    event = {'topic': 'svc.state', 'service': 'worker-17', 'state': 'running', 'pid': 4242}
+    print(f"{n} events of ~{len(json.dumps(event))} B in {root}")
+    try:
+        def run(label, durability, fn, count, **kw):
+            path = os.path.join(root, label.replace(' ', '-'))
+            j = EventJournal(path, durability=durability, **kw)
+            start = time.perf_counter()
+            fn(j)
+            j.flush()
+            elapsed = time.perf_counter() - start
+            print(f"  {label:<30} {count / elapsed:>10.0f} events/s")
+            return j
+
+        run('append, none', 'none', lambda j: [j.append(event, 'svc.state') for _ in range(n)], n)
+        j = run('append_many x1000, none', 'none',
+                lambda j: [j.append_many([('svc.state', event)] * 1000) for _ in range(n // 1000)], n // 1000 * 1000)
+        start = time.perf_counter()
+        replayed = sum(1 for _ in j.read(0))
+        print(f"  {'replay (read from 0)':<30} {replayed / (time.perf_counter() - start):>10.0f} events/s")
+        j.close()
+
+        def threaded(count):
+            def fn(j):
+                threads = [threading.Thread(target=lambda: [j.append(event, 'svc.state') for _ in range(count)])
+                           for _ in range(args.threads)]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+            return fn
+        few = max(1, args.sync_events // args.threads)
+        run(f'append, group, {args.threads} threads', 'group', threaded(few), few * args.threads)
+        run(f'append, fsync, {args.threads} threads', 'fsync', threaded(few), few * args.threads)
+
+        for journal in (None, os.path.join(root, 'kernel')):
+            kernel = Kernel(queue_size=4096, backpressure='block', journal=journal)
+            kernel.register_service('sink', lambda ev: None)
+            kernel.start()
+            start = time.perf_counter()
+            for _ in range(n // 1000):
+                kernel.emit_many([event] * 1000)
+            kernel.join()
+            elapsed = time.perf_counter() - start
+            kernel.stop()
+            label = 'kernel emit_many, ' + ('journal' if journal else 'no journal')
+            print(f"  {label:<30} {n // 1000 * 1000 / elapsed:>10.0f} events/s")
+            if kernel.journal is not None:
+                kernel.journal.close()
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def bench_frames(args):
+    import asyncio
+    from Pluto.aio import AsyncCollabClient, AsyncCollabServer
+    from Pluto.protocol import FrameDecoder, encode_message
+    sizes = [16, 256, 4096, 65536, 1 << 20]
+    print(f"{'size':>6} {'messages':>9} {'decode msg/s':>13} {'decode MB/s':>12} {'e2e msg/s':>11} {'e2e MB/s':>9}")
+
+    async def e2e(payload, count):
+        srv = AsyncCollabServer(port=0)
+        await srv.start()
+        sender, receiver = AsyncCollabClient(port=srv.port), AsyncCollabClient(port=srv.port)
+        got = [0]
+        done = asyncio.Event()
+
+        def on_message(m):
+            got[0] += 1
+            if got[0] == count:
+                done.set()
+        receiver.on_message = on_message
+        await sender.connect()
+        await receiver.connect()
+        while len(srv.clients) < 2:
+            await asyncio.sleep(0.001)
+        start = time.perf_counter()
+        for _ in range(count):
+            sender.send(payload)
+            if sender._writer.transport.get_write_buffer_size() > 4 << 20:
+                await sender.drain()
+        await asyncio.wait_for(done.wait(), args.timeout)
+        elapsed = time.perf_counter() - start
+        await sender.close()
+        await receiver.close()
+        await srv.stop()
+        return elapsed
+
+    for size in sizes:
+        count = min(args.max_messages, max(32, args.volume // size))
+        payload = os.urandom(size)
+        stream = b''.join([encode_message(payload)] * count)
+        decoder = FrameDecoder()
+        start = time.perf_counter()
+        n = 0
+        for i in range(0, len(stream), 1 << 16):
+            n += len(decoder.feed(stream[i:i + (1 << 16)]))
+        decode = time.perf_counter() - start
+        assert n == count
+        elapsed = asyncio.run(e2e(payload, count))
+        mb = count * size / 1e6
+        print(f"{_fmt_size(size):>6} {count:>9} {count / decode:>13.0f} {mb / decode:>12.1f} "
+              f"{count / elapsed:>11.0f} {mb / elapsed:>9.1f}")
+
+
+class _ThreadedPeers:
+    """The original thread-per-connection CollabServer/CollabClient, as a baseline."""
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(1024)
+        self.port = self.sock.getsockname()[1]
+        self.clients = []
+        self.lock = threading.Lock()
+        self.peers = []
+        self.received = 0
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+    def _accept_loop(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            with self.lock:
+                self.clients.append(conn)
+            threading.Thread(target=self._client_loop, args=(conn,), daemon=True).start()
+
+    def _client_loop(self, conn):
+        while True:
+            try:
+                raw = conn.recv(4096)
+            except OSError:
+                raw = b''
+            if not raw:
+                break
+            with self.lock:
+                for c in self.clients:
+                    if c is not conn:
+                        try:
+                            c.sendall(raw)
+                        except OSError:
+                            pass
+
+    def connect(self):
+        s = socket.create_connection(('127.0.0.1', self.port))
+        self.peers.append(s)
+        threading.Thread(target=self._recv_loop, args=(s,), daemon=True).start()
+
+    def _recv_loop(self, s):
+        while True:
+            try:
+                raw = s.recv(4096)
+            except OSError:
+                return
+            if not raw:
+                return
+            self.received += len(raw)  # += on an int is atomic enough for a counter under the GIL here
+
+    def close(self):
+        self.sock.close()
+        for c in self.peers + self.clients:
+            try:
+                c.shutdown(socket.SHUT_RDWR)  # wakes the threads blocked in recv()
+            except OSError:
+                pass
+            c.close()
+
+
+def _stalled_peer(port):
+    """A connected client that never reads, with a tiny receive window."""
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    s.connect(('127.0.0.1', port))
+    return s
+
+
+def bench_collab(args):
+    _raise_nofile(4 * (args.clients + args.stalled) + 256)
+    payload = b'x' * (args.size - 1) + b'\n'
+    expected = args.senders * args.messages * (args.clients - 1) * args.size
+    print(f"{args.clients} clients, {args.senders} senders x {args.messages} messages of {args.size} B "
+          f"(each delivered to {args.clients - 1} peers)")
+    if args.stalled:
+        print(f"plus {args.stalled} stalled peers that never read (asyncio slow-consumer policy: {args.policy})")
+    print(f"{'engine':<16} {'connect/s':>10} {'threads':>8} {'RSS MiB':>8} {'deliveries/s':>13}")
+    def report(label, base_rss, connect_s, threads, elapsed, received):
+        rate = received / args.size / elapsed
+        rss = (_mem_kb(os.getpid(), 'Rss') - base_rss) / 1024
+        note = '' if received >= expected else f"  (only {received * 100 // expected}% delivered)"
+        print(f"{label:<16} {args.clients / connect_s:>10.0f} {threads:>8} {rss:>8.1f} {rate:>13.0f}{note}")
+
+    base_rss = _mem_kb(os.getpid(), 'Rss')
+    peers = _ThreadedPeers()
+    start = time.perf_counter()
+    for _ in range(args.clients):
+        peers.connect()
+    stalled = [_stalled_peer(peers.port) for _ in range(args.stalled)]
+    _wait_until(lambda: len(peers.clients) == args.clients + args.stalled, 30)
+    connect_s = time.perf_counter() - start
+    threads = threading.active_count()
+    start = time.perf_counter()
+    for s in peers.peers[:args.senders]:
+        for _ in range(args.messages):
+            s.sendall(payload)
+    _wait_until(lambda: peers.received >= expected, args.timeout)
+    elapsed = time.perf_counter() - start
+    report('thread/client', base_rss, connect_s, threads, elapsed, peers.received)
+    for s in stalled:
+        s.close()
+    peers.close()
+    _wait_until(lambda: threading.active_count() <= 2, 10)
+
+    import asyncio
+    from Pluto.aio import AsyncCollabClient, AsyncCollabServer
+
+    async def run():
+        base_rss = _mem_kb(os.getpid(), 'Rss')
+        srv = AsyncCollabServer(port=0, slow_consumer=args.policy)
+        await srv.start()
+        received = [0]
+
+        def count(m):
+            received[0] += len(m)
+        clients = [AsyncCollabClient(port=srv.port) for _ in range(args.clients)]
+        start = time.perf_counter()
+        for c in clients:
+            c.on_message = count
+            await c.connect()
+        stalled = [_stalled_peer(srv.port) for _ in range(args.stalled)]
+        while len(srv.clients) < args.clients + args.stalled:
+            await asyncio.sleep(0.001)
+        connect_s = time.perf_counter() - start
+        text = payload.decode()
+        start = time.perf_counter()
+        deadline = start + args.timeout
+        for c in clients[:args.senders]:
+            for _ in range(args.messages):
+                c.send(text)
+            await c.drain()
+        while received[0] < expected and time.perf_counter() < deadline:
+            await asyncio.sleep(0.001)
+        elapsed = time.perf_counter() - start
+        report('asyncio', base_rss, connect_s, threading.active_count(), elapsed, received[0])
+        if args.stalled:
+            print(f"  slow consumers: {srv.stats()}")
+        for s in stalled:
+            s.close()
+        for c in clients:
+            await c.close()
+        await srv.stop()
+    asyncio.run(run())
+
+
+def _percentiles(samples):
+    samples = sorted(samples)
+    return [samples[min(len(samples) - 1, int(len(samples) * q))] * 1e3 for q in (0.5, 0.95, 0.99)]
+
+
+class _Fanout:
+    """Sends timestamped messages in bursts and times each one until its last recipient has it."""
+
+    HEADER = (f"{'delivery':<12} {'messages':>9} {'fan-out':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+              f"{'deliveries/s':>13}")
+
+    def __init__(self, burst, size, timeout):
+        self.burst = burst
+        self.size = size
+        self.timeout = timeout
+        self.pending = {}    # message id -> [sent at, deliveries left]
+        self.latencies = []
+
+    def got(self, msg):
+        entry = self.pending[msg[:msg.index(':')]]
+        entry[1] -= 1
+        if not entry[1]:
+            self.latencies.append(time.perf_counter() - entry[0])
+
+    def watch(self, client):
+        client.on_room_message = lambda room, sender, msg: self.got(msg)
+        client.on_message = self.got
+
+    async def measure(self, label, messages, fanout, send):
+        """`send(k, msg)` sends message `k`; prints one row and returns the seconds taken."""
+        import asyncio
+        self.pending.clear()
+        del self.latencies[:]
+        n = 0
+        start = time.perf_counter()
+        while n < messages:
+            burst = min(self.burst, messages - n)
+            for k in range(n, n + burst):
+                self.pending[str(k)] = [time.perf_counter(), fanout]
+                send(k, f"{k}:" + 'x' * self.size)
+            n += burst
+            deadline = time.perf_counter() + self.timeout
+            while len(self.latencies) < n and time.perf_counter() < deadline:
+                await asyncio.sleep(0)
+        elapsed = time.perf_counter() - start
+        p50, p95, p99 = _percentiles(self.latencies) if self.latencies else (0, 0, 0)
+        note = '' if len(self.latencies) == messages else f"  ({len(self.latencies)} of {messages} fully delivered)"
+        print(f"{label:<12} {messages:>9} {fanout:>8} {p50:>8.2f} {p95:>8.2f} {p99:>8.2f} "
+              f"{messages * fanout / elapsed:>13.0f}{note}")
+        return elapsed
+
+
+def bench_rooms(args):
+    _raise_nofile(2 * args.clients + 256)
+    import asyncio
+    from Pluto.aio import AsyncCollabClient, AsyncCollabServer
+
+    async def run():
+        srv = AsyncCollabServer(port=0, send_queue_bytes=16 << 20)
+        await srv.start()
+        fanout = _Fanout(args.burst, args.size, args.timeout)
+        clients = [AsyncCollabClient(port=srv.port, name=f"c{i}") for i in range(args.clients)]
+        start = time.perf_counter()
+        for c in clients:
+            fanout.watch(c)
+            await c.connect()
+        for i, c in enumerate(clients):
+            c.join(f"room{i % args.rooms}")
+        while sum(len(m) for m in srv.rooms.values()) < args.clients:
+            await asyncio.sleep(0.01)
+        print(f"{args.clients} clients in {args.rooms} rooms ({args.clients // args.rooms} members each), "
+              f"connected and joined in {time.perf_counter() - start:.1f}s")
+        print(_Fanout.HEADER)
+        members = args.clients // args.rooms
+        # one sender per room, rotating through the rooms
+        await fanout.measure('room', args.messages, members - 1,
+                             lambda k, m: clients[k % args.rooms].send_to_room(f"room{k % args.rooms}", m))
+        await fanout.measure('broadcast', args.broadcasts, args.clients - 1,
+                             lambda k, m: clients[k % args.rooms].send(m))
+        print(f"  server: {srv.stats()}")
+        for c in clients:
+            await c.close()
+        await srv.stop()
+    asyncio.run(run())
+
+
+def bench_cluster(args):
+    _raise_nofile(2 * args.clients + 64 * args.nodes + 256)
+    import asyncio
+    from Pluto.aio import AsyncCollabClient
+    from Pluto.cluster import AsyncClusterNode
+
+    async def scenario(label, nodes, spread):
+        cluster = []
+        for n in range(nodes):
+            node = AsyncClusterNode(port=0, node_id=f"n{n}", cluster_port=0, send_queue_bytes=16 << 20,
+                                    seeds=[cluster[0].addr] if cluster else ())
+            await node.start()
+            cluster.append(node)
+        while any(len(node.nodes) < nodes - 1 for node in cluster):
+            await asyncio.sleep(0.01)
+        fanout = _Fanout(args.burst, args.size, args.timeout)
+        clients = []
+        for i in range(args.clients):
+            # spread: each room has members on every node; else a room lives on one node
+            n = (i // args.rooms if spread else i % args.rooms) % nodes
+            c = AsyncCollabClient(port=cluster[n].port, name=f"c{i}")
+            fanout.watch(c)
+            await c.connect()
+            c.join(f"room{i % args.rooms}")
+            clients.append(c)
+        while any(len(node.members(f"room{r}")) < args.clients // args.rooms
+                  for node in cluster for r in range(args.rooms)):
+            await asyncio.sleep(0.01)
+        forwarded = sum(node.forwarded for node in cluster)
+        elapsed = await fanout.measure(
+            label, args.messages, args.clients // args.rooms - 1,
+            lambda k, m: clients[k % args.rooms].send_to_room(f"room{k % args.rooms}", m))
+        forwards = sum(node.forwarded for node in cluster) - forwarded
+        print(f"{'':<12} {forwards} node-to-node forwards ({forwards / elapsed:.0f}/s), "
+              f"{sum(node.duplicates for node in cluster)} duplicates dropped")
+        for c in clients:
+            await c.close()
+        for node in cluster:
+            await node.stop()
+
+    async def stream(label, cross):
+        # one sender streaming to one room member, on the same node or the next one
+        a = AsyncClusterNode(port=0, node_id='a', cluster_port=0)
+        await a.start()
+        b = AsyncClusterNode(port=0, node_id='b', cluster_port=0, seeds=[a.addr])
+        await b.start()
+        while not a.nodes or not b.nodes:
+            await asyncio.sleep(0.01)
+        received = [0]
+        sender = AsyncCollabClient(port=a.port)
+        receiver = AsyncCollabClient(port=(b if cross else a).port)
+        receiver.on_room_message = lambda room, who, msg: received.__setitem__(0, received[0] + 1)
+        for c in (sender, receiver):
+            await c.connect()
+        receiver.join('stream')
+        while len(a.members('stream')) < 1:
+            await asyncio.sleep(0.01)
+        msg = 'x' * args.size
+        start = time.perf_counter()
+        for i in range(args.stream):
+            sender.send_to_room('stream', msg)
+            if i % 1000 == 999:
+                await sender.drain()
+        deadline = time.perf_counter() + args.timeout
+        while received[0] < args.stream and time.perf_counter() < deadline:
+            await asyncio.sleep(0.001)
+        elapsed = time.perf_counter() - start
+        print(f"{label:<12} {received[0] / elapsed:>10.0f} msg/s {received[0] * args.size / elapsed / 1e6:>8.1f} MB/s")
+        for c in (sender, receiver):
+            await c.close()
+        await a.stop()
+        await b.stop()
+
+    async def run():
+        print(f"{args.clients} clients in {args.rooms} rooms ({args.clients // args.rooms} members each), "
+              f"{args.nodes} nodes on localhost sharing one event loop")
+        print(_Fanout.HEADER)
+        await scenario('1 node', 1, False)
+        await scenario('rooms local', args.nodes, False)
+        await scenario('rooms spread', args.nodes, True)
+        print(f"one sender to one room member, {args.stream} messages of {args.size} B:")
+        await stream('same node', False)
+        await stream('cross-node', True)
+    asyncio.run(run())
+
+
+def bench_batching(args):
+    from Pluto.collab import CollabClient, CollabServer
+    tmp = tempfile.mkdtemp(prefix='pluto-bench-')
+    tls = {}
+    if args.tls:
+        tls = {'certfile': os.path.join(tmp, 'cert.pem'), 'keyfile': os.path.join(tmp, 'key.pem')}
+    srv = CollabServer(port=0, use_ssl=args.tls, send_queue_bytes=64 << 20, **tls)
+    srv.start()
+    counts = {'messages': 0, 'callbacks': 0}
+
+    def one(msg):
+        counts['messages'] += 1
+        counts['callbacks'] += 1
+
+    def many(msgs):
+        counts['messages'] += len(msgs)
+        counts['callbacks'] += 1
+    print(f"{args.messages} messages of {args.size} B{' over TLS' if args.tls else ''}, one sender, one receiver")
+    print(f"{'sender':<34} {'receiver':<12} {'msg/s':>10} {'msgs/callback':>14}")
+    msg = 'x' * args.size
+
+    def run(label, send, options, receive):
+        sender = CollabClient(port=srv.port, use_ssl=args.tls, **options)
+        receiver = CollabClient(port=srv.port, use_ssl=args.tls)
+        if receive == 'list':
+            receiver.on_messages = many
+        else:
+            receiver.on_message = one
+        sender.connect()
+        receiver.connect()
+        _wait_until(lambda: len(srv.clients) == 2, 5)
+        counts.update(messages=0, callbacks=0)
+        start = time.perf_counter()
+        send(sender)
+        sender.flush()
+        _wait_until(lambda: counts['messages'] >= args.messages, args.timeout)
+        elapsed = time.perf_counter() - start
+        got = counts['messages']
+        note = '' if got >= args.messages else f"  (only {got} received)"
+        print(f"{label:<34} {receive:<12} {got / elapsed:>10.0f} {got / max(counts['callbacks'], 1):>14.1f}{note}")
+        sender.close()
+        receiver.close()
+        _wait_until(lambda: not srv.clients, 5)
+
+    def each(sender):
+        for _ in range(args.messages):
+            sender.send(msg)
+
+    def chunks(sender):
+        for i in range(0, args.messages, args.chunk):
+            sender.send_many([msg] * min(args.chunk, args.messages - i))
+
+    def loop_each(sender):
+        # the async client's own send(): straight onto the transport, or into its batch
+        async def go():
+            for i in range(args.messages):
+                sender.client.send(msg)
+                if i % 1000 == 999:
+                    await sender.client.drain()
+        sender._loop.run(go())
+
+    batched = {'batch_delay': args.delay}
+    run('send(), blocking', each, {}, 'per message')
+    run(f'send(), batch_delay={args.delay}', each, batched, 'per message')
+    run(f'send(), batch_delay={args.delay}', each, batched, 'list')
+    run(f'send_many() x {args.chunk}', chunks, {}, 'list')
+    run('async send()', loop_each, {}, 'list')
+    run('async send(), nodelay=False', loop_each, {'nodelay': False}, 'list')
+    run(f'async send(), batch_delay={args.delay}', loop_each, batched, 'list')
+    run(f'async send(), batched + cork', loop_each, dict(batched, cork=True), 'list')
+    srv.stop()
+    shutil.rmtree(tmp, ignore_errors=True)
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog='python -m Pluto.bench')
+    sub = p.add_subparsers(dest='cmd')
+    c = sub.add_parser('cipher', help='vault cipher backends, MB/s by payload size')
+    c.add_argument('--max-size', default='16M', help='largest payload, e.g. 256M or 1G')
+    c.set_defaults(func=bench_cipher)
+    d = sub.add_parser('durability', help='vault writes/s per backend and durability mode')
+    d.add_argument('--threads', type=int, default=16)
+    d.add_argument('--writes', type=int, default=200, help='writes per thread')
+    d.add_argument('--size', type=int, default=1024, help='payload bytes')
+    d.set_defaults(func=bench_durability)
+    k = sub.add_parser('crash', help='SIGKILL writers mid-write and check that no torn blob survives')
+    k.add_argument('--rounds', type=int, default=10, help='kills per backend/mode')
+    k.add_argument('--child', nargs=3, metavar=('ROOT', 'BACKEND', 'MODE'), help=argparse.SUPPRESS)
+    k.set_defaults(func=bench_crash)
+    s = sub.add_parser('startup', help='cold-start time of the CLI entry modules and VFS construction')
+    s.add_argument('--runs', type=int, default=10, help='interpreter launches per measurement')
+    s.add_argument('--importtime', type=int, nargs='?', const=10, default=0, metavar='N',
+                   help='also list the N slowest imports (cumulative) per module')
+    s.set_defaults(func=bench_startup)
+    v = sub.add_parser('supervisor', help='start, crash and restart many dummy services')
+    v.add_argument('--services', type=int, default=1000)
+    v.add_argument('--kills', type=int, default=50, help='services to SIGKILL and time the restart of')
+    v.add_argument('--depth', type=int, default=4, help='dependency stages')
+    v.add_argument('--stubborn', type=int, default=20, help='services that ignore SIGTERM')
+    v.set_defaults(func=bench_supervisor)
+    g = sub.add_parser('logs', help='service log append rate and history queries')
+    g.add_argument('--lines', type=int, default=2000000)
+    g.add_argument('--keep', type=int, default=1000, help='lines kept in memory')
+    g.set_defaults(func=bench_logs)
+    z = sub.add_parser('zygote', help='spawn latency and memory of exec vs zygote-forked Python services')
+    z.add_argument('--services', type=int, default=50)
+    z.add_argument('--restarts', type=int, default=10, help='services to kill and time the restart of')
+    z.add_argument('--imports', default='Pluto.vfs,Pluto.collab,cryptography.fernet',
+                   help='modules each service imports at startup')
+    z.set_defaults(func=bench_zygote)
+    e = sub.add_parser('kernel', help='kernel event bus events/s against handler count')
+    e.add_argument('--events', type=int, default=2000)
+    e.add_argument('--work', choices=('none', 'io', 'cpu'), default='io', help='what each handler does')
+    e.add_argument('--workers', type=int, default=1, help='worker threads per service')
+    e.add_argument('--processes', type=int, default=0, help='process pool size for --work cpu (0: threads)')
+    e.add_argument('--queue-size', type=int, default=1024)
+    e.add_argument('--max-handlers', type=int, default=16)
+    e.set_defaults(func=bench_kernel)
+    r = sub.add_parser('routing', help='kernel topic routing against broadcast-and-filter')
+    r.add_argument('--services', type=int, default=300)
+    r.add_argument('--events', type=int, default=30000)
+    r.add_argument('--batch', type=int, default=1000, help='events per emit_many call')
+    r.add_argument('--queue-size', type=int, default=4096)
+    r.set_defaults(func=bench_routing)
+    j = sub.add_parser('journal', help='kernel event journal append, fsync and replay rates')
+    j.add_argument('--events', type=int, default=200000)
+    j.add_argument('--threads', type=int, default=8, help='appending threads for the group/fsync runs')
+    j.add_argument('--sync-events', type=int, default=2000, help='events for the group/fsync runs')
+    j.add_argument('--dir', default=None, help='directory for the journal (default: system temp)')
+    j.set_defaults(func=bench_journal)
+    f = sub.add_parser('frames', help='collab framing: decode and loopback msgs/s and MB/s by message size')
+    f.add_argument('--volume', type=int, default=64 << 20, help='bytes sent per message size')
+    f.add_argument('--max-messages', type=int, default=200000)
+    f.add_argument('--timeout', type=float, default=120.0)
+    f.set_defaults(func=bench_frames)
+    o = sub.add_parser('collab', help='collab connections and message fan-out: thread per client vs asyncio')
+    o.add_argument('--clients', type=int, default=500)
+    o.add_argument('--senders', type=int, default=10)
+    o.add_argument('--messages', type=int, default=1000, help='messages per sender')
+    o.add_argument('--size', type=int, default=64, help='message bytes')
+    o.add_argument('--timeout', type=float, default=60.0)
+    o.add_argument('--stalled', type=int, default=0, help='extra peers that connect but never read')
+    o.add_argument('--policy', choices=('drop', 'coalesce', 'disconnect'), default='drop',
+                   help='asyncio slow-consumer policy')
+    o.set_defaults(func=bench_collab)
+    m = sub.add_parser('rooms', help='collab room fan-out latency percentiles, against broadcast to everyone')
+    m.add_argument('--clients', type=int, default=5000)
+    m.add_argument('--rooms', type=int, default=500)
+    m.add_argument('--messages', type=int, default=20000, help='room messages')
+    m.add_argument('--broadcasts', type=int, default=200, help='broadcast messages, for comparison')
+    m.add_argument('--burst', type=int, default=50, help='messages in flight at a time')
+    m.add_argument('--size', type=int, default=64, help='message bytes')
+    m.add_argument('--timeout', type=float, default=30.0, help='seconds to wait for a burst')
+    m.set_defaults(func=bench_rooms)
+    u = sub.add_parser('cluster', help='collab cluster nodes on localhost: cross-node room fan-out')
+    u.add_argument('--nodes', type=int, default=3)
+    u.add_argument('--clients', type=int, default=1500)
+    u.add_argument('--rooms', type=int, default=150)
+    u.add_argument('--messages', type=int, default=10000, help='room messages per scenario')
+    u.add_argument('--stream', type=int, default=200000, help='messages for the one-to-one stream')
+    u.add_argument('--burst', type=int, default=50, help='messages in flight at a time')
+    u.add_argument('--size', type=int, default=64, help='message bytes')
+    u.add_argument('--timeout', type=float, default=30.0, help='seconds to wait for a burst')
+    u.set_defaults(func=bench_cluster)
+    b = sub.add_parser('batching', help='collab client write batching, send_many, Nagle/cork and list callbacks')
+    b.add_argument('--messages', type=int, default=100000)
+    b.add_argument('--size', type=int, default=32, help='message bytes')
+    b.add_argument('--delay', type=float, default=0.001, help='batch_delay for the batched runs, seconds')
+    b.add_argument('--chunk', type=int, default=100, help='messages per send_many() call')
+    b.add_argument('--tls', action='store_true')
+    b.add_argument('--timeout', type=float, default=60.0)
+    b.set_defaults(func=bench_batching)
+    args = p.parse_args(argv)
+    if not getattr(args, 'func', None):
+        p.print_help()
+        return
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,754 @@
+"""
+Blob storage backends for PrivacyVault.
+
+`FileStore` keeps the original layout (one `{name}.dat` file per blob).
+`PackStore` appends blobs to a few large segment files, keeps an offset index
+in memory (persisted to `pack.idx`) and compacts dead space in the background.
+Both also offer `open_writer`/`open_reader` for streaming large blobs.
+
+Writes never leave a torn blob behind: FileStore writes a temp file and
+renames it into place, PackStore drops a partial or corrupt tail record
+(CRC-checked) on recovery. `durability` decides when data reaches the disk:
+'none' leaves it to the OS, 'fsync' syncs every write, and 'group' lets
+concurrent writers share fsyncs: whoever arrives while one runs is covered
+by the next (for FileStore, the directory fsync; each writer syncs its own
+temp file).
+
+Both stores keep a generation counter (`.generation`) current around their
+writes, so indexes kept beside the blobs can tell whether anything wrote to
+the store since they last synced with it (see `Pluto.pathindex`).
+"""
+import os
+import json
+import logging
+import mmap
+import itertools
+import struct
+import threading
+import zlib
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# record header: name length, payload length, flags
+_REC = struct.Struct('>HIB')
+_CRC = struct.Struct('>I')
+_TOMBSTONE = 1
+_HAS_CRC = 2      # payload is followed by its CRC32
+
+DURABILITY = ('none', 'fsync', 'group')
+
+log = logging.getLogger(__name__)
+
+
+def _fsync_dir(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return  # e.g. directories cannot be opened on Windows
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class _Generation:
+    """Counter in `storage_dir/.generation`.
+
+    `claim()` takes the next value. A store instance claims one before its
+    first write, and checks again before and after every later write: if
+    anyone claimed a value since (an index syncing with the store, or
+    another writer), it claims a new one. So while the counter still reads
+    the value an index claimed, nothing else has written to the store.
+    """
+
+    FILE = '.generation'
+    _seq = itertools.count()  # unique temp names across instances
+
+    def __init__(self, storage_dir, durable=False):
+        self.path = os.path.join(storage_dir, self.FILE)
+        self.durable = durable
+        self._lock = threading.Lock()
+        self._mine = None
+
+    def read(self):
+        try:
+            with open(self.path, 'r') as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            return 0
+
+    def bump(self):
+        if self._mine is None or self.read() != self._mine:
+            self.claim()
+
+    def claim(self):
+        with self._lock, open(self.path + '.lock', 'a') as lock:
+            if fcntl is not None:
+                # other processes read-modify-write the same counter
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            value = self.read() + 1
+            tmp = f"{self.path}.{os.getpid()}-{next(self._seq)}.tmp"
+            with open(tmp, 'w') as f:
+                f.write(str(value))
+                if self.durable:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+            self._mine = value
+            return value
+
+
+class GroupCommitter:
+    """Collects commits from concurrent writers and flushes them together.
+
+    `commit(item)` blocks until a batch containing `item` was passed to
+    `flush(batch)`. A writer that finds no flush running flushes right away,
+    taking every pending item with it; writers that arrive meanwhile wait,
+    and the first of them flushes all of them once the running flush is
+    done. So an idle writer pays one fsync, and under load one fsync covers
+    everyone who arrived during the previous one. If the flush raises,
+    every writer in that batch gets the exception.
+    """
+
+    def __init__(self, flush):
+        self.flush = flush
+        self._cond = threading.Condition()
+        self._pending = []
+        self._flushing = False
+        self._closed = False
+
+    def commit(self, item):
+        slot = [False, None]  # done, error
+        with self._cond:
+            if self._closed:
+                raise ValueError('commit on a closed store')
+            self._pending.append((item, slot))
+            while not slot[0]:
+                if self._flushing:
+                    self._cond.wait()
+                    continue
+                self._flushing = True
+                batch, self._pending = self._pending, []
+                error = RuntimeError('group flush interrupted')
+                self._cond.release()
+                try:
+                    self.flush([item for item, _ in batch])
+                    error = None
+                except Exception as e:
+                    error = e
+                finally:
+                    self._cond.acquire()
+                    self._flushing = False
+                    for _, done in batch:
+                        done[0], done[1] = True, error
+                    self._cond.notify_all()
+        if slot[1] is not None:
+            raise slot[1]
+
+    def close(self):
+        """Wait for the running flush; later commits raise ValueError."""
+        with self._cond:
+            self._closed = True
+            while self._flushing or self._pending:
+                self._cond.wait()
+
+
+class FileReader:
+    """Positional reads from a blob file."""
+
+    def __init__(self, path):
+        self._fd = os.open(path, os.O_RDONLY)
+        self.size = os.fstat(self._fd).st_size
+
+    def pread(self, offset, n):
+        return os.pread(self._fd, n, offset)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class ViewReader:
+    """Positional reads from an in-memory blob (bytes or memoryview)."""
+
+    def __init__(self, buf):
+        self.buf = buf
+        self.size = len(buf)
+
+    def pread(self, offset, n):
+        return self.buf[offset:offset + n]
+
+    def close(self):
+        pass
+
+
+class _PackSpool:
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+        import tempfile
+        self._spool = tempfile.TemporaryFile(dir=store.storage_dir)
+
+    def write(self, data):
+        return self._spool.write(data)
+
+    def abort(self):
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+
+    def close(self):
+        if self._spool is None:
+            return
+        try:
+            self._spool.flush()
+            self.store._append_spool(self.name, self._spool)
+        finally:
+            self._spool.close()
+            self._spool = None
+
+
+class _AtomicWriter:
+    """Write to a temp file; close() renames it over the final path."""
+
+    def __init__(self, store, name):
+        self.store = store
+        self.final = store._path(name)
+        self.tmp = f"{self.final}.{os.getpid()}-{next(store._seq)}.tmp"
+        self._file = open(self.tmp, 'wb')
+
+    def write(self, data):
+        return self._file.write(data)
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.remove(self.tmp)
+        except OSError:
+            pass
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.store._commit(self)
+
+
+class FileStore:
+    """One encrypted blob per file: `storage_dir/{name}.dat`."""
+
+    def __init__(self, storage_dir, durability='none'):
+        if durability not in DURABILITY:
+            raise ValueError(f"durability must be one of {DURABILITY}")
+        self.storage_dir = storage_dir
+        self.durability = durability
+        os.makedirs(self.storage_dir, exist_ok=True)
+        self._seq = itertools.count()
+        self._committer = GroupCommitter(self._flush_group) if durability == 'group' else None
+        self._generation = _Generation(storage_dir, durability != 'none')
+        self._remove_stale_tmp()
+
+    def _path(self, name):
+        return os.path.join(self.storage_dir, f"{name}.dat")
+
+    def _remove_stale_tmp(self):
+        # temp files of writers that died before renaming: `{name}.dat.{pid}-{n}.tmp`
+        for f in Path(self.storage_dir).glob('*.tmp'):
+            try:
+                pid = int(f.suffixes[-2][1:].split('-')[0])
+                os.kill(pid, 0)
+                continue  # writer still alive
+            except (IndexError, ValueError):
+                continue  # not one of ours
+            except ProcessLookupError:
+                pass
+            except PermissionError:
+                continue
+            try:
+                f.unlink()
+            except OSError:
+                pass
+
+    def put(self, name, data):
+        w = _AtomicWriter(self, name)
+        try:
+            w.write(data)
+        except BaseException:
+            w.abort()
+            raise
+        w.close()
+
+    def _commit(self, w):
+        f = w._file
+        self._generation.bump()
+        try:
+            if self.durability != 'none':
+                # in group mode too: writers sync their own file in parallel,
+                # the committer only shares the directory fsync
+                f.flush()
+                os.fsync(f.fileno())
+        except BaseException:
+            w.abort()
+            raise
+        f.close()
+        if self.durability == 'group':
+            self._committer.commit(w)
+        else:
+            os.replace(w.tmp, w.final)
+            if self.durability == 'fsync':
+                _fsync_dir(self.storage_dir)
+        self._generation.bump()
+
+    def _flush_group(self, batch):
+        # batch is in commit order, so the last writer of a name wins
+        for w in batch:
+            os.replace(w.tmp, w.final)
+        _fsync_dir(self.storage_dir)
+
+    def get(self, name):
+        try:
+            with open(self._path(name), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            raise KeyError(name)
+
+    def open_writer(self, name):
+        return _AtomicWriter(self, name)
+
+    def open_reader(self, name):
+        try:
+            return FileReader(self._path(name))
+        except FileNotFoundError:
+            raise KeyError(name)
+
+    def delete(self, name):
+        # Also remove `name.dat.dat` variants created by past bugs
+        self._generation.bump()
+        removed = False
+        for candidate in (f"{name}.dat", f"{name}.dat.dat"):
+            full = os.path.join(self.storage_dir, candidate)
+            if os.path.exists(full):
+                os.remove(full)
+                removed = True
+        self._generation.bump()
+        if not removed:
+            raise KeyError(name)
+
+    def names(self):
+        return [f.stem for f in Path(self.storage_dir).glob('*.dat')]
+
+    def generation(self, claim=False):
+        """Current generation; it moves whenever a write follows a claim.
+
+        `claim=True` takes a new generation for the caller, so every other
+        store instance moves it again on its next write.
+        """
+        return self._generation.claim() if claim else self._generation.read()
+
+    def stamp(self, name):
+        """Cheap change marker for cache validation."""
+        try:
+            st = os.stat(self._path(name))
+        except FileNotFoundError:
+            raise KeyError(name)
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def __contains__(self, name):
+        return os.path.exists(self._path(name))
+
+    def sync(self, names):
+        """fsync the given blobs and the directory entries pointing at them."""
+        if self.durability != 'none':
+            return  # every write was already made durable
+        for name in names:
+            try:
+                fd = os.open(self._path(name), os.O_RDONLY)
+            except FileNotFoundError:
+                continue
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        _fsync_dir(self.storage_dir)
+
+    def close(self):
+        if self._committer is not None:
+            self._committer.close()
+
+
+class PackStore:
+    """Append-only segment files with an in-memory offset index.
+
+    Each record is `header | name | payload | crc32`; deletes append a tombstone.
+    Overwritten and deleted records are dead space which `compact()` reclaims
+    by rewriting live records into a fresh segment. Reads slice an mmap of the
+    segment, so a hot read returns a view without copying the payload.
+
+    Single process only: append offsets come from the open segment handle
+    and the index lives in memory, so two processes (or two PackStore
+    instances) on one directory would overwrite each other's records.
+    """
+
+    INDEX_FILE = 'pack.idx'
+
+    def __init__(self, storage_dir, segment_size=64 * 1024 * 1024, compact_ratio=0.5, auto_compact=True,
+                 save_every=10000, durability='none'):
+        if durability not in DURABILITY:
+            raise ValueError(f"durability must be one of {DURABILITY}")
+        self.storage_dir = storage_dir
+        self.durability = durability
+        self.segment_size = segment_size
+        self.compact_ratio = compact_ratio
+        self.auto_compact = auto_compact
+        self.save_every = save_every
+        os.makedirs(self.storage_dir, exist_ok=True)
+        self.index = {}       # name -> (segment id, payload offset, payload length)
+        self.dead_bytes = 0
+        self.total_bytes = 0
+        self._maps = {}       # segment id -> mmap
+        self._lock = threading.RLock()
+        self._compacting = False
+        self._compact_lock = threading.Lock()
+        self._unsaved = 0
+        self._committer = GroupCommitter(self._flush_group) if durability == 'group' else None
+        self._generation = _Generation(storage_dir, durability != 'none')
+        self._load()
+        self._open_active()
+
+    # -- segment files -----------------------------------------------------
+
+    def _seg_path(self, seg):
+        return os.path.join(self.storage_dir, f"seg-{seg:06d}.pack")
+
+    def _segments(self):
+        segs = []
+        for f in Path(self.storage_dir).glob('seg-*.pack'):
+            try:
+                segs.append(int(f.stem[4:]))
+            except ValueError:
+                pass
+        return sorted(segs)
+
+    def _open_active(self):
+        segs = self._segments()
+        self.active = segs[-1] if segs else 0
+        self._file = open(self._seg_path(self.active), 'ab')
+
+    def _roll(self):
+        self._sync_active()
+        self._file.close()
+        self.active += 1
+        self._file = open(self._seg_path(self.active), 'ab')
+
+    def _map(self, seg, end):
+        mm = self._maps.get(seg)
+        if mm is None or len(mm) < end:
+            with open(self._seg_path(seg), 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[seg] = mm
+        return mm
+
+    # -- index persistence ---------------------------------------------------
+
+    def _load(self):
+        scanned = {}
+        path = os.path.join(self.storage_dir, self.INDEX_FILE)
+        try:
+            with open(path, 'r') as f:
+                saved = json.load(f)
+            self.index = {k: tuple(v) for k, v in saved['index'].items()}
+            self.dead_bytes = saved['dead_bytes']
+            self.total_bytes = saved['total_bytes']
+            scanned = {int(k): v for k, v in saved['segments'].items()}
+        except (OSError, ValueError, KeyError):
+            self.index, self.dead_bytes, self.total_bytes = {}, 0, 0
+        segs = self._segments()
+        if any(s not in segs for s in scanned):
+            # a segment vanished under us: the saved index is stale
+            self.index, self.dead_bytes, self.total_bytes, scanned = {}, 0, 0, {}
+        # catch up on records appended after the index was last saved
+        for seg in segs:
+            self._scan(seg, scanned.get(seg, 0), tail=seg == segs[-1])
+        for f in Path(self.storage_dir).glob('seg-*.pack.tmp'):
+            f.unlink()  # an interrupted compaction; its sources are still here
+
+    def _scan(self, seg, start, tail=True):
+        """Index the records of `seg` from `start` on.
+
+        Only the tail segment can hold an interrupted append, so only it is
+        truncated at the first bad record. In a sealed segment a record
+        whose CRC does not match is skipped (and logged); its neighbours
+        stay readable.
+        """
+        path = self._seg_path(seg)
+        size = os.path.getsize(path)
+        if start >= size:
+            return
+        with open(path, 'rb') as f:
+            f.seek(start)
+            pos = start
+            while pos + _REC.size <= size:
+                nlen, dlen, flags = _REC.unpack(f.read(_REC.size))
+                crc_len = _CRC.size if flags & _HAS_CRC else 0
+                end = pos + _REC.size + nlen + dlen + crc_len
+                if end > size:
+                    break
+                name = f.read(nlen)
+                if crc_len:
+                    data = f.read(dlen)
+                    if _CRC.unpack(f.read(crc_len))[0] != zlib.crc32(data):
+                        if tail:
+                            break
+                        log.warning('%s: skipping corrupt record at offset %d', path, pos)
+                        self.total_bytes += end - pos
+                        self.dead_bytes += end - pos
+                        pos = end
+                        continue
+                else:
+                    f.seek(dlen, os.SEEK_CUR)
+                data_off = pos + _REC.size + nlen
+                loc = None if flags & _TOMBSTONE else (seg, data_off, dlen)
+                self._account(name.decode('utf-8'), loc, end - pos)
+                pos = end
+        if pos < size:
+            if not tail:
+                log.warning('%s: unreadable records after offset %d left in place', path, pos)
+                return
+            # torn or corrupt record from an interrupted append: drop it
+            with open(path, 'r+b') as f:
+                f.truncate(pos)
+
+    def _account(self, name, loc, rec_len):
+        old = self.index.pop(name, None)
+        if old is not None:
+            self.dead_bytes += _REC.size + len(name.encode('utf-8')) + old[2] + _CRC.size
+        if loc is None:
+            self.dead_bytes += rec_len
+        else:
+            self.index[name] = loc
+        self.total_bytes += rec_len
+        self._unsaved += 1
+
+    def save_index(self):
+        with self._lock:
+            self._file.flush()
+            state = {
+                'index': self.index,
+                'dead_bytes': self.dead_bytes,
+                'total_bytes': self.total_bytes,
+                'segments': {s: os.path.getsize(self._seg_path(s)) for s in self._segments()},
+            }
+            path = os.path.join(self.storage_dir, self.INDEX_FILE)
+            tmp = path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp, path)
+            self._unsaved = 0
+
+    # -- blob API ----------------------------------------------------------
+
+    def _append(self, name, data, flags=0):
+        bname = name.encode('utf-8')
+        if self._file.tell() >= self.segment_size:
+            self._roll()
+        pos = self._file.tell()
+        self._file.write(_REC.pack(len(bname), len(data), flags | _HAS_CRC) + bname)
+        self._file.write(data)
+        self._file.write(_CRC.pack(zlib.crc32(data)))
+        self._file.flush()
+        data_off = pos + _REC.size + len(bname)
+        return (self.active, data_off, len(data)), data_off + len(data) + _CRC.size - pos
+
+    def _make_durable(self):
+        if self.durability == 'fsync':
+            with self._lock:
+                self._sync_active()
+        elif self.durability == 'group':
+            self._committer.commit(None)
+
+    def _flush_group(self, batch):
+        # a dup'ed fd stays valid even if the segment rolls meanwhile;
+        # rolled segments were synced by _roll
+        with self._lock:
+            fd = os.dup(self._file.fileno())
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def put(self, name, data):
+        self._generation.bump()
+        with self._lock:
+            loc, rec_len = self._append(name, data)
+            self._account(name, loc, rec_len)
+        self._generation.bump()
+        self._make_durable()
+        self._after_write()
+
+    def get(self, name):
+        """Return a read-only memoryview of the stored payload."""
+        with self._lock:
+            try:
+                seg, off, length = self.index[name]
+            except KeyError:
+                raise KeyError(name)
+            mm = self._map(seg, off + length)
+        return memoryview(mm)[off:off + length]
+
+    def open_writer(self, name):
+        """Spool to a temp file that is appended as one record on close()."""
+        return _PackSpool(self, name)
+
+    def _append_spool(self, name, spool):
+        self._generation.bump()
+        with self._lock:
+            size = os.fstat(spool.fileno()).st_size
+            spool.seek(0)
+            bname = name.encode('utf-8')
+            if self._file.tell() >= self.segment_size:
+                self._roll()
+            pos = self._file.tell()
+            self._file.write(_REC.pack(len(bname), size, _HAS_CRC) + bname)
+            crc = 0
+            for block in iter(lambda: spool.read(1 << 20), b''):
+                crc = zlib.crc32(block, crc)
+                self._file.write(block)
+            self._file.write(_CRC.pack(crc))
+            self._file.flush()
+            data_off = pos + _REC.size + len(bname)
+            self._account(name, (self.active, data_off, size), data_off + size + _CRC.size - pos)
+        self._generation.bump()
+        self._make_durable()
+        self._after_write()
+
+    def open_reader(self, name):
+        return ViewReader(self.get(name))
+
+    def delete(self, name):
+        with self._lock:
+            if name not in self.index:
+                raise KeyError(name)
+            self._generation.bump()
+            _, rec_len = self._append(name, b'', _TOMBSTONE)
+            self._account(name, None, rec_len)
+        self._generation.bump()
+        self._make_durable()
+        self._after_write()
+
+    def names(self):
+        with self._lock:
+            return list(self.index)
+
+    def generation(self, claim=False):
+        return self._generation.claim() if claim else self._generation.read()
+
+    def stamp(self, name):
+        try:
+            return self.index[name]
+        except KeyError:
+            raise KeyError(name)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def _sync_active(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def sync(self, names=None):
+        """fsync the active segment; one call covers every record appended so far."""
+        if self.durability != 'none':
+            return
+        with self._lock:
+            self._sync_active()
+
+    # -- compaction ----------------------------------------------------------
+
+    def _after_write(self):
+        # the index can always be rebuilt by scanning, saving just bounds the scan
+        if self.save_every and self._unsaved >= self.save_every:
+            self.save_index()
+        if not self.auto_compact or self._compacting:
+            return
+        if self.total_bytes and self.dead_bytes / self.total_bytes >= self.compact_ratio \
+                and self.dead_bytes >= self.segment_size // 4:
+            self._compacting = True
+            threading.Thread(target=self.compact, daemon=True).start()
+
+    def compact(self):
+        """Rewrite live records into a fresh segment and delete the old ones.
+
+        Only the start and the final swap take the store lock: records are
+        copied while reads and writes go on. The copy gets the segment id
+        just below the new active segment, so anything written meanwhile
+        still wins on recovery; records that changed during the copy keep
+        their new location and their copy counts as dead space.
+        """
+        with self._compact_lock:
+            try:
+                self._compact()
+            finally:
+                self._compacting = False
+
+    def _compact(self):
+        with self._lock:
+            old = self._segments()
+            live = list(self.index.items())
+            self._roll()
+            target = self.active
+            self._roll()
+        path = self._seg_path(target)
+        tmp = path + '.tmp'
+        moved = {}
+        maps = {}
+        try:
+            with open(tmp, 'wb') as f:
+                for name, (seg, off, length) in live:
+                    mm = maps.get(seg)
+                    if mm is None:
+                        # old segments are sealed: our own maps, no lock needed
+                        with open(self._seg_path(seg), 'rb') as sf:
+                            mm = maps[seg] = mmap.mmap(sf.fileno(), 0, access=mmap.ACCESS_READ)
+                    data = mm[off:off + length]
+                    bname = name.encode('utf-8')
+                    pos = f.tell()
+                    f.write(_REC.pack(len(bname), length, _HAS_CRC) + bname)
+                    f.write(data)
+                    f.write(_CRC.pack(zlib.crc32(data)))
+                    moved[name] = (seg, off, length), (target, pos + _REC.size + len(bname), length)
+                # live data must be on disk before the old copies go away
+                f.flush()
+                os.fsync(f.fileno())
+        finally:
+            for mm in maps.values():
+                mm.close()
+        os.replace(tmp, path)
+        _fsync_dir(self.storage_dir)
+        with self._lock:
+            for name, (was, now) in moved.items():
+                if self.index.get(name) == was:
+                    self.index[name] = now
+            for seg in old:
+                # open views keep their mmap alive; we only drop our handle
+                self._maps.pop(seg, None)
+                try:
+                    os.remove(self._seg_path(seg))
+                except OSError:
+                    pass
+            self.total_bytes = sum(os.path.getsize(self._seg_path(s)) for s in self._segments())
+            self.dead_bytes = self.total_bytes - sum(
+                _REC.size + len(name.encode('utf-8')) + length + _CRC.size
+                for name, (_, _, length) in self.index.items())
+            self.save_index()
+
+    def close(self):
+        if self._committer is not None:
+            self._committer.close()  # its flush takes self._lock
+        with self._lock:
+            self.save_index()
+            self._file.close()
+            self._maps.clear()
@@ -0,0 +1,98 @@
+"""
+Cipher backends for PrivacyVault.
+
+`FernetCipher` is the real one. The XOR ciphers are the demo fallback for
+images without `cryptography`; they are not secure, but they work on whole
+buffers instead of one byte at a time: `XorCipher` XORs 1 MiB blocks as big
+integers, `NumpyXorCipher` uses NumPy's vectorised XOR when NumPy is present.
+Both XOR ciphers produce the same output as the original per-byte fallback.
+"""
+import importlib.util
+
+FALLBACK_KEY = b'pluto-fallback-key-16'
+_BLOCK = 1 << 20
+
+
+class FernetCipher:
+    name = 'fernet'
+
+    def __init__(self, key: bytes):
+        from cryptography.fernet import Fernet
+        self._fernet = Fernet(key)
+
+    @staticmethod
+    def generate_key() -> bytes:
+        from cryptography.fernet import Fernet
+        return Fernet.generate_key()
+
+    def encrypt(self, data) -> bytes:
+        return self._fernet.encrypt(bytes(data))
+
+    def decrypt(self, token) -> bytes:
+        # Fernet only takes bytes; memoryviews (pack store) are copied here, once
+        return self._fernet.decrypt(bytes(token))
+
+
+class XorCipher:
+    """Repeating-key XOR over whole blocks, in place on writable buffers."""
+
+    name = 'xor'
+
+    def __init__(self, key: bytes):
+        self.key = key
+        # keystream block whose length is a multiple of the key, so every
+        # block starts at key offset 0
+        self._keystream = key * (-(-_BLOCK // len(key)))
+        self._keystream_int = int.from_bytes(self._keystream, 'little')
+
+    @staticmethod
+    def generate_key() -> bytes:
+        return FALLBACK_KEY
+
+    def xor_into(self, buf):
+        mv = memoryview(buf).cast('B')
+        step = len(self._keystream)
+        for off in range(0, len(mv), step):
+            chunk = mv[off:off + step]
+            n = len(chunk)
+            ks = self._keystream_int if n == step else int.from_bytes(self._keystream[:n], 'little')
+            chunk[:] = (int.from_bytes(chunk, 'little') ^ ks).to_bytes(n, 'little')
+
+    def encrypt(self, data) -> bytes:
+        buf = bytearray(data)
+        self.xor_into(buf)
+        return bytes(buf)
+
+    decrypt = encrypt
+
+
+class NumpyXorCipher(XorCipher):
+    name = 'xor-numpy'
+
+    def __init__(self, key: bytes):
+        import numpy
+        super().__init__(key)
+        self._np = numpy
+        self._ks = numpy.frombuffer(self._keystream, dtype=numpy.uint8)
+
+    def xor_into(self, buf):
+        np = self._np
+        arr = np.frombuffer(buf, dtype=np.uint8)
+        step = len(self._ks)
+        for off in range(0, len(arr), step):
+            part = arr[off:off + step]
+            np.bitwise_xor(part, self._ks[:len(part)], out=part)
+
+
+CIPHERS = {c.name: c for c in (FernetCipher, XorCipher, NumpyXorCipher)}
+
+
+def available():
+    """Names of the cipher backends usable in this interpreter."""
+    names = []
+    if importlib.util.find_spec('cryptography') is not None:
+        names.append(FernetCipher.name)
+    if importlib.util.find_spec('numpy') is not None:
+        names.append(NumpyXorCipher.name)
+    names.append(XorCipher.name)
+    return names
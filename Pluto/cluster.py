@@ -0,0 +1,401 @@
+"""
+Clustered Collab servers: several nodes form a mesh and share one set of
+peers, rooms and broadcasts.
+
+An `AsyncClusterNode` is an `AsyncCollabServer` that also listens on
+`cluster_port` for links from other nodes and dials the ones in `seeds`.
+The NODE handshake carries every address a node knows of, so dialing one
+seed is enough for a new node to get linked to all the others. Over a
+link a node sends INTEREST updates (its peers and their room
+memberships), and each node keeps that per link: a room message is then
+forwarded once to each node that has members in the room, a direct
+message only to the node of its peer, and a broadcast to the nodes that
+have clients. Forwarded messages are delivered locally and never relayed.
+Every FORWARD carries a message ID (the origin's per-start id and a
+sequence number); IDs seen recently are remembered so copies are dropped.
+
+A pair of nodes keeps one link, the one dialed by the node with the
+smaller id, and dialers retry with backoff, so a node that restarts joins
+again; its clients reconnect to any node (`AsyncCollabClient(nodes=...)`).
+A link whose send queue outgrows `link_queue_bytes` is dropped rather than
+losing frames, and the new link starts with the full INTEREST state.
+
+Links are authenticated both ways with `cluster_token`, which defaults to
+the client `auth_token`: the dialer sends it first and the accepting node
+answers with its own only once the dialer's matched. A node whose clients
+must authenticate refuses to run an open mesh. With `use_ssl` the links
+use TLS as well: the cluster port serves the node's certificate and
+dialers check the other node's against `cluster_cafile` (default: the
+node's own certificate, for nodes sharing one).
+"""
+import asyncio
+import hmac
+import json
+import os
+from collections import OrderedDict
+
+from Pluto.aio import READ_SIZE, AsyncCollabServer
+from Pluto.collab import client_ssl_context
+from Pluto.protocol import (AUTH, DIRECT, ERROR, FORWARD, INTEREST, NODE, ROOM, FrameDecoder, ProtocolError,
+                            encode_frame, forward_frame, parse_forward)
+
+SEEN = 1 << 16         # message IDs remembered for duplicate suppression
+RETRY = (0.05, 2.0)    # dial backoff bounds, seconds
+
+
+class _Remote:
+    """A linked node and what it has told us about its peers."""
+
+    __slots__ = ('link', 'dialer', 'addr', 'peers', 'rooms')
+
+    def __init__(self, link, dialer, addr):
+        self.link = link        # _Peer wrapping the link's writer and send queue
+        self.dialer = dialer    # id of the node that dialed the link
+        self.addr = addr
+        self.peers = set()
+        self.rooms = {}         # room -> peer ids in it
+
+
+class AsyncClusterNode(AsyncCollabServer):
+    def __init__(self, host='127.0.0.1', port=6000, use_ssl=False, certfile=None, keyfile=None, auth_token=None,
+                 node_id=None, cluster_port=7000, seeds=(), cluster_token=None, cluster_cafile=None,
+                 link_queue_bytes=64 << 20, **options):
+        super().__init__(host, port, use_ssl, certfile, keyfile, auth_token, **options)
+        if cluster_token is None:
+            cluster_token = auth_token
+        if auth_token and not cluster_token:
+            raise ValueError("cluster_token is required when clients must authenticate (auth_token is set)")
+        self.node_id = node_id or os.urandom(4).hex()
+        self.id_prefix = f"{self.node_id}.peer"
+        self.cluster_port = cluster_port
+        self.seeds = [tuple(a) for a in seeds]
+        self.cluster_token = cluster_token
+        self.cluster_cafile = cluster_cafile or self.certfile
+        self.link_queue_bytes = link_queue_bytes
+        self.origin = f"{self.node_id}/{os.urandom(4).hex()}"   # message ID prefix, new on every start
+        self.addr = None
+        self.nodes = {}          # node id -> _Remote, for the link in use
+        self.remote_peers = {}   # peer id -> node id
+        self.remote_rooms = {}   # room -> {peer id: node id}
+        self._room_nodes = {}    # room -> {node id: members there}
+        self._seq = 0
+        self._outbox = {}        # node id -> FORWARD frames waiting for the end of this loop pass
+        self._seen = OrderedDict()
+        self._known = set()      # cluster addresses of other nodes
+        self._addr_nodes = {}    # cluster address -> node id, once a handshake told us
+        self._dialers = {}       # cluster address -> dial task
+        self._links = set()      # writers of accepted links
+        self._cluster = None
+        self.forwarded = 0
+        self.received = 0
+        self.duplicates = 0
+
+    async def start(self):
+        await super().start()
+        self._cluster = await asyncio.start_server(self._accept_link, self.host, self.cluster_port,
+                                                   ssl=self._ssl_context, backlog=self.backlog,
+                                                   reuse_address=True)
+        if not self.cluster_port:
+            self.cluster_port = self._cluster.sockets[0].getsockname()[1]
+        self.addr = (self.host, self.cluster_port)
+        for addr in self.seeds:
+            self._learn(addr)
+
+    # -- links -----------------------------------------------------------------
+
+    def _learn(self, addr):
+        if addr != self.addr and addr not in self._known:
+            self._known.add(addr)
+            self._dialers[addr] = asyncio.get_running_loop().create_task(self._dial_loop(addr))
+
+    def _linked(self, addr):
+        node_id = self._addr_nodes.get(addr)
+        return node_id == self.node_id or node_id in self.nodes
+
+    def _link_ssl_context(self):
+        if not self.use_ssl:
+            return None
+        ctx = client_ssl_context(self.cluster_cafile)
+        # nodes are told apart by the certificate they present, not by host name
+        ctx.check_hostname = False
+        return ctx
+
+    async def _dial_loop(self, addr):
+        ctx = self._link_ssl_context()
+        delay = RETRY[0]
+        while True:
+            if self._addr_nodes.get(addr) == self.node_id:
+                return  # our own address under another name
+            if self._linked(addr):
+                # the link the other node dialed is in use
+                await asyncio.sleep(RETRY[1])
+                continue
+            try:
+                reader, writer = await asyncio.open_connection(*addr, ssl=ctx)
+            except OSError:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RETRY[1])
+                continue
+            delay = RETRY[0]
+            if self.cluster_token:
+                writer.write(encode_frame(AUTH, self.cluster_token.encode()))
+            writer.write(self._hello())
+            await self._link_loop(reader, writer, addr)
+            await asyncio.sleep(delay)
+
+    async def _accept_link(self, reader, writer):
+        self._links.add(writer)
+        try:
+            await self._link_loop(reader, writer, None)
+        finally:
+            self._links.discard(writer)
+
+    def _hello(self):
+        return encode_frame(NODE, json.dumps({'id': self.node_id, 'addr': list(self.addr),
+                                              'known': [list(a) for a in self._known]}).encode())
+
+    async def _link_loop(self, reader, writer, addr):
+        """Serve one link; `addr` is the address we dialed, None for an accepted link."""
+        decoder = FrameDecoder(self.max_frame)
+        token = self.cluster_token.encode() if self.cluster_token else None
+        authed = token is None
+        if addr is None and authed:
+            writer.write(self._hello())
+        link = None
+        try:
+            while True:
+                raw = await reader.read(READ_SIZE)
+                if not raw:
+                    break
+                for ftype, payload in decoder.feed(raw):
+                    if not authed:
+                        # the first frame must carry the token, in both directions
+                        if ftype != AUTH or not hmac.compare_digest(payload.strip(), token):
+                            if addr is None:
+                                writer.write(encode_frame(ERROR, b'auth'))
+                            return
+                        authed = True
+                        if addr is None:
+                            writer.write(encode_frame(AUTH, token) + self._hello())
+                    elif link is None:
+                        if ftype != NODE:
+                            return
+                        link = self._handshake(json.loads(payload), writer, addr)
+                        if link is None:
+                            return
+                    else:
+                        remote = self.nodes.get(link.id)
+                        if remote is None or remote.link is not link:
+                            return  # replaced by the other link to that node
+                        if ftype == FORWARD:
+                            self._forwarded(payload)
+                        elif ftype == INTEREST:
+                            self._interest(link.id, remote, json.loads(payload))
+        except (OSError, ProtocolError, ValueError, KeyError, TypeError, IndexError):
+            pass
+        finally:
+            if link is not None:
+                link.task.cancel()
+                remote = self.nodes.get(link.id)
+                if remote is not None and remote.link is link:
+                    self._drop_node(link.id)
+            writer.close()
+
+    def _handshake(self, hello, writer, addr):
+        node_id = hello['id']
+        node_addr = tuple(hello['addr'])
+        self._addr_nodes[node_addr] = node_id
+        if addr is not None:
+            self._addr_nodes[addr] = node_id
+        if node_id == self.node_id:
+            return None
+        self._learn(node_addr)
+        for a in hello.get('known', ()):
+            self._learn(tuple(a))
+        dialer = self.node_id if addr is not None else node_id
+        current = self.nodes.get(node_id)
+        if current is not None:
+            # keep the link dialed by the smaller node id; both ends pick the same one
+            if current.dialer <= dialer:
+                return None
+            self._drop_node(node_id)
+            current.link.transport.close()
+        # a dropped INTEREST frame would leave the membership views apart for
+        # good; dropping the link instead makes the redial resync them in full
+        link = self._new_peer(writer, node_id, self.link_queue_bytes, 'disconnect')
+        self.nodes[node_id] = _Remote(link, dialer, node_addr)
+        ops = [['peer', peer_id] for peer_id in self.peers]
+        ops += [['join', room, peer.id] for room, members in self.rooms.items() for peer in members]
+        self._deliver(link, encode_frame(INTEREST, json.dumps(ops).encode()))
+        return link
+
+    def _drop_node(self, node_id):
+        remote = self.nodes.pop(node_id)
+        for room, peer_ids in list(remote.rooms.items()):
+            for peer_id in list(peer_ids):
+                self._remote_leave(node_id, remote, room, peer_id)
+        for peer_id in remote.peers:
+            if self.remote_peers.get(peer_id) == node_id:
+                del self.remote_peers[peer_id]
+
+    # -- interest ----------------------------------------------------------------
+
+    def _announce(self, ops):
+        if self.nodes:
+            frame = encode_frame(INTEREST, json.dumps(ops).encode())
+            for remote in self.nodes.values():
+                self._deliver(remote.link, frame)
+
+    def _interest(self, node_id, remote, ops):
+        for op in ops:
+            if op[0] == 'peer':
+                remote.peers.add(op[1])
+                self.remote_peers[op[1]] = node_id
+            elif op[0] == 'unpeer':
+                remote.peers.discard(op[1])
+                if self.remote_peers.get(op[1]) == node_id:
+                    del self.remote_peers[op[1]]
+            elif op[0] == 'join':
+                self._remote_join(node_id, remote, op[1], op[2])
+            elif op[0] == 'leave':
+                self._remote_leave(node_id, remote, op[1], op[2])
+
+    def _remote_join(self, node_id, remote, room, peer_id):
+        peer_ids = remote.rooms.setdefault(room, set())
+        if peer_id in peer_ids:
+            return
+        self._presence(room, {'event': 'join', 'room': room, 'peer': peer_id})
+        peer_ids.add(peer_id)
+        self.remote_rooms.setdefault(room, {})[peer_id] = node_id
+        counts = self._room_nodes.setdefault(room, {})
+        counts[node_id] = counts.get(node_id, 0) + 1
+
+    def _remote_leave(self, node_id, remote, room, peer_id):
+        peer_ids = remote.rooms.get(room)
+        if not peer_ids or peer_id not in peer_ids:
+            return
+        peer_ids.discard(peer_id)
+        if not peer_ids:
+            del remote.rooms[room]
+        members = self.remote_rooms[room]
+        del members[peer_id]
+        if not members:
+            del self.remote_rooms[room]
+        counts = self._room_nodes[room]
+        counts[node_id] -= 1
+        if not counts[node_id]:
+            del counts[node_id]
+            if not counts:
+                del self._room_nodes[room]
+        self._presence(room, {'event': 'leave', 'room': room, 'peer': peer_id})
+
+    # -- local peers, announced to the other nodes -------------------------------
+
+    def _join(self, writer):
+        peer = super()._join(writer)
+        self._announce([['peer', peer.id]])
+        return peer
+
+    def _leave_all(self, peer):
+        super()._leave_all(peer)
+        self._announce([['unpeer', peer.id]])
+
+    def _rename(self, peer, name):
+        old = peer.id
+        super()._rename(peer, name)
+        self._announce([['unpeer', old], ['peer', name]])
+
+    def _name_taken(self, name):
+        return name in self.peers or name in self.remote_peers
+
+    def join_room(self, peer, room):
+        if not super().join_room(peer, room):
+            return False
+        self._announce([['join', room, peer.id]])
+        return True
+
+    def leave_room(self, peer, room):
+        if not super().leave_room(peer, room):
+            return False
+        self._announce([['leave', room, peer.id]])
+        return True
+
+    def members(self, room):
+        return super().members(room) + list(self.remote_rooms.get(room, ()))
+
+    # -- forwarding ----------------------------------------------------------------
+
+    def _publish(self, kind, target, data, exclude=None):
+        if kind == ROOM:
+            super()._publish(kind, target, data, exclude)
+            nodes = self._room_nodes.get(target)
+            if nodes:
+                self._forward(nodes, kind, target, data)
+        elif kind == DIRECT:
+            if super()._publish(kind, target, data):
+                return True
+            node_id = self.remote_peers.get(target)
+            if node_id is None:
+                return False
+            self._forward((node_id,), kind, target, data)
+        else:
+            super()._publish(kind, target, data, exclude)
+            self._forward([n for n, remote in self.nodes.items() if remote.peers], kind, '', data)
+        return True
+
+    def _forward(self, node_ids, kind, target, data):
+        if not node_ids:
+            return
+        self._seq += 1
+        frame = forward_frame(kind, self.origin, self._seq, target, data)
+        if not self._outbox:
+            asyncio.get_running_loop().call_soon(self._flush_links)
+        for node_id in node_ids:
+            self._outbox.setdefault(node_id, []).append(frame)
+            self.forwarded += 1
+
+    def _flush_links(self):
+        # everything forwarded while handling one batch of reads goes out as one write per link
+        outbox, self._outbox = self._outbox, {}
+        for node_id, frames in outbox.items():
+            remote = self.nodes.get(node_id)
+            if remote is not None:
+                self._deliver(remote.link, b''.join(frames))
+
+    def _forwarded(self, payload):
+        kind, origin, seq, target, data = parse_forward(payload)
+        key = (origin, seq)
+        if key in self._seen:
+            self.duplicates += 1
+            return
+        self._seen[key] = None
+        if len(self._seen) > SEEN:
+            self._seen.popitem(last=False)
+        self.received += 1
+        super()._publish(kind, target, data)  # local clients only, never relayed
+
+    def stats(self):
+        stats = super().stats()
+        stats.update(node=self.node_id, nodes=sorted(self.nodes), remote_peers=len(self.remote_peers),
+                     forwarded=self.forwarded, received=self.received, duplicates=self.duplicates)
+        return stats
+
+    async def stop(self):
+        for task in self._dialers.values():
+            task.cancel()
+        self._dialers = {}
+        if self._cluster is not None:
+            self._cluster.close()
+        for writer in list(self._links):
+            writer.close()
+        for remote in list(self.nodes.values()):
+            remote.link.task.cancel()
+            remote.link.writer.close()
+        self.nodes = {}
+        if self._cluster is not None:
+            try:
+                await asyncio.wait_for(self._cluster.wait_closed(), 2)
+            except asyncio.TimeoutError:
+                pass
+            self._cluster = None
+        await super().stop()
@@ -1,210 +1,238 @@
 """
 Collaboration module — simple TCP-based server and client for peer messages.
 Demonstrates coordination and messaging between PlutoOS peers.
+
+The engine is `AsyncCollabServer` / `AsyncCollabClient` in `Pluto.aio`;
+`CollabServer` and `CollabClient` are blocking front ends that run them on
+one shared background event loop, so thousands of peers cost one thread
+rather than a thread (and stack) each. Messages travel as length-prefixed
+frames (`Pluto.protocol`), so each `send` arrives as exactly one message.
+Callbacks such as `on_message` run on that loop's thread: there, sends and
+`members()`/`stats()` work as usual (sends are scheduled rather than waited
+for), while calls that have to wait, like `connect` or `close`, raise
+RuntimeError.
 """
-import socket
-import threading
-import ssl
 import os
-from cryptography import x509
-from cryptography.x509.oid import NameOID
-from cryptography.hazmat.primitives import hashes, serialization
-from cryptography.hazmat.primitives.asymmetric import rsa
-from cryptography.hazmat.primitives import serialization as crypto_serialization
-from cryptography.hazmat.primitives.serialization import NoEncryption
-from cryptography.hazmat.backends import default_backend
+import ssl
+import threading
 import datetime
 
+
+def generate_self_signed(certfile: str, keyfile: str, common_name: str = 'PlutoLocal'):
+    # imported here: the x509 stack is slow to load and only needed for TLS
+    from cryptography import x509
+    from cryptography.x509.oid import NameOID
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.hazmat.backends import default_backend
+    # generate RSA key
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+    # subject / issuer
+    subject = issuer = x509.Name([
+        x509.NameAttribute(NameOID.COUNTRY_NAME, u"US"),
+        x509.NameAttribute(NameOID.STATE_OR_PROVINCE_NAME, u"CA"),
+        x509.NameAttribute(NameOID.LOCALITY_NAME, u"Pluto"),
+        x509.NameAttribute(NameOID.ORGANIZATION_NAME, u"PlutoOS"),
+        x509.NameAttribute(NameOID.COMMON_NAME, common_name),
+    ])
+    cert = x509.CertificateBuilder().subject_name(subject).issuer_name(issuer).public_key(
+        key.public_key()
+    ).serial_number(x509.random_serial_number()).not_valid_before(
+        datetime.datetime.utcnow() - datetime.timedelta(days=1)
+    ).not_valid_after(
+        datetime.datetime.utcnow() + datetime.timedelta(days=3650)
+    ).add_extension(
+        x509.SubjectAlternativeName([x509.DNSName(common_name)]), critical=False,
+    ).sign(key, hashes.SHA256(), default_backend())
+
+    # write key
+    with open(keyfile, 'wb') as f:
+        f.write(key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.TraditionalOpenSSL,
+            encryption_algorithm=serialization.NoEncryption()
+        ))
+
+    # write cert
+    with open(certfile, 'wb') as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+
+
+def server_ssl_context(certfile=None, keyfile=None):
+    """`(context, certfile, keyfile)` for a TLS server; a self-signed pair is generated if missing."""
+    # ensure cert/key exist; generate self-signed if files missing or not provided
+    os.makedirs('vault/ssl', exist_ok=True)
+    if not certfile:
+        certfile = 'vault/ssl/pluto-cert.pem'
+    if not keyfile:
+        keyfile = 'vault/ssl/pluto-key.pem'
+    if not (os.path.exists(certfile) and os.path.exists(keyfile)):
+        generate_self_signed(certfile, keyfile)
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ctx.load_cert_chain(certfile, keyfile)
+    return ctx, certfile, keyfile
+
+
+def client_ssl_context(cafile=None):
+    ctx = ssl.create_default_context()
+    if cafile:
+        ctx.load_verify_locations(cafile)
+    else:
+        ctx.check_hostname = False
+        ctx.verify_mode = ssl.CERT_NONE
+    return ctx
+
+
 class CollabServer:
-    def __init__(self, host='127.0.0.1', port=6000, use_ssl=False, certfile=None, keyfile=None, auth_token=None):
-        self.host = host
-        self.port = port
-        self.use_ssl = use_ssl
-        self.certfile = certfile
-        self.keyfile = keyfile
-        self.auth_token = auth_token
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.clients = []
-        self.lock = threading.Lock()
-        self._running = False
-        self._ssl_context = None
-        if self.use_ssl:
-            # ensure cert/key exist; generate self-signed if files missing or not provided
-            os.makedirs('vault/ssl', exist_ok=True)
-            if not self.certfile:
-                self.certfile = 'vault/ssl/pluto-cert.pem'
-            if not self.keyfile:
-                self.keyfile = 'vault/ssl/pluto-key.pem'
-            if not (os.path.exists(self.certfile) and os.path.exists(self.keyfile)):
-                self._generate_self_signed(self.certfile, self.keyfile)
-            ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
-            ctx.load_cert_chain(self.certfile, self.keyfile)
-            self._ssl_context = ctx
-
-    def _generate_self_signed(self, certfile: str, keyfile: str, common_name: str = 'PlutoLocal'):
-        # generate RSA key
-        key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
-        # subject / issuer
-        subject = issuer = x509.Name([
-            x509.NameAttribute(NameOID.COUNTRY_NAME, u"US"),
-            x509.NameAttribute(NameOID.STATE_OR_PROVINCE_NAME, u"CA"),
-            x509.NameAttribute(NameOID.LOCALITY_NAME, u"Pluto"),
-            x509.NameAttribute(NameOID.ORGANIZATION_NAME, u"PlutoOS"),
-            x509.NameAttribute(NameOID.COMMON_NAME, common_name),
-        ])
-        cert = x509.CertificateBuilder().subject_name(subject).issuer_name(issuer).public_key(
-            key.public_key()
-        ).serial_number(x509.random_serial_number()).not_valid_before(
-            datetime.datetime.utcnow() - datetime.timedelta(days=1)
-        ).not_valid_after(
-            datetime.datetime.utcnow() + datetime.timedelta(days=3650)
-        ).add_extension(
-            x509.SubjectAlternativeName([x509.DNSName(common_name)]), critical=False,
-        ).sign(key, hashes.SHA256(), default_backend())
-
-        # write key
-        with open(keyfile, 'wb') as f:
-            f.write(key.private_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PrivateFormat.TraditionalOpenSSL,
-                encryption_algorithm=serialization.NoEncryption()
-            ))
-
-        # write cert
-        with open(certfile, 'wb') as f:
-            f.write(cert.public_bytes(serialization.Encoding.PEM))
+    def __init__(self, host='127.0.0.1', port=6000, use_ssl=False, certfile=None, keyfile=None, auth_token=None,
+                 **options):
+        """`options` go to `AsyncCollabServer` (e.g. `slow_consumer`, `send_queue_bytes`); with
+        `cluster_port` (and `node_id`, `seeds`, ...) the server is an `AsyncClusterNode`."""
+        from Pluto.aio import AsyncCollabServer, background_loop
+        if 'cluster_port' in options:
+            from Pluto.cluster import AsyncClusterNode as AsyncCollabServer
+        self.server = AsyncCollabServer(host, port, use_ssl, certfile, keyfile, auth_token, **options)
+        self._loop = background_loop()
+
+    def __getattr__(self, name):
+        # host, port, use_ssl, certfile, ... live on the async server
+        return getattr(self.server, name)
+
+    @property
+    def clients(self):
+        return list(self.server.clients)
 
     def start(self):
-        self.sock.bind((self.host, self.port))
-        self.sock.listen(5)
-        self._running = True
-        threading.Thread(target=self._accept_loop, daemon=True).start()
-
-    def _accept_loop(self):
-        while self._running:
-            try:
-                conn, addr = self.sock.accept()
-                # wrap with SSL if enabled
-                if self._ssl_context:
-                    try:
-                        conn = self._ssl_context.wrap_socket(conn, server_side=True)
-                    except Exception:
-                        conn.close()
-                        continue
-                with self.lock:
-                    self.clients.append(conn)
-                threading.Thread(target=self._client_loop, args=(conn, addr), daemon=True).start()
-            except Exception:
-                pass
-
-    def _client_loop(self, conn, addr):
-        try:
-            with conn:
-                # first message may be auth token if server expects it
-                if self.auth_token:
-                    raw = conn.recv(4096)
-                    if not raw:
-                        return
-                    token = raw.decode().strip()
-                    if token != self.auth_token:
-                        try:
-                            conn.sendall(b'ERR auth')
-                        except Exception:
-                            pass
-                        return
-                while True:
-                    raw = conn.recv(4096)
-                    if not raw:
-                        break
-                    msg = raw.decode()
-                    self.broadcast(msg, exclude=conn)
-        finally:
-            with self.lock:
-                if conn in self.clients:
-                    self.clients.remove(conn)
+        self._loop.run(self.server.start())
 
     def broadcast(self, msg, exclude=None):
-        with self.lock:
-            for c in list(self.clients):
-                if c is exclude:
-                    continue
-                try:
-                    c.sendall(msg.encode())
-                except Exception:
-                    try:
-                        c.close()
-                    except:
-                        pass
-                    if c in self.clients:
-                        self.clients.remove(c)
+        self._loop.call(self.server.broadcast, msg, exclude)
+
+    def send_to_room(self, room, msg):
+        self._loop.call(self.server.send_to_room, room, msg)
+
+    def send_direct(self, peer_id, msg):
+        self._loop.call(self.server.send_direct, peer_id, msg)
+
+    def members(self, room):
+        return self._loop.run_sync(self.server.members, room)
+
+    def stats(self):
+        return self._loop.run_sync(self.server.stats)
 
     def stop(self):
-        self._running = False
-        try:
-            self.sock.close()
-        except Exception:
-            pass
-        with self.lock:
-            for c in self.clients:
-                try:
-                    c.close()
-                except Exception:
-                    pass
-            self.clients = []
+        self._loop.run(self.server.stop())
+
 
 class CollabClient:
-    def __init__(self, host='127.0.0.1', port=6000, use_ssl=False, cafile=None, token=None):
-        self.host = host
-        self.port = port
-        self.use_ssl = use_ssl
-        self.cafile = cafile
-        self.token = token
-        self.sock = None
-        self._recv_thread = None
-        self.on_message = None
+    def __init__(self, host='127.0.0.1', port=6000, use_ssl=False, cafile=None, token=None, **options):
+        """`options` go to `AsyncCollabClient` (e.g. `batch_delay`, `cork`, `name`).
+
+        Without `batch_delay`, `send` blocks until the message is on the
+        socket. With it, `send` only adds the frame to a batch kept on the
+        calling side, which is handed to the loop in one go when it is
+        `batch_bytes` long or `batch_delay` has passed; `flush()` sends it
+        and waits.
+        """
+        from Pluto.aio import AsyncCollabClient, background_loop
+        from Pluto.protocol import encode_message
+        self.client = AsyncCollabClient(host, port, use_ssl, cafile, token, **options)
+        self._loop = background_loop()
+        self._encode = encode_message
+        self._batch = []
+        self._batch_bytes = 0
+        self._batch_lock = threading.Lock()
+        self._batch_timer = None    # loop handle, once the batch has been handed to the loop
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def __setattr__(self, name, value):
+        # on_message, on_room_message, ... are called on the background loop thread,
+        # as they were on the old receive thread
+        if name.startswith('on_'):
+            setattr(self.client, name, value)
+        else:
+            super().__setattr__(name, value)
 
     def connect(self):
-        raw = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        raw.connect((self.host, self.port))
-        if self.use_ssl:
-            ctx = ssl.create_default_context()
-            if self.cafile:
-                ctx.load_verify_locations(self.cafile)
+        self._loop.run(self.client.connect())
+
+    def send(self, msg):
+        """Send a str (TEXT frame) or bytes (BINARY frame); see `__init__` for when it is on the socket."""
+        if not self.client.batch_delay:
+            self._loop.run_or_schedule(self.client.sendall(msg))
+            return
+        frame = self._encode(msg)
+        with self._batch_lock:
+            self._batch.append(frame)
+            self._batch_bytes += len(frame)
+            if self._batch_bytes >= self.client.batch_bytes:
+                batch, self._batch, self._batch_bytes = self._batch, [], 0
+            elif self._batch_timer is None:
+                self._batch_timer = True
+                self._loop.call(self._arm)
+                return
             else:
-                ctx.check_hostname = False
-                ctx.verify_mode = ssl.CERT_NONE
-            self.sock = ctx.wrap_socket(raw, server_hostname=self.host)
-        else:
-            self.sock = raw
-
-        # send auth token first if provided
-        if self.token:
-            try:
-                self.sock.sendall(self.token.encode())
-            except Exception:
-                pass
-
-        self._recv_thread = threading.Thread(target=self._recv_loop, daemon=True)
-        self._recv_thread.start()
-
-    def _recv_loop(self):
-        while True:
-            try:
-                raw = self.sock.recv(4096)
-                if not raw:
-                    break
-                if self.on_message:
-                    self.on_message(raw.decode())
-            except Exception:
-                break
-
-    def send(self, msg: str):
-        if self.sock:
-            self.sock.sendall(msg.encode())
+                return
+        self._loop.call(self._write_batch, batch)
+
+    def _arm(self):
+        # on the loop: send whatever has collected after batch_delay
+        self._batch_timer = self._loop.loop.call_later(self.client.batch_delay, self._take_batch)
+
+    def _take_batch(self):
+        with self._batch_lock:
+            batch, self._batch, self._batch_bytes = self._batch, [], 0
+            self._batch_timer = None
+        self._write_batch(batch)
+
+    def _write_batch(self, batch):
+        if batch:
+            self.client._write(b''.join(batch))
+            self.client.flush()
+
+    def send_many(self, msgs):
+        """Send several messages with one write and wait until they are on the socket."""
+        self._loop.run_or_schedule(self._sent(self.client.send_many, msgs))
+
+    def flush(self):
+        """Send everything batched so far and wait until it is on the socket."""
+        self._loop.run_or_schedule(self._flush())
+
+    async def _flush(self):
+        self._write_batch(self._take_pending())
+        await self.client.drain()
+
+    def _take_pending(self):
+        # on the loop
+        with self._batch_lock:
+            batch, self._batch, self._batch_bytes = self._batch, [], 0
+            timer, self._batch_timer = self._batch_timer, None
+        if timer not in (None, True):
+            timer.cancel()
+        return batch
+
+    def join(self, room):
+        self._loop.run_or_schedule(self._sent(self.client.join, room))
+
+    def leave(self, room):
+        self._loop.run_or_schedule(self._sent(self.client.leave, room))
+
+    def send_to_room(self, room, msg):
+        self._loop.run_or_schedule(self._sent(self.client.send_to_room, room, msg))
+
+    def send_direct(self, peer_id, msg):
+        self._loop.run_or_schedule(self._sent(self.client.send_direct, peer_id, msg))
+
+    async def _sent(self, fn, *args):
+        self._write_batch(self._take_pending())  # keep the order of batched sends
+        fn(*args)
+        await self.client.drain()
+
+    def reconnect(self):
+        self._loop.run(self.client.reconnect())
 
     def close(self):
-        try:
-            self.sock.close()
-        except Exception:
-            pass
+        self.flush()
+        self._loop.run(self.client.close())
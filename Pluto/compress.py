@@ -0,0 +1,102 @@
+"""
+Compression stage for the vault pipeline (compress, then encrypt).
+
+Ciphertext does not compress, so PrivacyVault compresses plaintext before
+encrypting it. A compressed blob is stored as `MAGIC | codec id | token`;
+blobs that skip compression (small, incompressible, or codec 'none') keep the
+plain token layout, which is also what every older blob looks like.
+
+Codecs are stdlib only: 'zlib' and 'lzma'. A spec is a codec name or a
+`(name, level)` tuple; `CompressionPolicy` picks one per blob name by
+longest matching prefix.
+"""
+import zlib
+import lzma
+
+MAGIC = b'PLZ1'
+HEADER_SIZE = len(MAGIC) + 1
+MIN_SIZE = 256            # below this the header and codec overhead win
+SAMPLE_SIZE = 64 * 1024   # probe large payloads before compressing them whole
+MAX_RATIO = 0.95          # keep the compressed form only if it saves > 5%
+
+
+def _lzma_compress(data, level):
+    return lzma.compress(data, preset=6 if level is None else level)
+
+
+def _zlib_compress(data, level):
+    return zlib.compress(data, 6 if level is None else level)
+
+
+# codec id -> (name, compress(data, level), decompress(data)); id 0 is "stored"
+CODECS = {
+    1: ('zlib', _zlib_compress, zlib.decompress),
+    2: ('lzma', _lzma_compress, lzma.decompress),
+}
+_IDS = {name: cid for cid, (name, _, _) in CODECS.items()}
+
+
+def parse_spec(spec):
+    """Normalise a spec to `(codec id, level)`; id 0 means no compression."""
+    if spec is None or spec == 'none':
+        return 0, None
+    name, level = (spec, None) if isinstance(spec, str) else spec
+    if name == 'none':
+        return 0, None
+    try:
+        return _IDS[name], level
+    except KeyError:
+        raise ValueError(f"unknown compression codec {name!r}")
+
+
+def compress(data, spec):
+    """Return `(codec id, payload)`, falling back to `(0, data)` when not worth it."""
+    cid, level = parse_spec(spec)
+    if cid == 0 or len(data) < MIN_SIZE:
+        return 0, data
+    fn = CODECS[cid][1]
+    if len(data) > SAMPLE_SIZE * 4:
+        sample = bytes(data[:SAMPLE_SIZE])
+        if len(zlib.compress(sample, 1)) > len(sample) * MAX_RATIO:
+            return 0, data  # looks incompressible (already compressed, random, ...)
+    packed = fn(data, level)
+    if len(packed) > len(data) * MAX_RATIO:
+        return 0, data
+    return cid, packed
+
+
+def decompress(cid, payload):
+    if cid == 0:
+        return payload
+    try:
+        return CODECS[cid][2](payload)
+    except KeyError:
+        raise ValueError(f"unknown compression codec id {cid}")
+
+
+def header(cid) -> bytes:
+    return MAGIC + bytes((cid,))
+
+
+def split_header(blob):
+    """Return `(codec id, token)`; blobs without the header are codec 0."""
+    if len(blob) > HEADER_SIZE and bytes(blob[:len(MAGIC)]) == MAGIC:
+        return blob[len(MAGIC)], blob[HEADER_SIZE:]
+    return 0, blob
+
+
+class CompressionPolicy:
+    """Default codec spec plus per-prefix overrides, longest prefix wins."""
+
+    def __init__(self, default=None, rules=None):
+        parse_spec(default)
+        self.default = default
+        self.rules = sorted((rules or {}).items(), key=lambda kv: len(kv[0]), reverse=True)
+        for _, spec in self.rules:
+            parse_spec(spec)
+
+    def for_name(self, name):
+        for prefix, spec in self.rules:
+            if name.startswith(prefix):
+                return spec
+        return self.default
@@ -0,0 +1,147 @@
+"""
+Content-addressed deduplication support for PrivacyVault.
+
+In dedup mode each stored name holds a small encrypted pointer to an object
+blob named after a keyed hash (HMAC-SHA256) of the plaintext, so identical
+content is encrypted and stored once while the hash reveals nothing without
+the vault key. `RefTable` keeps per-object reference counts, persisted like
+the VFS path index: a JSON snapshot plus an append-only journal.
+
+The vault raises a count before writing the pointer and lowers it only after
+the pointer is gone, so a crash can leak an object but never drop one that is
+still referenced; `PrivacyVault.dedup_gc()` recounts and removes orphans.
+The table is owned by one process at a time.
+"""
+import os
+import hmac
+import json
+import hashlib
+import threading
+
+CAS_PREFIX = '.cas-'
+REF_MAGIC = b'PLREF1\x00'
+_DIGEST_SIZE = 32
+
+
+def dedup_key(vault_key: bytes) -> bytes:
+    return hmac.new(vault_key, b'pluto-dedup-v1', hashlib.sha256).digest()
+
+
+def content_digest(key: bytes, data) -> str:
+    return hmac.new(key, data, hashlib.sha256).hexdigest()
+
+
+def object_name(digest: str) -> str:
+    return CAS_PREFIX + digest
+
+
+def make_ref(digest: str) -> bytes:
+    return REF_MAGIC + bytes.fromhex(digest)
+
+
+def parse_ref(plain):
+    """Digest if `plain` is a pointer blob, else None."""
+    if len(plain) == len(REF_MAGIC) + _DIGEST_SIZE and bytes(plain[:len(REF_MAGIC)]) == REF_MAGIC:
+        return bytes(plain[len(REF_MAGIC):]).hex()
+    return None
+
+
+class RefTable:
+    SNAPSHOT = '.casrefs'
+    JOURNAL = '.casrefs.log'
+    STRIPES = 64
+
+    def __init__(self, storage_dir, compact_after=10000):
+        self.compact_after = compact_after
+        self._snapshot = os.path.join(storage_dir, self.SNAPSHOT)
+        self._journal = os.path.join(storage_dir, self.JOURNAL)
+        self._lock = threading.Lock()
+        self._stripes = [threading.Lock() for _ in range(self.STRIPES)]
+        self.counts = {}  # digest -> [references, plaintext size]
+        self._journal_lines = 0
+        try:
+            with open(self._snapshot, 'r') as f:
+                self.counts = json.load(f)
+        except (OSError, ValueError):
+            pass
+        try:
+            with open(self._journal, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    self._apply(line.decode('ascii').split())
+                    self._journal_lines += 1
+        except OSError:
+            pass
+        self._log = open(self._journal, 'ab')
+
+    def _apply(self, op):
+        if op[0] == '+':
+            entry = self.counts.setdefault(op[1], [0, int(op[2])])
+            entry[0] += 1
+            return entry[0]
+        entry = self.counts.get(op[1])
+        if entry is None:
+            return 0
+        entry[0] -= 1
+        if entry[0] <= 0:
+            del self.counts[op[1]]
+            return 0
+        return entry[0]
+
+    def _record(self, op):
+        count = self._apply(op)
+        self._log.write((' '.join(op) + '\n').encode('ascii'))
+        self._log.flush()
+        self._journal_lines += 1
+        if self._journal_lines >= self.compact_after:
+            self._compact()
+        return count
+
+    def _compact(self):
+        tmp = self._snapshot + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.counts, f)
+        os.replace(tmp, self._snapshot)
+        self._log.truncate(0)
+        self._journal_lines = 0
+
+    def incr(self, digest, size) -> int:
+        with self._lock:
+            return self._record(['+', digest, str(size)])
+
+    def decr(self, digest) -> int:
+        with self._lock:
+            return self._record(['-', digest])
+
+    def lock(self, digest):
+        """Lock held around check/put/incr and decr/delete of one object."""
+        return self._stripes[hash(digest) % self.STRIPES]
+
+    def get(self, digest) -> int:
+        entry = self.counts.get(digest)
+        return entry[0] if entry else 0
+
+    def reset(self, counts):
+        """Replace all counts (after a full recount) and persist them."""
+        with self._lock:
+            self.counts = counts
+            self._compact()
+
+    def stats(self):
+        with self._lock:
+            refs = sum(c for c, _ in self.counts.values())
+            logical = sum(c * size for c, size in self.counts.values())
+            stored = sum(size for _, size in self.counts.values())
+        return {
+            'objects': len(self.counts),
+            'references': refs,
+            'logical_bytes': logical,
+            'stored_bytes': stored,
+            'saved_bytes': logical - stored,
+            'ratio': (logical / stored) if stored else 1.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._log.close()
@@ -0,0 +1,329 @@
+"""
+Append-only event journal for the Kernel bus.
+
+Events are stored one JSON line (`[ts, topic, event]`) per record in segment
+files named after the offset of their first record (`{offset:020d}.log`); a
+record's offset is its position in the whole journal, so segments need no
+index. Writes go through a 1 MiB buffer. `durability` follows the vault:
+'none' flushes the buffer every `flush_interval` seconds, 'fsync' syncs
+every append and 'group' lets concurrent appenders share fsyncs. A torn
+last line is cut off when the journal is reopened.
+
+Events must be built from dict, list, tuple, str, int, float, bool, None and
+bytes; anything else raises TypeError before it is appended. Plain JSON would
+turn tuples into lists and non-str dict keys into strings, so tuples, bytes
+and dicts with other keys are tagged (`{"__tuple__": [...]}` etc.) and a
+replayed event compares equal to the one delivered live.
+
+Consumers record how far they got with `commit(consumer, offset)`;
+committed offsets are saved to `offsets.json` along with the periodic
+flush. Whole segments are dropped, oldest first, beyond `max_bytes` or once
+they are older than `max_age` seconds.
+"""
+import base64
+import bisect
+import json
+import os
+import threading
+import time
+
+from Pluto.blobstore import DURABILITY, GroupCommitter, _fsync_dir
+
+OFFSETS = 'offsets.json'
+# one shared encoder: json.dumps() rebuilds one per call when given options
+_encode = json.JSONEncoder(separators=(',', ':'), check_circular=False).encode
+_SCALARS = (str, int, float, bool, type(None))
+_TAGS = ('__tuple__', '__bytes__', '__map__')
+
+
+def _lossless(obj):
+    """`obj` with tuples, bytes and non-str-keyed dicts tagged for JSON."""
+    t = type(obj)
+    if t in _SCALARS:
+        return obj
+    if t is dict:
+        if all(type(k) is str for k in obj) and not (len(obj) == 1 and next(iter(obj)) in _TAGS):
+            return {k: _lossless(v) for k, v in obj.items()}
+        return {'__map__': [[_lossless(k), _lossless(v)] for k, v in obj.items()]}
+    if t is list:
+        return [_lossless(v) for v in obj]
+    if t is tuple:
+        return {'__tuple__': [_lossless(v) for v in obj]}
+    if t is bytes:
+        return {'__bytes__': base64.b64encode(obj).decode('ascii')}
+    raise TypeError(f"journaled events may only contain dict, list, tuple, str, int, float, bool, "
+                    f"None and bytes, not {t.__name__}")
+
+
+def _restore(d):
+    if len(d) == 1:
+        key, value = next(iter(d.items()))
+        if key == '__tuple__':
+            return tuple(value)
+        if key == '__bytes__':
+            return base64.b64decode(value)
+        if key == '__map__':
+            return {k: v for k, v in value}
+    return d
+
+
+def _seg_name(first):
+    return f"{first:020d}.log"
+
+
+class EventJournal:
+    def __init__(self, path, segment_bytes=64 << 20, durability='none', flush_interval=0.05,
+                 max_bytes=None, max_age=None):
+        if durability not in DURABILITY:
+            raise ValueError(f"durability must be one of {DURABILITY}")
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.durability = durability
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._segments = []   # first offsets, ascending; the last one is being written
+        self._sizes = {}      # first offset -> bytes, for closed segments
+        for name in os.listdir(path):
+            if name.endswith('.log') and name[:-4].isdigit():
+                self._segments.append(int(name[:-4]))
+        self._segments.sort()
+        if not self._segments:
+            self._segments.append(0)
+        for first in self._segments[:-1]:
+            self._sizes[first] = os.path.getsize(self._seg_path(first))
+        self._next = self._segments[-1] + self._recover(self._seg_path(self._segments[-1]))
+        self._file = open(self._seg_path(self._segments[-1]), 'ab', buffering=1 << 20)
+        self._size = self._file.tell()
+        self._flushed = self._next  # offset up to which the buffer was last flushed
+        self._offsets = self._load_offsets()
+        self._offsets_dirty = False
+        self._committer = GroupCommitter(self._flush_group) if durability == 'group' else None
+        self._closed = threading.Event()
+        self._flusher = None
+        if flush_interval:
+            self._flusher = threading.Thread(target=self._flush_loop, args=(flush_interval,),
+                                             name='pluto-journal', daemon=True)
+            self._flusher.start()
+
+    def _seg_path(self, first):
+        return os.path.join(self.path, _seg_name(first))
+
+    @staticmethod
+    def _recover(seg_path):
+        """Number of complete records in a segment; a torn last line is truncated."""
+        try:
+            with open(seg_path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return 0
+        end = data.rfind(b'\n') + 1
+        if end < len(data):
+            with open(seg_path, 'r+b') as f:
+                f.truncate(end)
+        return data.count(b'\n', 0, end)
+
+    def _load_offsets(self):
+        try:
+            with open(os.path.join(self.path, OFFSETS)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_offsets(self):
+        with self._save_lock:
+            with self._lock:
+                if not self._offsets_dirty:
+                    return
+                state = json.dumps(self._offsets)
+                self._offsets_dirty = False
+            path = os.path.join(self.path, OFFSETS)
+            tmp = path + '.tmp'
+            with open(tmp, 'w') as f:
+                f.write(state)
+            os.replace(tmp, path)
+
+    # -- writing -------------------------------------------------------------
+
+    @staticmethod
+    def encode(records):
+        """Journal lines for `(topic, event)` pairs; raises TypeError for unsupported events."""
+        ts = time.time()
+        return ''.join([_encode([ts, topic, _lossless(event)]) + '\n' for topic, event in records]).encode()
+
+    def append(self, event, topic=None, wait=True):
+        """Append one event; returns its offset.
+
+        With `wait=False` a 'group' journal returns before the fsync; call
+        `sync()` later (outside any lock) to wait for it.
+        """
+        return self.append_encoded(self.encode([(topic, event)]), 1, wait)
+
+    def append_many(self, records, wait=True):
+        """Append `(topic, event)` pairs with one write; returns the offset of the first."""
+        return self.append_encoded(self.encode(records), len(records), wait)
+
+    def append_encoded(self, data, n, wait=True):
+        """Append `n` records already encoded by `encode()`; returns the offset of the first."""
+        with self._lock:
+            offset = self._next
+            self._write(data, n)
+        if wait:
+            self.sync()
+        return offset
+
+    def _write(self, data, n):
+        if self._size >= self.segment_bytes:
+            self._roll()
+        self._file.write(data)
+        self._size += len(data)
+        self._next += n
+        if self.durability == 'fsync':
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def sync(self):
+        """Wait until everything appended so far is as durable as `durability` promises."""
+        if self._committer is not None:
+            self._committer.commit(None)
+
+    def _flush_group(self, batch):
+        # fsync outside the lock so appends can go on meanwhile; a dup'ed fd
+        # stays valid across a roll, which syncs the old segment itself
+        with self._lock:
+            self._file.flush()
+            fd = os.dup(self._file.fileno())
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _roll(self):
+        # called with self._lock held
+        self._file.flush()
+        if self.durability != 'none':
+            os.fsync(self._file.fileno())
+        self._file.close()
+        self._sizes[self._segments[-1]] = self._size
+        self._segments.append(self._next)
+        self._file = open(self._seg_path(self._next), 'ab', buffering=1 << 20)
+        self._size = 0
+        if self.durability != 'none':
+            _fsync_dir(self.path)
+        self._apply_retention()
+
+    def _apply_retention(self):
+        # called with self._lock held; the segment being written is never dropped
+        now = time.time()
+        total = self._size + sum(self._sizes.values())
+        while len(self._segments) > 1:
+            first = self._segments[0]
+            path = self._seg_path(first)
+            too_big = self.max_bytes is not None and total > self.max_bytes
+            too_old = False
+            if self.max_age is not None and not too_big:
+                try:
+                    too_old = os.path.getmtime(path) < now - self.max_age
+                except OSError:
+                    too_old = True
+            if not (too_big or too_old):
+                break
+            self._segments.pop(0)
+            total -= self._sizes.pop(first, 0)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def apply_retention(self):
+        with self._lock:
+            self._apply_retention()
+
+    def flush(self):
+        """Hand buffered records to the OS (and fsync them unless durability is 'none')."""
+        with self._lock:
+            if not self._file.closed and self._flushed != self._next:
+                self._flushed = self._next
+                self._file.flush()
+                if self.durability != 'none':
+                    os.fsync(self._file.fileno())
+        self._save_offsets()
+
+    def _flush_loop(self, interval):
+        while not self._closed.wait(interval):
+            self.flush()
+            if self.max_bytes is not None or self.max_age is not None:
+                self.apply_retention()
+
+    # -- reading -------------------------------------------------------------
+
+    @property
+    def first_offset(self):
+        return self._segments[0]
+
+    @property
+    def next_offset(self):
+        """Offset the next appended event will get."""
+        return self._next
+
+    def read(self, offset=0, end=None):
+        """Yield `(offset, ts, topic, event)` from `offset` up to `end` (default: now).
+
+        Offsets already removed by retention are skipped.
+        """
+        with self._lock:
+            self._file.flush()
+            segments = list(self._segments)
+            end = self._next if end is None else min(end, self._next)
+        offset = max(offset, segments[0])
+        i = bisect.bisect_right(segments, offset) - 1
+        for first in segments[i:]:
+            if first >= end:
+                return
+            try:
+                f = open(self._seg_path(first), 'rb')
+            except FileNotFoundError:
+                continue  # dropped by retention while we were reading
+            with f:
+                pos = first
+                for line in f:
+                    if pos >= end:
+                        return
+                    if pos >= offset:
+                        try:
+                            ts, topic, event = json.loads(line, object_hook=_restore)
+                        except ValueError:
+                            pos += 1
+                            continue
+                        yield pos, ts, topic, event
+                    pos += 1
+
+    # -- consumer offsets ----------------------------------------------------
+
+    def commit(self, consumer, offset):
+        """Record that `consumer` has handled everything before `offset`."""
+        with self._lock:
+            if offset > self._offsets.get(consumer, -1):
+                self._offsets[consumer] = offset
+                self._offsets_dirty = True
+
+    def committed(self, consumer, default=None):
+        return self._offsets.get(consumer, default)
+
+    def stats(self):
+        with self._lock:
+            return {'first_offset': self._segments[0], 'next_offset': self._next,
+                    'segments': len(self._segments), 'bytes': self._size + sum(self._sizes.values()),
+                    'consumers': dict(self._offsets)}
+
+    def close(self):
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        if self._committer is not None:
+            self._committer.close()
+        self.flush()
+        with self._lock:
+            self._file.close()
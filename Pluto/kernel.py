@@ -1,45 +1,634 @@
 """
 Simple Kernel for PlutoOS: service registry and event bus.
+
+Every registered service gets its own queue and worker thread(s), so a slow
+handler only delays its own events. Queues are unbounded unless `queue_size`
+is set; when a bounded queue is full, `emit_event` applies the service's
+backpressure policy: 'drop-new' (the default) discards the new event,
+'drop-oldest' the oldest queued one, and 'block' waits for room. 'block'
+only waits while the service's workers are running and the caller is not one
+of them (a handler emitting to its own full queue); otherwise the event is
+dropped, so an emit can never wait for a worker that will not come. Drops are
+counted in `metrics()`. Services registered with `mode='process'` run their handler in the
+kernel's process pool (the handler must be picklable, i.e. a module-level
+function), which lets CPU-bound handlers use more than one core.
+`metrics()` reports per-service queue depth, drops, errors and handler latency.
+
+Services may subscribe to `topics`: exact names ('vfs.write'), prefixes
+('vfs.*', any pattern whose only wildcard is a trailing '*') or glob patterns
+('svc.*.crash', fnmatch syntax); no topics (or '*') means every event. An
+event's topic is the `topic` argument, else `event['topic']` for dicts or
+`event.topic`. Routes are resolved once per topic and cached until the
+subscriptions change, so an emit only touches interested services.
+`emit_many` queues a whole batch with one lock round trip per service.
+
+With a `journal` (an `EventJournal` or a directory for one) every emitted
+event is appended to disk before it is queued, so it survives a restart and
+reaches services registered later: `register_service(replay_from=...)`
+first replays the journal from an offset ('earliest', or 'committed' to
+resume where its `consumer` left off), then continues with live events.
+Journaled events are limited to JSON-like types (see `Pluto.journal`); an
+unsupported event raises TypeError from `emit_event` and is not queued.
+A service with a `consumer` name commits its offset after every batch; with
+several workers it commits the low-water mark, i.e. only past events that
+every worker has finished, so a restart never skips an event still in flight.
 """
+import fnmatch
+import re
 import threading
-import queue
+import time
+from collections import deque
+
+BACKPRESSURE = ('block', 'drop-oldest', 'drop-new')
+_LATENCY_SAMPLES = 1024
+_MAX_ROUTES = 65536  # cached topic routes before the cache is reset
+
+
+def topic_of(event):
+    if isinstance(event, dict):
+        return event.get('topic')
+    return getattr(event, 'topic', None)
+
+
+def compile_pattern(pattern):
+    """`(kind, value)` for a subscription pattern: all, exact, prefix or glob."""
+    if pattern == '*':
+        return 'all', None
+    if not any(c in pattern for c in '*?['):
+        return 'exact', pattern
+    if pattern.endswith('*') and not any(c in pattern[:-1] for c in '*?['):
+        return 'prefix', pattern[:-1]
+    return 'glob', re.compile(fnmatch.translate(pattern)).match
+
+
+class ServiceQueue:
+    """FIFO of events for one service (bounded if `maxsize` is set), plus its counters.
+
+    Workers take events in batches and producers/consumers are only woken when
+    someone is actually waiting, so a busy queue costs about one lock round
+    trip per batch instead of a context switch per event.
+    """
+
+    BATCH = 256
+    MODES = ('thread', 'process')
+
+    def __init__(self, name, handler, maxsize=None, backpressure='drop-new', workers=1, mode='thread', topics=None):
+        if backpressure not in BACKPRESSURE:
+            raise ValueError(f"backpressure must be one of {BACKPRESSURE}, not {backpressure!r}")
+        if mode not in self.MODES:
+            raise ValueError(f"mode must be one of {self.MODES}, not {mode!r}")
+        self.name = name
+        self.handler = handler
+        self.maxsize = maxsize
+        self.backpressure = backpressure
+        self.workers = workers
+        self.mode = mode
+        self.topics = set(topics) if topics else {'*'}
+        self.consumer = None   # journal consumer name, if offsets are committed
+        self.replay = None     # (start, end) journal offsets to handle before live events
+        self.replayed = threading.Event()
+        self.replayed.set()
+        self._items = deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._idle = threading.Condition(self._lock)
+        self._getters = self._putters = 0
+        self._closed = False
+        self._running = False  # workers started and not yet stopped
+        self.worker_ids = set()  # see _current()
+        self._busy = 0
+        self._inflight = {}      # id(batch) -> lowest journal offset in it
+        self._handled_to = None  # one past the highest handled journal offset
+        self._committed = None
+        self.delivered = self.dropped = self.errors = self.max_depth = 0
+        self.last_error = None
+        self._latency = deque(maxlen=_LATENCY_SAMPLES)  # mean handler seconds per batch
+        self._wait = deque(maxlen=_LATENCY_SAMPLES)     # seconds the oldest event of a batch spent queued
+
+    def put(self, event, offset=None):
+        """Queue `event` (with its journal `offset`) per the backpressure policy; False if it was dropped."""
+        with self._lock:
+            if self._closed:
+                return False
+            if self.maxsize is not None and len(self._items) >= self.maxsize:
+                if self.backpressure == 'drop-new' or (self.backpressure == 'block' and not self._can_block()):
+                    self.dropped += 1
+                    return False
+                if self.backpressure == 'drop-oldest':
+                    self._items.popleft()
+                    self.dropped += 1
+                else:
+                    self._putters += 1
+                    while len(self._items) >= self.maxsize and not self._closed:
+                        self._not_full.wait()
+                    self._putters -= 1
+                    if self._closed:
+                        return False
+            self._items.append((time.perf_counter(), event, offset))
+            if len(self._items) > self.max_depth:
+                self.max_depth = len(self._items)
+            if self._getters:
+                self._not_empty.notify()
+            return True
+
+    def put_many(self, events, offsets=None):
+        """Queue a list of events under one lock acquisition (per wait for room); returns how many were queued."""
+        now = time.perf_counter()
+        items = [(now, e, o) for e, o in zip(events, offsets)] if offsets else [(now, e, None) for e in events]
+        accepted, i = 0, 0
+        with self._lock:
+            while i < len(items) and not self._closed:
+                i, n = self._offer(items, i)
+                accepted += n
+                if not n and i < len(items):
+                    self._putters += 1
+                    self._not_full.wait()
+                    self._putters -= 1
+        return accepted
+
+    def _offer(self, items, i):
+        """Queue `items[i:]` as far as the policy allows without waiting; returns `(next i, queued)`.
+
+        Queues nothing and leaves `i` alone when the queue is full under 'block'.
+        """
+        room = len(items) - i if self.maxsize is None else self.maxsize - len(self._items)
+        if room <= 0:
+            if self.backpressure == 'drop-new' or (self.backpressure == 'block' and not self._can_block()):
+                self.dropped += len(items) - i
+                return len(items), 0
+            if self.backpressure == 'block':
+                return i, 0
+            room = len(items) - i
+        chunk = items[i:i + room]
+        self._items.extend(chunk)
+        overflow = 0 if self.maxsize is None else len(self._items) - self.maxsize
+        if overflow > 0:  # drop-oldest
+            for _ in range(overflow):
+                self._items.popleft()
+            self.dropped += overflow
+        if len(self._items) > self.max_depth:
+            self.max_depth = len(self._items)
+        self._wake_getters()
+        return i + len(chunk), len(chunk)
+
+    def _current(self):
+        """Identity of the calling worker, as recorded in `worker_ids`."""
+        return threading.get_ident()
+
+    def _can_block(self):
+        # waiting is only safe if a worker is running that is not the caller
+        return self._running and self._current() not in self.worker_ids
+
+    def _wake_getters(self):
+        if self._getters:
+            self._not_empty.notify(self._getters)
+
+    def get_batch(self):
+        """Up to `BATCH` queued `(queued_at, event, offset)` items; empty once closed and drained."""
+        with self._lock:
+            while not self._items:
+                if self._closed:
+                    return []
+                self._getters += 1
+                self._not_empty.wait()
+                self._getters -= 1
+            batch = self._take()
+            if self._putters:
+                self._not_full.notify(len(batch))
+            return batch
+
+    def _take(self):
+        n = min(self.BATCH, len(self._items))
+        batch = [self._items.popleft() for _ in range(n)]
+        self._busy += n
+        if self.consumer and batch[0][2] is not None:
+            self._inflight[id(batch)] = min(item[2] for item in batch)
+        return batch
+
+    def settle(self, batch):
+        """Journal offset to commit now that `batch` was handled, or None if it did not advance.
+
+        That is the lowest offset still queued or in another worker's batch,
+        capped at one past the highest offset handled so far.
+        """
+        with self._lock:
+            if self._inflight.pop(id(batch), None) is None:
+                return None
+            top = max(item[2] for item in batch) + 1
+            if self._handled_to is None or top > self._handled_to:
+                self._handled_to = top
+            mark = self._handled_to
+            if self._inflight:
+                mark = min(mark, min(self._inflight.values()))
+            if self._items and self._items[0][2] is not None:
+                mark = min(mark, self._items[0][2])
+            if self._committed is not None and mark <= self._committed:
+                return None
+            self._committed = mark
+            return mark
+
+    def done(self, n, wait, latency, errors=0, last_error=None, queued=True):
+        """Record a handled batch of `n` events (`latency` is the mean per event)."""
+        with self._lock:
+            if queued:
+                self._busy -= n
+                self._wait.append(wait)
+            self._latency.append(latency)
+            self.delivered += n - errors
+            if errors:
+                self.errors += errors
+                self.last_error = repr(last_error)
+            if not self._items and not self._busy:
+                self._idle.notify_all()
+                return True
+        return False
+
+    def join(self, timeout=None):
+        """Wait until every queued event has been handled; False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while self._items or self._busy:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._running = False
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+
+    def reopen(self):
+        """Accept events again; called as the workers are started."""
+        with self._lock:
+            self._closed = False
+            self._running = True
 
-class Kernel:
-    def __init__(self, name="PlutoOS"):
+    def metrics(self):
+        with self._lock:
+            lat = sorted(self._latency)
+            wait = sorted(self._wait)
+            out = {'queue_depth': len(self._items), 'max_depth': self.max_depth, 'in_flight': self._busy,
+                   'delivered': self.delivered, 'dropped': self.dropped, 'errors': self.errors,
+                   'last_error': self.last_error, 'maxsize': self.maxsize, 'backpressure': self.backpressure,
+                   'workers': self.workers, 'mode': self.mode, 'topics': sorted(self.topics)}
+        for key, values in (('latency', lat), ('queue_wait', wait)):
+            if values:
+                out[key] = {'mean_ms': 1000 * sum(values) / len(values),
+                            'p50_ms': 1000 * values[len(values) // 2],
+                            'p95_ms': 1000 * values[min(len(values) - 1, int(len(values) * 0.95))],
+                            'max_ms': 1000 * values[-1]}
+        return out
+
+
+def _call(handler, event):
+    # module-level so the process pool can pickle it
+    return handler(event)
+
+
+class _Bus:
+    """Service registry and topic routing shared by `Kernel` and `AsyncKernel`."""
+
+    def __init__(self, name, queue_size, backpressure, processes):
         self.name = name
-        self.services = {}
-        self.event_queue = queue.Queue()
+        self.services = {}   # name -> ServiceQueue
+        self.queue_size = queue_size
+        self.backpressure = backpressure
+        self.processes = processes
+        self._pool = None
+        self._lock = threading.Lock()
         self._running = False
-        self._thread = None
+        self._rebuild_routes()
+
+    def _add(self, sq):
+        """Install `sq` (called with self._lock held); returns the queue it replaces, if any."""
+        old = self.services.get(sq.name)
+        self.services[sq.name] = sq
+        self._rebuild_routes()
+        return old
+
+    def subscribe(self, name, pattern):
+        """Add a topic pattern; the first one replaces the default catch-all."""
+        with self._lock:
+            sq = self.services[name]
+            if pattern != '*' and sq.topics == {'*'}:
+                sq.topics.clear()
+            sq.topics.add(pattern)
+            self._rebuild_routes()
+
+    def unsubscribe(self, name, pattern):
+        """Drop one pattern; a service left without patterns receives nothing."""
+        with self._lock:
+            self.services[name].topics.discard(pattern)
+            self._rebuild_routes()
+
+    def _rebuild_routes(self):
+        # called with self._lock held (or from __init__); readers use the new objects lock-free
+        catch_all, exact, prefixes, globs = [], {}, [], []
+        for sq in self.services.values():
+            for pattern in sq.topics:
+                kind, value = compile_pattern(pattern)
+                if kind == 'all':
+                    catch_all.append(sq)
+                elif kind == 'exact':
+                    exact.setdefault(value, []).append(sq)
+                elif kind == 'prefix':
+                    prefixes.append((value, sq))
+                else:
+                    globs.append((value, sq))
+        order = {sq: i for i, sq in enumerate(self.services.values())}
+        # published as one object: a route computed from an old table can
+        # only ever land in that table's own cache
+        self._routing = ((catch_all, exact, prefixes, globs, order), {})
+
+    def _route(self, topic, routing=None):
+        """Services interested in `topic`, in registration order; cached."""
+        table, routes = routing or self._routing
+        route = routes.get(topic)
+        if route is not None:
+            return route
+        catch_all, exact, prefixes, globs, order = table
+        found = list(catch_all)
+        if topic is not None:
+            found += exact.get(topic, ())
+            found += [sq for p, sq in prefixes if topic.startswith(p)]
+            found += [sq for match, sq in globs if match(topic)]
+        # a service matching several patterns gets the event once
+        route = tuple(sorted(set(found), key=order.__getitem__))
+        if len(routes) >= _MAX_ROUTES:
+            routes.clear()
+        routes[topic] = route
+        return route
+
+    def routes(self, topic):
+        """Names of the services an event with `topic` is delivered to."""
+        return [sq.name for sq in self._route(topic)]
+
+    def _group(self, events, first_offset=None):
+        """`{queue: (events, offsets)}` for events that each carry their own topic.
+
+        `offsets` is None unless the events were journaled from `first_offset` on.
+        """
+        routing = self._routing
+        routes = routing[1]
+        per_service = {}
+        last, route = object(), ()
+        for i, event in enumerate(events):
+            t = topic_of(event)
+            if t != last:
+                route = routes.get(t)
+                if route is None:
+                    route = self._route(t, routing)
+                last = t
+            for sq in route:
+                group = per_service.get(sq)
+                if group is None:
+                    per_service[sq] = group = ([], None if first_offset is None else [])
+                group[0].append(event)
+                if first_offset is not None:
+                    group[1].append(first_offset + i)
+        return per_service
+
+    def _process_pool(self):
+        with self._lock:
+            if self._pool is None:
+                from concurrent.futures import ProcessPoolExecutor
+                self._pool = ProcessPoolExecutor(self.processes)
+            return self._pool
+
+    def metrics(self):
+        """Per-service queue depth, drop/error counts and handler latency."""
+        return {name: sq.metrics() for name, sq in list(self.services.items())}
 
-    def register_service(self, name, handler):
-        """Register a service handler that accepts one event argument."""
-        self.services[name] = handler
 
-    def emit_event(self, event):
-        self.event_queue.put(event)
+class Kernel(_Bus):
+    def __init__(self, name="PlutoOS", queue_size=None, backpressure='drop-new', processes=None, journal=None):
+        super().__init__(name, queue_size, backpressure, processes)
+        self._threads = {}   # name -> [threads]
+        if isinstance(journal, str):
+            from Pluto.journal import EventJournal
+            journal = EventJournal(journal)
+        self.journal = journal
+        # held across journal append + route lookup, so a replaying service
+        # sees each event either in its replay range or live, never both
+        self._emit_lock = threading.Lock()
 
-    def _loop(self):
-        while self._running:
+    def register_service(self, name, handler, queue_size=None, backpressure=None, workers=1, mode='thread',
+                         topics=None, consumer=None, replay_from=None):
+        """Register a service handler that accepts one event argument.
+
+        The service gets its own queue (of at most `queue_size` events, if set)
+        and `workers` threads; `mode='process'` runs the handler in the kernel's process pool.
+        `topics` limits it to matching events (default: all events).
+        With a journal, `consumer` names the offset the service commits and
+        `replay_from` (an offset, 'earliest' or 'committed') replays older events first.
+        """
+        sq = ServiceQueue(name, handler, queue_size or self.queue_size, backpressure or self.backpressure,
+                          workers, mode, topics)
+        if (consumer or replay_from is not None) and self.journal is None:
+            raise ValueError("consumer offsets and replay need a Kernel(journal=...)")
+        sq.consumer = consumer
+        start = None
+        if replay_from == 'earliest':
+            start = self.journal.first_offset
+        elif replay_from == 'committed':
+            if not consumer:
+                raise ValueError("replay_from='committed' needs a consumer name")
+            start = self.journal.committed(consumer, self.journal.first_offset)
+        elif replay_from is not None:
+            start = int(replay_from)
+        with self._lock, self._emit_lock:
+            if start is not None and start < self.journal.next_offset:
+                sq.replay = (start, self.journal.next_offset)
+                sq.replayed.clear()
+            old = self._add(sq)
+            if self._running:
+                self._start_workers(sq)
+        if old is not None:
+            self._retire(old)
+
+    def unregister_service(self, name):
+        with self._lock:
+            sq = self.services.pop(name, None)
+            self._rebuild_routes()
+        if sq is not None:
+            self._retire(sq)
+
+    def _retire(self, sq):
+        sq.close()
+        for t in self._threads.pop(sq.name + '#' + str(id(sq)), []):
+            t.join(timeout=1)
+
+    def emit_event(self, event, topic=None):
+        """Queue `event` for every subscribed service; returns how many accepted it."""
+        if topic is None:
+            topic = topic_of(event)
+        offset = None
+        if self.journal is None:
+            route = self._routing[1].get(topic)
+            if route is None:
+                route = self._route(topic)
+        else:
+            data = self.journal.encode([(topic, event)])  # raises before anything is locked
+            with self._emit_lock:
+                offset = self.journal.append_encoded(data, 1, wait=False)
+                route = self._route(topic)
+            self.journal.sync()
+        accepted = 0
+        for sq in route:
+            accepted += sq.put(event, offset)
+        return accepted
+
+    def emit_many(self, events, topic=None):
+        """Queue a batch of events (all on `topic`, or each on its own); returns total acceptances."""
+        events = events if isinstance(events, list) else list(events)
+        first = None
+        if self.journal is not None:
+            records = [(topic, e) for e in events] if topic is not None else [(topic_of(e), e) for e in events]
+            data = self.journal.encode(records)
+            with self._emit_lock:
+                first = self.journal.append_encoded(data, len(records), wait=False)
+                groups = ([(sq, (events, None)) for sq in self._route(topic)] if topic is not None
+                          else list(self._group(events, first).items()))
+            self.journal.sync()
+        elif topic is not None:
+            groups = [(sq, (events, None)) for sq in self._route(topic)]
+        else:
+            groups = self._group(events).items()
+        accepted = 0
+        for sq, (batch, offsets) in groups:
+            if offsets is None and first is not None:
+                offsets = range(first, first + len(batch))
+            accepted += sq.put_many(batch, offsets)
+        return accepted
+
+    def _replay(self, sq, handler):
+        """Handle the journaled events in `sq.replay` that match the service's topics."""
+        start, end = sq.replay
+        clock = time.perf_counter
+        batch = []
+        for offset, _, topic, event in self.journal.read(start, end):
+            if sq in self._route(topic):
+                batch.append((offset, event))
+            if len(batch) >= sq.BATCH:
+                self._replay_batch(sq, handler, batch, clock)
+                batch = []
+        if batch:
+            self._replay_batch(sq, handler, batch, clock)
+        if sq.consumer:
+            self.journal.commit(sq.consumer, end)
+        sq.replay = None
+
+    def _replay_batch(self, sq, handler, batch, clock):
+        started = clock()
+        errors, last_error = 0, None
+        for _, event in batch:
             try:
-                ev = self.event_queue.get(timeout=0.5)
-                # dispatch to services
-                for svc in list(self.services.values()):
-                    try:
-                        svc(ev)
-                    except Exception:
-                        pass
-            except Exception:
-                pass
+                handler(event)
+            except Exception as e:
+                errors += 1
+                last_error = e
+        sq.done(len(batch), 0.0, (clock() - started) / len(batch), errors, last_error, queued=False)
+        if sq.consumer:
+            self.journal.commit(sq.consumer, batch[-1][0] + 1)
+
+    def _worker(self, sq, replay=False):
+        sq.worker_ids.add(sq._current())
+        try:
+            self._work(sq, replay)
+        finally:
+            sq.worker_ids.discard(sq._current())
+
+    def _work(self, sq, replay):
+        clock = time.perf_counter
+        handler = sq.handler
+        if sq.mode == 'process':
+            def handler(event):
+                return self._process_pool().submit(_call, sq.handler, event).result()
+        if replay:
+            try:
+                self._replay(sq, handler)
+            finally:
+                sq.replayed.set()
+        else:
+            sq.replayed.wait()  # live events only once the replay is done
+        commit = self.journal.commit if sq.consumer else None
+        while True:
+            batch = sq.get_batch()
+            if not batch:
+                return
+            started = clock()
+            errors, last_error = 0, None
+            for _, event, _ in batch:
+                try:
+                    handler(event)
+                except Exception as e:
+                    errors += 1
+                    last_error = e
+            sq.done(len(batch), started - batch[0][0], (clock() - started) / len(batch), errors, last_error)
+            if commit is not None:
+                mark = sq.settle(batch)
+                if mark is not None:
+                    commit(sq.consumer, mark)
+
+    def _start_workers(self, sq):
+        sq.reopen()
+        replay = sq.replay is not None
+        threads = [threading.Thread(target=self._worker, args=(sq, replay and i == 0), name=f"kernel-{sq.name}-{i}",
+                                    daemon=True)
+                   for i in range(sq.workers)]
+        self._threads[sq.name + '#' + str(id(sq))] = threads
+        for t in threads:
+            t.start()
+
+    def join(self, timeout=None):
+        """Wait until all queued events have been handled."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for sq in list(self.services.values()):
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not sq.replayed.wait(remaining):
+                return False
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not sq.join(remaining):
+                return False
+        return True
+
+    def metrics(self):
+        out = super().metrics()
+        if self.journal is not None:
+            end = self.journal.next_offset
+            for name, m in out.items():
+                sq = self.services.get(name)
+                if sq is not None and sq.consumer:
+                    committed = self.journal.committed(sq.consumer, 0)
+                    m['consumer'] = {'name': sq.consumer, 'committed': committed, 'lag': end - committed}
+        return out
 
     def start(self):
-        if self._running:
-            return
-        self._running = True
-        self._thread = threading.Thread(target=self._loop, daemon=True)
-        self._thread.start()
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+            for sq in self.services.values():
+                self._start_workers(sq)
 
     def stop(self):
-        self._running = False
-        if self._thread:
-            self._thread.join(timeout=1)
+        """Stop the workers; events still queued are handled first (up to 1 s per worker)."""
+        with self._lock:
+            self._running = False
+            services = list(self.services.values())
+            threads, self._threads = self._threads, {}
+            pool, self._pool = self._pool, None
+        for sq in services:
+            sq.close()
+        for ts in threads.values():
+            for t in ts:
+                t.join(timeout=1)
+        if pool is not None:
+            pool.shutdown(wait=False)
+        if self.journal is not None:
+            self.journal.flush()
@@ -0,0 +1,53 @@
+"""
+Process-wide cache of vault keys and cipher objects, keyed by key file.
+
+Every `PrivacyVault`/`VFS` used to read its key file and build a fresh cipher
+(for Fernet, that also means importing `cryptography`). The keyring does that
+once per `(key file, cipher)` and afterwards only `stat`s the file, so a key
+that is replaced on disk is picked up again.
+"""
+import os
+import threading
+
+_lock = threading.Lock()
+_entries = {}  # (real path, cipher name) -> (file stamp, key, cipher)
+
+
+def _stamp(st):
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+def _create(key_path, cipher_cls):
+    parent = os.path.dirname(key_path)
+    if parent:
+        os.makedirs(parent, exist_ok=True)
+    try:
+        with open(key_path, 'xb') as f:
+            f.write(cipher_cls.generate_key())
+    except FileExistsError:
+        pass  # another process or thread created it first
+
+
+def get(key_path, cipher_cls):
+    """Return `(key, cipher)` for `key_path`, generating the key file if missing."""
+    try:
+        st = os.stat(key_path)
+    except FileNotFoundError:
+        _create(key_path, cipher_cls)
+        st = os.stat(key_path)
+    slot = (os.path.realpath(key_path), cipher_cls.name)
+    with _lock:
+        entry = _entries.get(slot)
+        if entry is not None and entry[0] == _stamp(st):
+            return entry[1], entry[2]
+        with open(key_path, 'rb') as f:
+            stamp = _stamp(os.fstat(f.fileno()))
+            key = f.read()
+        cipher = cipher_cls(key)
+        _entries[slot] = (stamp, key, cipher)
+        return key, cipher
+
+
+def clear():
+    with _lock:
+        _entries.clear()
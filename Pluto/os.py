@@ -18,7 +18,10 @@ def main():
     vfs = VFS()
 
     # start core services
-    sup.start_all()
+    boot = sup.start_all()
+    print(f"Started {boot['started']} service(s) in {boot['seconds']:.2f}s")
+    for name, err in boot['failed'].items():
+        print(f"  {name}: {err}")
 
     shell = Shell(sup, vfs)
     try:
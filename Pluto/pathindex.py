@@ -0,0 +1,229 @@
+"""
+Persistent sorted path index for the VFS.
+
+Paths are kept in a sorted list so prefix listings are a bisect plus a scan
+of the matches. The index is persisted in its own `.pathindex.d` directory as
+a snapshot plus an append-only journal of `+path` / `-path` lines, so
+`add`/`remove` cost one small append. On open the index claims a generation
+of the blob store (see `Pluto.blobstore`) and records it on close; if the
+snapshot is missing, or the store's generation moved since (blobs written by
+something that did not update the index, or a crash before close), the index
+is rebuilt from the blob store.
+"""
+import os
+import json
+import bisect
+import threading
+
+
+class PathIndex:
+    DIR = '.pathindex.d'
+    SNAPSHOT = 'snapshot'
+    JOURNAL = 'journal.log'
+    GENERATION = 'generation'
+    LEGACY = ('.pathindex', '.pathindex.log')
+
+    def __init__(self, storage_dir, rebuild, generation=None, compact_after=10000):
+        """`rebuild` is a callable returning every stored path; `generation`
+        is the store's `generation(claim=False)` (without it, every open rebuilds)."""
+        self.storage_dir = storage_dir
+        self.rebuild_source = rebuild
+        self.generation = generation
+        self.compact_after = compact_after
+        index_dir = os.path.join(storage_dir, self.DIR)
+        os.makedirs(index_dir, exist_ok=True)
+        for name in self.LEGACY:
+            try:
+                os.remove(os.path.join(storage_dir, name))
+            except OSError:
+                pass
+        self._snapshot = os.path.join(index_dir, self.SNAPSHOT)
+        self._journal = os.path.join(index_dir, self.JOURNAL)
+        self._marker = os.path.join(index_dir, self.GENERATION)
+        self._lock = threading.Lock()
+        self._paths = []
+        self._journal_pos = 0
+        self._journal_lines = 0
+        self._log = None
+        self._claimed = None
+        with self._lock:
+            stale = self._claim()
+            self._log = open(self._journal, 'ab')
+            self._reader = open(self._journal, 'rb')
+            if stale or not self._load():
+                self._rebuild()
+
+    # -- persistence ---------------------------------------------------------
+
+    def _load(self):
+        try:
+            with open(self._snapshot, 'r') as f:
+                self._paths = json.load(f)
+        except (OSError, ValueError):
+            return False
+        self._journal_pos = self._journal_lines = 0
+        self._replay()
+        return True
+
+    def _replay(self):
+        self._reader.seek(self._journal_pos)
+        data = self._reader.read()
+        end = data.rfind(b'\n') + 1  # ignore a partial line from a concurrent append
+        for line in data[:end].splitlines():
+            self._journal_lines += 1
+            try:
+                op, path = line[:1], json.loads(line[1:])
+            except ValueError:
+                continue
+            if op == b'+':
+                self._insert(path)
+            elif op == b'-':
+                self._delete(path)
+        self._journal_pos += end
+
+    def _claim(self):
+        """Claim a generation; True if the store moved past the marker since.
+
+        Only the claimed generation is marked on close: a write by anyone
+        else after the claim moves the store past it.
+        """
+        if self.generation is None:
+            return True
+        self._claimed = self.generation(claim=True)
+        try:
+            with open(self._marker, 'r') as f:
+                return f.read() != str(self._claimed - 1)
+        except OSError:
+            return True
+
+    def _mark(self):
+        tmp = self._marker + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(str(self._claimed))
+        os.replace(tmp, self._marker)
+
+    def _rebuild(self):
+        self._paths = sorted(set(self.rebuild_source()))
+        self._compact()
+
+    def _compact(self):
+        tmp = self._snapshot + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self._paths, f)
+        os.replace(tmp, self._snapshot)
+        self._log.truncate(0)
+        self._journal_pos = self._journal_lines = 0
+
+    def _append(self, op, *paths):
+        self._log.write(''.join(op + json.dumps(p) + '\n' for p in paths).encode('utf-8'))
+        self._log.flush()
+        # reading our own line back also picks up other processes' appends
+        self._replay()
+        if self._journal_lines >= self.compact_after:
+            self._compact()
+
+    def _refresh(self):
+        # pick up entries journaled by other processes sharing the storage dir
+        size = os.fstat(self._reader.fileno()).st_size
+        if size > self._journal_pos:
+            self._replay()
+        elif size < self._journal_pos:
+            if not self._load():
+                self._rebuild()
+
+    # -- sorted list -------------------------------------------------------
+
+    def _insert(self, path):
+        i = bisect.bisect_left(self._paths, path)
+        if i < len(self._paths) and self._paths[i] == path:
+            return False
+        self._paths.insert(i, path)
+        return True
+
+    def _has(self, path):
+        i = bisect.bisect_left(self._paths, path)
+        return i < len(self._paths) and self._paths[i] == path
+
+    def _delete(self, path):
+        i = bisect.bisect_left(self._paths, path)
+        if i < len(self._paths) and self._paths[i] == path:
+            del self._paths[i]
+            return True
+        return False
+
+    # -- public API --------------------------------------------------------
+
+    def add(self, path):
+        with self._lock:
+            if self._insert(path):
+                self._append('+', path)
+
+    def add_many(self, paths):
+        """Add a batch of paths with one sort-merge and one journal write."""
+        with self._lock:
+            new = sorted(set(p for p in paths if not self._has(p)))
+            if not new:
+                return
+            # timsort merges the two sorted runs in linear time
+            self._paths.extend(new)
+            self._paths.sort()
+            self._append('+', *new)
+
+    def remove(self, path):
+        with self._lock:
+            if self._delete(path):
+                self._append('-', path)
+
+    def rebuild(self):
+        with self._lock:
+            self._claim()
+            self._rebuild()
+
+    def ls(self, prefix=''):
+        """All paths starting with `prefix`, in sorted order."""
+        with self._lock:
+            self._refresh()
+            paths = self._paths
+            i = bisect.bisect_left(paths, prefix)
+            out = []
+            while i < len(paths) and paths[i].startswith(prefix):
+                out.append(paths[i])
+                i += 1
+            return out
+
+    def listdir(self, directory=''):
+        """Immediate children of `directory`; sub-directories end with '/'."""
+        pfx = directory.strip('/')
+        pfx = pfx + '/' if pfx else ''
+        with self._lock:
+            self._refresh()
+            paths = self._paths
+            out = []
+            i = bisect.bisect_left(paths, pfx)
+            while i < len(paths) and paths[i].startswith(pfx):
+                child, sep, _ = paths[i][len(pfx):].partition('/')
+                if sep:
+                    out.append(child + '/')
+                    # skip the whole subtree: '0' sorts right after '/'
+                    i = bisect.bisect_left(paths, pfx + child + '0', i)
+                else:
+                    out.append(child)
+                    i += 1
+            return out
+
+    def __contains__(self, path):
+        with self._lock:
+            return self._has(path)
+
+    def __len__(self):
+        return len(self._paths)
+
+    def close(self):
+        with self._lock:
+            if self._log:
+                if self.generation is not None:
+                    # everything written through this index is journaled by now
+                    self._mark()
+                self._log.close()
+                self._reader.close()
+                self._log = None
@@ -2,63 +2,307 @@
 Privacy Vault for PlutoOS — stores secrets encrypted on disk.
 Uses `cryptography.Fernet` when available; falls back to a simple XOR for demo.
 """
+import io
 import os
-import base64
+import threading
+import importlib.util
 import warnings
+from Pluto.blobstore import FileStore, PackStore, ViewReader
+from Pluto.readcache import ReadCache
+from Pluto.ciphers import CIPHERS, FernetCipher, available
+from Pluto import dedup as cas
+from Pluto import compress
+from Pluto import stream
+from Pluto import keyring
+
+# find_spec only: cryptography is imported once a Fernet cipher is built (see Pluto.keyring)
+HAS_CRYPTO = importlib.util.find_spec('cryptography') is not None
+
+BACKENDS = {'file': FileStore, 'pack': PackStore}
 
-try:
-    from cryptography.fernet import Fernet
-    HAS_CRYPTO = True
-except Exception:
-    HAS_CRYPTO = False
 
 class PrivacyVault:
-    def __init__(self, key_path='vault/key.key', storage_dir='vault/data'):
+    def __init__(self, key_path='vault/key.key', storage_dir='vault/data', backend='file',
+                 cache_bytes=0, zero_on_evict=True, cipher=None, workers=None, durability='none',
+                 dedup=False, compression=None, compression_rules=None):
+        """`backend` is 'file' (one file per blob), 'pack' (append-only segments)
+        or a store object, see `Pluto.blobstore`; writes are atomic and
+        `durability` ('none', 'fsync' or 'group') decides when they are fsynced.
+        `cipher` names a `Pluto.ciphers` backend (default: Fernet if available).
+        `cache_bytes` > 0 keeps decrypted blobs in an LRU `ReadCache`.
+        `compression` is the default codec spec and `compression_rules` maps name
+        prefixes to specs (see `Pluto.compress`); plaintext is compressed before
+        it is encrypted.
+        """
         self.key_path = key_path
         self.storage_dir = storage_dir
-        os.makedirs(os.path.dirname(self.key_path), exist_ok=True)
-        os.makedirs(self.storage_dir, exist_ok=True)
-
-        if HAS_CRYPTO:
-            if not os.path.exists(self.key_path):
-                k = Fernet.generate_key()
-                with open(self.key_path, 'wb') as f:
-                    f.write(k)
-            self.key = open(self.key_path, 'rb').read()
-            self.cipher = Fernet(self.key)
+        if isinstance(backend, str):
+            backend = BACKENDS[backend](self.storage_dir, durability=durability)  # creates the dir
         else:
-            warnings.warn('cryptography not available — using fallback XOR cipher (demo only)')
-            if not os.path.exists(self.key_path):
-                with open(self.key_path, 'wb') as f:
-                    f.write(b'pluto-fallback-key-16')
-            self.key = open(self.key_path, 'rb').read()
+            os.makedirs(self.storage_dir, exist_ok=True)
+        self.backend = backend
+        self.cache = ReadCache(cache_bytes, zero_on_evict) if cache_bytes else None
+        self.workers = workers or min(32, (os.cpu_count() or 1) + 4)
+        self._pool = None
+
+        if cipher is None:
+            cipher = FernetCipher.name if HAS_CRYPTO else available()[0]
+            if not HAS_CRYPTO:
+                warnings.warn('cryptography not available — using fallback XOR cipher (demo only)')
+        cipher_cls = CIPHERS[cipher] if isinstance(cipher, str) else cipher
+        self.key, self.cipher = keyring.get(self.key_path, cipher_cls)
+        self.refs = cas.RefTable(self.storage_dir) if dedup else None
+        self._dedup_key = cas.dedup_key(self.key) if dedup else None
+        self.compression = compress.CompressionPolicy(compression, compression_rules)
 
     def encrypt(self, data: bytes) -> bytes:
-        if HAS_CRYPTO:
-            return self.cipher.encrypt(data)
-        else:
-            return self._xor(data)
+        return self.cipher.encrypt(data)
 
     def decrypt(self, token: bytes) -> bytes:
-        if HAS_CRYPTO:
-            return self.cipher.decrypt(token)
+        return self.cipher.decrypt(token)
+
+    def _seal(self, name, data, compression=None) -> bytes:
+        """Compress (per policy or explicit spec), encrypt, and prefix the codec header."""
+        spec = self.compression.for_name(name) if compression is None else compression
+        cid, payload = compress.compress(data, spec)
+        token = self.encrypt(payload)
+        return compress.header(cid) + token if cid else token
+
+    def _unseal(self, blob) -> bytes:
+        cid, token = compress.split_header(blob)
+        return compress.decompress(cid, self.decrypt(token))
+
+    def store(self, name: str, data: bytes, compression=None):
+        """Store encrypted blob under `name` in the backend.
+
+        `compression` overrides the policy for this call: a codec name,
+        `(name, level)` or 'none'.
+        """
+        if self.refs is not None:
+            self._store_dedup(name, data, compression)
         else:
-            return self._xor(token)
+            self.backend.put(name, self._seal(name, data, compression))
+        if self.cache:
+            self.cache.invalidate(name)
+
+    def _store_dedup(self, name, data, compression=None):
+        digest = cas.content_digest(self._dedup_key, data)
+        old = self._ref_of(name)
+        if old == digest:
+            return
+        obj = cas.object_name(digest)
+        # a concurrent _release must not delete the object between check and incr
+        with self.refs.lock(digest):
+            if self.refs.get(digest) == 0 or obj not in self.backend:
+                self.backend.put(obj, self._seal(name, data, compression))
+            # count first, release last: a crash leaks an object rather than losing one
+            self.refs.incr(digest, len(data))
+        self.backend.put(name, self.encrypt(cas.make_ref(digest)))
+        if old:
+            self._release(old)
 
-    def store(self, name: str, data: bytes):
-        """Store encrypted blob as `storage_dir/{name}.dat`."""
-        token = self.encrypt(data)
-        path = os.path.join(self.storage_dir, f"{name}.dat")
-        with open(path, 'wb') as f:
-            f.write(token)
+    def _ref_of(self, name):
+        try:
+            blob = self.backend.get(name)
+        except KeyError:
+            return None
+        if stream.is_stream(blob):
+            return None
+        return cas.parse_ref(self._unseal(blob))
+
+    def _release(self, digest):
+        with self.refs.lock(digest):
+            if self.refs.decr(digest) == 0:
+                try:
+                    self.backend.delete(cas.object_name(digest))
+                except KeyError:
+                    pass
+
+    def _resolve(self, plain) -> bytes:
+        # follow a dedup pointer to the shared object
+        digest = cas.parse_ref(plain)
+        if digest is None:
+            return plain
+        return self._unseal(self.backend.get(cas.object_name(digest)))
 
     def retrieve(self, name: str) -> bytes:
-        path = os.path.join(self.storage_dir, f"{name}.dat")
-        if not os.path.exists(path):
-            raise KeyError(name)
-        with open(path, 'rb') as f:
-            return self.decrypt(f.read())
-
-    def _xor(self, data: bytes) -> bytes:
-        k = self.key
-        return bytes(b ^ k[i % len(k)] for i, b in enumerate(data))
+        if not self.cache:
+            return self._decrypt_blob(self.backend.get(name))
+        stamp = self.backend.stamp(name)
+        data = self.cache.get(name, stamp)
+        if data is None:
+            data = self._decrypt_blob(self.backend.get(name))
+            self.cache.put(name, stamp, data)
+        return data
+
+    def _decrypt_blob(self, blob) -> bytes:
+        if stream.is_stream(blob):
+            with stream.ChunkReader(self, ViewReader(blob)) as r:
+                return r.read()
+        return self._resolve(self._unseal(blob))
+
+    def retrieve_range(self, name: str, offset: int, length: int = None) -> bytes:
+        """Read `length` bytes (default: the rest) at `offset`.
+
+        Stream blobs only decrypt the chunks touched; other blobs are decrypted whole.
+        """
+        with self.open_reader(name) as r:
+            r.seek(offset)
+            return r.read(-1 if length is None else length)
+
+    def open_writer(self, name: str, chunk_size: int = stream.CHUNK_SIZE, on_commit=None):
+        """File object that stores `name` as a chunked stream blob on close().
+
+        Chunks are encrypted independently (see `Pluto.stream`), so large
+        blobs never sit in memory whole and range reads only decrypt the
+        chunks they touch. `abort()` (or an exception inside `with`)
+        discards the write; `on_commit()` is only called once the blob was
+        stored.
+        """
+        old = self._ref_of(name) if self.refs is not None else None
+
+        def on_close():
+            if self.cache:
+                self.cache.invalidate(name)
+            if old:
+                self._release(old)
+            if on_commit:
+                on_commit()
+        return stream.ChunkWriter(self, self.backend.open_writer(name), chunk_size, on_close)
+
+    def open_reader(self, name: str):
+        """Seekable file object over a blob; only stream blobs avoid a full decrypt."""
+        raw = self.backend.open_reader(name)
+        if stream.is_stream(raw.pread(0, len(stream.MAGIC))):
+            return stream.ChunkReader(self, raw)
+        try:
+            return io.BytesIO(self._resolve(self._unseal(raw.pread(0, raw.size))))
+        finally:
+            raw.close()
+
+    def delete(self, name: str):
+        if self.cache:
+            self.cache.invalidate(name)
+        old = self._ref_of(name) if self.refs is not None else None
+        self.backend.delete(name)
+        if old:
+            self._release(old)
+
+    def dedup_stats(self):
+        """Objects, references, logical/stored/saved bytes and dedup ratio.
+
+        With `dedup=True` identical contents are stored once as a shared
+        object that names point to (see `Pluto.dedup`); empty otherwise.
+        """
+        return self.refs.stats() if self.refs is not None else {}
+
+    def dedup_gc(self):
+        """Recount references from the pointers and delete orphaned objects.
+
+        Returns the number of objects removed.
+        """
+        counts = {}
+        sizes = {k: v[1] for k, v in self.refs.counts.items()}
+        for name in self.names():
+            digest = self._ref_of(name)
+            if digest:
+                if digest not in sizes:
+                    sizes[digest] = len(self.retrieve(name))
+                counts.setdefault(digest, [0, sizes[digest]])[0] += 1
+        removed = 0
+        for name in self.backend.names():
+            if name.startswith(cas.CAS_PREFIX) and name[len(cas.CAS_PREFIX):] not in counts:
+                self.backend.delete(name)
+                removed += 1
+        self.refs.reset(counts)
+        return removed
+
+    def cache_stats(self):
+        """Hit/miss/eviction counters of the read cache (empty if disabled)."""
+        return self.cache.stats() if self.cache else {}
+
+    def names(self):
+        """Names of all stored blobs."""
+        return [n for n in self.backend.names() if not n.startswith(cas.CAS_PREFIX)]
+
+    def _imap(self, fn, items, workers=None):
+        """Apply `fn` to `items` on the pool, yielding results as they complete.
+
+        At most a few tasks per worker are in flight, so huge iterables are
+        consumed lazily instead of being submitted all at once.
+        """
+        from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+        workers = workers or self.workers
+        if workers == self.workers:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix='vault')
+            pool, owned = self._pool, False
+        else:
+            pool, owned = ThreadPoolExecutor(workers, thread_name_prefix='vault'), True
+        try:
+            pending = set()
+            for item in items:
+                pending.add(pool.submit(fn, item))
+                if len(pending) >= workers * 4:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for fut in done:
+                        yield fut.result()
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    yield fut.result()
+        finally:
+            if owned:
+                pool.shutdown(wait=False)
+
+    def store_many(self, items, workers=None, sync_batch=256):
+        """Store `(name, data)` pairs on a thread pool, yielding names as they are stored.
+
+        Names are yielded in completion order, after the batch they belong to
+        has been fsynced with a single `backend.sync` call. A name that occurs
+        more than once is stored in order (the last pair wins) and yielded
+        once per occurrence.
+        """
+        def _store(item):
+            name, data, prev, done = item
+            try:
+                if prev is not None:
+                    # FIFO pool: prev was submitted first, so it is already running or done
+                    prev.wait()
+                self.store(name, data)
+            finally:
+                done.set()
+            return name
+
+        def _ordered():
+            latest = {}  # name -> Event set once its last submitted store finished
+            for i, (name, data) in enumerate(items, 1):
+                done = threading.Event()
+                yield name, data, latest.get(name), done
+                latest[name] = done
+                if i % 4096 == 0:
+                    latest = {k: e for k, e in latest.items() if not e.is_set()}
+        batch = []
+        for name in self._imap(_store, _ordered(), workers):
+            batch.append(name)
+            if len(batch) >= sync_batch:
+                self.backend.sync(batch)
+                yield from batch
+                batch = []
+        if batch:
+            self.backend.sync(batch)
+            yield from batch
+
+    def retrieve_many(self, names, workers=None):
+        """Retrieve blobs in parallel, yielding `(name, data)` as they complete."""
+        return self._imap(lambda name: (name, self.retrieve(name)), names, workers)
+
+    def close(self):
+        if self.refs is not None:
+            self.refs.close()
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        if self.cache:
+            self.cache.clear()
+        self.backend.close()
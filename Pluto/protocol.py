@@ -0,0 +1,142 @@
+"""
+Wire protocol for Collab peers: length-prefixed frames.
+
+Every frame is a 5-byte header (payload length as a big-endian u32, then a
+type byte) followed by the payload, so message boundaries survive TCP
+coalescing and splitting, and text is only decoded once a whole frame has
+arrived. Types: AUTH (token, the first frame when the server wants one),
+TEXT (UTF-8) and BINARY (opaque bytes) broadcasts, and ERROR (from the
+server; auth and protocol errors are followed by a disconnect).
+
+Rooms and direct messages: HELLO asks for a peer name (the server answers
+with the id it assigned), JOIN/LEAVE carry a room name, and ROOM/DIRECT
+frames carry a routing header (`ROUTE`: body kind, target and sender
+lengths) before the target (room or peer id), the sender (filled in by the
+server) and the body. PRESENCE frames are JSON: `{"event": "join"|"leave",
+"room", "peer"}`, or `{"event": "members", "room", "peers"}` for a joiner.
+
+Cluster links between server nodes (`Pluto.cluster`) use NODE (JSON
+handshake), INTEREST (JSON list of peer and room membership changes) and
+FORWARD frames, whose `FORWARD_HDR` (delivery kind, origin and target
+lengths, sequence number) precedes the origin, the target and the frames
+to hand to local clients; origin and sequence number form the message ID.
+
+`FrameDecoder.feed(data)` parses incrementally: whole frames are sliced
+straight out of the received chunk, and only an incomplete tail is kept in
+the decoder's buffer until the rest arrives.
+"""
+import struct
+
+HEADER = struct.Struct('>IB')
+ROUTE = struct.Struct('>BHH')
+FORWARD_HDR = struct.Struct('>BHHQ')
+MAX_FRAME = 16 << 20
+
+AUTH = 1
+TEXT = 2
+BINARY = 3
+ERROR = 4
+HELLO = 5
+JOIN = 6
+LEAVE = 7
+ROOM = 8
+DIRECT = 9
+PRESENCE = 10
+NODE = 11
+INTEREST = 12
+FORWARD = 13
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def encode_frame(ftype, payload):
+    return HEADER.pack(len(payload), ftype) + payload
+
+
+def encode_message(msg):
+    """TEXT frame for a str, BINARY frame for bytes."""
+    if isinstance(msg, str):
+        return encode_frame(TEXT, msg.encode('utf-8'))
+    return encode_frame(BINARY, bytes(msg))
+
+
+def routed_frame(ftype, kind, target, sender, body):
+    """ROOM/DIRECT frame; `target` and `sender` are str, `body` bytes of `kind` TEXT or BINARY."""
+    t = target.encode('utf-8')
+    s = sender.encode('utf-8')
+    return encode_frame(ftype, ROUTE.pack(kind, len(t), len(s)) + t + s + body)
+
+
+def encode_routed(ftype, target, msg, sender=''):
+    if isinstance(msg, str):
+        return routed_frame(ftype, TEXT, target, sender, msg.encode('utf-8'))
+    return routed_frame(ftype, BINARY, target, sender, bytes(msg))
+
+
+def parse_routed(payload):
+    """`(kind, target, sender, body bytes)` of a ROOM/DIRECT payload."""
+    if len(payload) < ROUTE.size:
+        raise ProtocolError("short routing header")
+    kind, tlen, slen = ROUTE.unpack_from(payload)
+    pos = ROUTE.size
+    if len(payload) < pos + tlen + slen:
+        raise ProtocolError("routing header longer than the frame")
+    target = payload[pos:pos + tlen].decode('utf-8', 'replace')
+    sender = payload[pos + tlen:pos + tlen + slen].decode('utf-8', 'replace')
+    return kind, target, sender, payload[pos + tlen + slen:]
+
+
+def forward_frame(kind, origin, seq, target, data):
+    o = origin.encode('utf-8')
+    t = target.encode('utf-8')
+    return encode_frame(FORWARD, FORWARD_HDR.pack(kind, len(o), len(t), seq) + o + t + data)
+
+
+def parse_forward(payload):
+    """`(kind, origin, seq, target, data)` of a FORWARD payload."""
+    if len(payload) < FORWARD_HDR.size:
+        raise ProtocolError("short forward header")
+    kind, olen, tlen, seq = FORWARD_HDR.unpack_from(payload)
+    pos = FORWARD_HDR.size
+    if len(payload) < pos + olen + tlen:
+        raise ProtocolError("forward header longer than the frame")
+    origin = payload[pos:pos + olen].decode('utf-8', 'replace')
+    target = payload[pos + olen:pos + olen + tlen].decode('utf-8', 'replace')
+    return kind, origin, seq, target, payload[pos + olen + tlen:]
+
+
+class FrameDecoder:
+    def __init__(self, max_frame=MAX_FRAME):
+        self.max_frame = max_frame
+        self._buf = bytearray()
+
+    def feed(self, data):
+        """Parse `data` (appended to any buffered tail); returns the complete `(type, payload)` frames."""
+        if self._buf:
+            self._buf += data
+            data = self._buf
+        frames = []
+        pos = 0
+        size = len(data)
+        hsize = HEADER.size
+        with memoryview(data) as view:
+            while size - pos >= hsize:
+                length, ftype = HEADER.unpack_from(data, pos)
+                if length > self.max_frame:
+                    raise ProtocolError(f"frame of {length} bytes exceeds the {self.max_frame} byte limit")
+                end = pos + hsize + length
+                if end > size:
+                    break
+                frames.append((ftype, bytes(view[pos + hsize:end])))
+                pos = end
+            if data is not self._buf and pos < size:
+                self._buf += view[pos:]
+        if data is self._buf:
+            del self._buf[:pos]
+        return frames
+
+    def pending(self):
+        """Bytes of an incomplete frame waiting for more data."""
+        return len(self._buf)
@@ -0,0 +1,82 @@
+"""
+LRU cache of decrypted blobs for PrivacyVault, bounded by a byte budget.
+
+Entries are tagged with a backend stamp (mtime/size/inode for files, the
+record location for packs); a lookup whose stamp no longer matches is treated
+as a miss, which catches writes made by other processes to the file backend.
+Plaintext is held in `bytearray`s so it can be zeroed when an entry is
+evicted or invalidated.
+"""
+import threading
+from collections import OrderedDict
+
+
+class ReadCache:
+    def __init__(self, max_bytes: int, zero_on_evict: bool = True):
+        self.max_bytes = max_bytes
+        self.zero_on_evict = zero_on_evict
+        self._entries = OrderedDict()  # name -> (stamp, bytearray)
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, name, stamp):
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] != stamp:
+                # changed on disk behind our back
+                self._drop(name)
+                self.invalidations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(name)
+            self.hits += 1
+            return bytes(entry[1])
+
+    def put(self, name, stamp, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if name in self._entries:
+                self._drop(name)
+            self._entries[name] = (stamp, bytearray(data))
+            self.bytes += len(data)
+            while self.bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def invalidate(self, name):
+        with self._lock:
+            if name in self._entries:
+                self._drop(name)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            for name in list(self._entries):
+                self._drop(name)
+
+    def _drop(self, name):
+        _, buf = self._entries.pop(name)
+        self.bytes -= len(buf)
+        if self.zero_on_evict:
+            buf[:] = bytes(len(buf))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
@@ -0,0 +1,166 @@
+"""
+Per-service resource accounting and limits for the Supervisor.
+
+`read_proc(pid)` samples CPU time, RSS/VMS, open FDs and I/O bytes from
+`/proc/<pid>` (Linux; None elsewhere or once the process is gone). Samples go
+into a `ResourceSeries`, a fixed-capacity ring of `array` columns, so a long
+history costs a few bytes per sample instead of a dict each.
+
+`Limits` sets rlimits on a service (memory is RLIMIT_AS, i.e. address space;
+CPU seconds; open files). The supervisor applies them with `prlimit` right
+after spawning, so no Python code runs in the child between fork and exec;
+where `prlimit` is missing (non-Linux) they are set from `preexec_fn`. The kernel does not
+say which limit killed a process, so limit-hit events are inferred: SIGXCPU or
+SIGKILL after the CPU budget means 'cpu', a failed exit near the memory limit
+means 'memory', and samples within 10% of a limit raise a '-near' warning.
+"""
+import os
+import signal
+from array import array
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_PAGE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+_TICK = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+NEAR = 0.9  # fraction of a limit that counts as "near"
+HAS_PRLIMIT = hasattr(resource, 'prlimit')
+
+FIELDS = ('ts', 'cpu', 'rss', 'vms', 'fds', 'read_bytes', 'write_bytes')
+
+
+def read_proc(pid):
+    """Return a sample dict for `pid`, or None if it cannot be read."""
+    base = f"/proc/{pid}"
+    try:
+        with open(f"{base}/stat", 'rb') as f:
+            stat = f.read().rsplit(b')', 1)[1].split()
+        with open(f"{base}/statm", 'rb') as f:
+            statm = f.read().split()
+        fds = len(os.listdir(f"{base}/fd"))
+    except OSError:
+        return None
+    sample = {
+        'cpu': (int(stat[11]) + int(stat[12])) / _TICK,
+        'rss': int(statm[1]) * _PAGE,
+        'vms': int(statm[0]) * _PAGE,
+        'fds': fds,
+        'read_bytes': 0,
+        'write_bytes': 0,
+    }
+    try:
+        with open(f"{base}/io", 'rb') as f:
+            for row in f:
+                key, _, value = row.partition(b':')
+                if key in (b'read_bytes', b'write_bytes'):
+                    sample[key.decode()] = int(value)
+    except OSError:
+        pass  # /proc/<pid>/io needs ptrace access; leave the counters at 0
+    return sample
+
+
+class ResourceSeries:
+    """Ring buffer of samples stored column-wise in `array`s."""
+
+    def __init__(self, capacity=720):
+        self.capacity = capacity
+        self._cols = {name: array('d', bytes(8 * capacity)) for name in FIELDS}
+        self._next = 0
+        self._count = 0
+
+    def add(self, ts, sample):
+        i = self._next
+        self._cols['ts'][i] = ts
+        for name in FIELDS[1:]:
+            self._cols[name][i] = sample[name]
+        self._next = (i + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def __len__(self):
+        return self._count
+
+    def _row(self, i):
+        row = {name: int(self._cols[name][i]) for name in FIELDS}
+        row['ts'] = self._cols['ts'][i]
+        row['cpu'] = self._cols['cpu'][i]
+        return row
+
+    def samples(self, since=None):
+        """Samples oldest first, optionally only those taken at or after `since`."""
+        start = (self._next - self._count) % self.capacity
+        rows = [self._row((start + k) % self.capacity) for k in range(self._count)]
+        if since is not None:
+            rows = [r for r in rows if r['ts'] >= since]
+        return rows
+
+    def latest(self):
+        """Newest sample plus `cpu_percent` over the previous interval, or None."""
+        if not self._count:
+            return None
+        last = self._row((self._next - 1) % self.capacity)
+        if self._count > 1:
+            prev = self._row((self._next - 2) % self.capacity)
+            span = last['ts'] - prev['ts']
+            last['cpu_percent'] = 100.0 * (last['cpu'] - prev['cpu']) / span if span > 0 else 0.0
+        return last
+
+
+class Limits:
+    """rlimits for a service: `memory` bytes, `cpu` seconds, `nofile` descriptors."""
+
+    def __init__(self, memory=None, cpu=None, nofile=None):
+        self.memory = memory
+        self.cpu = cpu
+        self.nofile = nofile
+
+    def __bool__(self):
+        return any(v is not None for v in (self.memory, self.cpu, self.nofile))
+
+    def as_dict(self):
+        return {'memory': self.memory, 'cpu': self.cpu, 'nofile': self.nofile}
+
+    def rlimits(self):
+        """`(resource, (soft, hard))` pairs for the limits that are set."""
+        out = []
+        if self.memory is not None:
+            out.append((resource.RLIMIT_AS, (self.memory, self.memory)))
+        if self.cpu is not None:
+            # SIGXCPU at the soft limit, SIGKILL one second later
+            out.append((resource.RLIMIT_CPU, (self.cpu, self.cpu + 1)))
+        if self.nofile is not None:
+            out.append((resource.RLIMIT_NOFILE, (self.nofile, self.nofile)))
+        return out
+
+    def apply(self, pid=0):
+        """Set the limits on process `pid` (0: the calling process, e.g. a zygote child)."""
+        for res, limit in self.rlimits():
+            if pid:
+                resource.prlimit(pid, res, limit)
+            else:
+                resource.setrlimit(res, limit)
+
+    def sample_events(self, sample):
+        """'-near' warnings for a running process."""
+        events = []
+        if self.memory is not None and sample['vms'] >= self.memory * NEAR:
+            events.append(('memory-near', f"address space {int(sample['vms'])} of {self.memory} bytes"))
+        if self.cpu is not None and sample['cpu'] >= self.cpu * NEAR:
+            events.append(('cpu-near', f"{sample['cpu']:.1f} of {self.cpu} CPU seconds"))
+        if self.nofile is not None and sample['fds'] >= self.nofile * NEAR:
+            events.append(('nofile-near', f"{int(sample['fds'])} of {self.nofile} open files"))
+        return events
+
+    def exit_event(self, rc, sample):
+        """The limit that most likely ended a process with exit code `rc`, if any."""
+        if rc == 0:
+            return None
+        if self.cpu is not None and (rc == -getattr(signal, 'SIGXCPU', 0) or
+                                     (rc == -signal.SIGKILL and sample and sample['cpu'] >= self.cpu * NEAR)):
+            return 'cpu', f"exceeded {self.cpu} CPU seconds (exit code {rc})"
+        if self.memory is not None and sample and sample['vms'] >= self.memory * NEAR:
+            return 'memory', f"exited with {rc} near the {self.memory} byte memory limit"
+        if self.nofile is not None and sample and sample['fds'] >= self.nofile * NEAR:
+            return 'nofile', f"exited with {rc} near the {self.nofile} open file limit"
+        return None
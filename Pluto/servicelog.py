@@ -0,0 +1,210 @@
+"""
+Per-service log capture for the Supervisor.
+
+The newest `max_lines` lines live in a ring buffer (`collections.deque`), so
+appending is O(1) however chatty a service is. With a `spill_dir`, every line
+is also written, `segment_lines` at a time, to gzip segment files
+(`{first seq}.log.gz`, one `ts<TAB>line` per row; backslashes and newlines
+in `line` are escaped, so every append is exactly one row); `index.jsonl` records
+each segment's sequence range, time range and size, and old segments are
+dropped beyond `max_segments` / `max_bytes`. Queries walk the ring, the
+not yet spilled lines and then the segments, newest first, skipping whole
+segments by the index: a `tail` stops as soon as it has enough lines and a
+`since` stops at the first segment that ends before it.
+"""
+import gzip
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+
+INDEX = 'index.jsonl'
+_UNESCAPE = re.compile(r'\\(.)', re.S)
+
+
+def _escape(text):
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def _unescape(text):
+    if '\\' not in text:
+        return text
+    return _UNESCAPE.sub(lambda m: '\n' if m.group(1) == 'n' else m.group(1), text)
+
+
+class ServiceLog:
+    def __init__(self, max_lines=1000, spill_dir=None, segment_lines=10000, max_segments=None,
+                 max_bytes=None, compresslevel=1):
+        self.max_lines = max_lines
+        self.spill_dir = spill_dir
+        self.segment_lines = segment_lines
+        self.max_segments = max_segments
+        self.max_bytes = max_bytes
+        self.compresslevel = compresslevel
+        self._lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._ring = deque(maxlen=max_lines)  # (seq, ts, line)
+        self._pending = []    # lines not yet in a segment, oldest first
+        self._flushing = []   # the batch currently being written
+        self._segments = []   # [first_seq, last_seq, first_ts, last_ts, file, bytes]
+        self._next_seq = 0
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+            self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(os.path.join(self.spill_dir, INDEX), 'r') as f:
+                for row in f:
+                    try:
+                        seg = json.loads(row)
+                    except ValueError:
+                        break  # torn last row
+                    if os.path.exists(os.path.join(self.spill_dir, seg[4])):
+                        self._segments.append(seg)
+        except OSError:
+            pass
+        if self._segments:
+            self._next_seq = self._segments[-1][1] + 1
+
+    def _save_index(self):
+        tmp = os.path.join(self.spill_dir, INDEX + '.tmp')
+        with open(tmp, 'w') as f:
+            for seg in self._segments:
+                f.write(json.dumps(seg) + '\n')
+        os.replace(tmp, os.path.join(self.spill_dir, INDEX))
+
+    def append(self, line, ts=None):
+        ts = time.time() if ts is None else ts
+        with self._lock:
+            entry = (self._next_seq, ts, line)
+            self._next_seq += 1
+            self._ring.append(entry)
+            if self.spill_dir is None:
+                return
+            self._pending.append(entry)
+            if len(self._pending) < self.segment_lines:
+                return
+        self.flush()
+
+    def flush(self):
+        """Write not yet spilled lines to a new segment (no-op without `spill_dir`)."""
+        if self.spill_dir is None:
+            return
+        with self._spill_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+                self._flushing = batch
+            if not batch:
+                return
+            name = f"{batch[0][0]:012d}.log.gz"
+            path = os.path.join(self.spill_dir, name)
+            data = ''.join(f"{ts:.6f}\t{_escape(line)}\n" for _, ts, line in batch).encode('utf-8', 'replace')
+            with gzip.open(path, 'wb', compresslevel=self.compresslevel) as f:
+                f.write(data)
+            seg = [batch[0][0], batch[-1][0], batch[0][1], batch[-1][1], name, os.path.getsize(path)]
+            with self._lock:
+                self._segments.append(seg)
+                self._flushing = []
+                dropped = self._apply_retention()
+            for old in dropped:
+                try:
+                    os.remove(os.path.join(self.spill_dir, old[4]))
+                except OSError:
+                    pass
+            self._save_index()
+
+    def _apply_retention(self):
+        dropped = []
+        total = sum(seg[5] for seg in self._segments)
+        while len(self._segments) > 1 and (
+                (self.max_segments is not None and len(self._segments) > self.max_segments)
+                or (self.max_bytes is not None and total > self.max_bytes)):
+            seg = self._segments.pop(0)
+            total -= seg[5]
+            dropped.append(seg)
+        return dropped
+
+    def _read_segment(self, seg, grep=None, regex=None):
+        try:
+            with gzip.open(os.path.join(self.spill_dir, seg[4]), 'rb') as f:
+                text = f.read().decode('utf-8', 'replace')
+        except (OSError, EOFError):
+            return []
+        raw_grep = None if grep is None else _escape(grep)
+        if raw_grep is not None and raw_grep not in text:
+            return []  # cheap whole-segment check: most segments hold no match
+        out = []
+        for i, row in enumerate(text.split('\n')[:-1]):
+            if raw_grep is not None and raw_grep not in row:
+                continue
+            ts, _, line = row.partition('\t')
+            line = _unescape(line)
+            if (grep is None or grep in line) and (regex is None or regex.search(line)):
+                out.append((seg[0] + i, float(ts), line))
+        return out
+
+    def _sources(self):
+        """Yield `(rows, segment)` newest source first; rows are in seq order, or None for a segment."""
+        with self._lock:
+            ring = list(self._ring)
+            mem = self._flushing + self._pending
+            segments = list(self._segments)
+        yield ring, None
+        yield mem, None
+        for seg in reversed(segments):
+            yield None, seg
+
+    def _newest_first(self, since, grep=None, regex=None):
+        """Yield `(seq, ts, line)` newest first, each line once.
+
+        Spilled lines are already filtered by `grep`/`regex`; in-memory ones are not.
+        """
+        floor = None
+        for rows, seg in self._sources():
+            if seg is not None:
+                if since is not None and seg[3] < since:
+                    return
+                if floor is not None and seg[0] >= floor:
+                    continue
+                first = seg[0]
+                rows = self._read_segment(seg, grep, regex)
+            elif rows:
+                first = rows[0][0]
+            else:
+                continue
+            for entry in reversed(rows):
+                if floor is not None and entry[0] >= floor:
+                    continue
+                if since is not None and entry[1] < since:
+                    return
+                yield entry
+            floor = first if floor is None else min(floor, first)
+
+    def query(self, tail=50, since=None, grep=None, regex=None):
+        """Lines matching all filters, oldest first; at most the last `tail` of them."""
+        if isinstance(regex, str):
+            regex = re.compile(regex)
+        out = []
+        for _, _, line in self._newest_first(since, grep, regex):
+            if grep is not None and grep not in line:
+                continue
+            if regex is not None and not regex.search(line):
+                continue
+            out.append(line)
+            if tail is not None and len(out) >= tail:
+                break
+        out.reverse()
+        return out
+
+    def stats(self):
+        with self._lock:
+            return {
+                'lines': self._next_seq,
+                'in_memory': len(self._ring),
+                'unspilled': len(self._pending) + len(self._flushing),
+                'segments': len(self._segments),
+                'spilled_bytes': sum(seg[5] for seg in self._segments),
+            }
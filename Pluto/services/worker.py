@@ -6,17 +6,21 @@ import time
 import argparse
 
 
-def main(name='worker'):
+def main(name='worker', imports=()):
+    for module in imports:
+        __import__(module)  # simulate a service that uses heavier Pluto modules
     try:
         while True:
-            print(f"[{name}] heartbeat")
+            # flush: stdout is a pipe to the supervisor, which would otherwise see nothing for a long time
+            print(f"[{name}] heartbeat", flush=True)
             time.sleep(2)
     except KeyboardInterrupt:
-        print(f"[{name}] stopping")
+        print(f"[{name}] stopping", flush=True)
 
 
 if __name__ == '__main__':
     p = argparse.ArgumentParser()
     p.add_argument('--name', default='worker')
+    p.add_argument('--imports', default='', help='comma-separated modules to import at startup')
     args = p.parse_args()
-    main(args.name)
+    main(args.name, [m for m in args.imports.split(',') if m])
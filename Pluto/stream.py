@@ -0,0 +1,163 @@
+"""
+Chunked streaming encryption for large vault blobs.
+
+A stream blob is `MAGIC | chunk_size` followed by records `length | token`,
+where each token is the vault cipher applied to `index | last | chunk`.
+Chunks are encrypted and authenticated independently, so memory use stays at
+one chunk and a range read only decrypts the chunks it touches. Every full
+chunk encrypts to the same token size, which makes record offsets computable;
+the index and `last` flag inside each token detect reordering and truncation.
+"""
+import io
+import struct
+
+MAGIC = b'PLS1'
+CHUNK_SIZE = 64 * 1024
+
+_HEADER = struct.Struct('>4sI')   # magic, chunk size
+_LEN = struct.Struct('>I')        # token length
+_CHUNK = struct.Struct('>QB')     # chunk index, last flag
+
+
+def is_stream(head) -> bool:
+    return bytes(head[:len(MAGIC)]) == MAGIC
+
+
+class ChunkWriter(io.RawIOBase):
+    """Write-only file object that encrypts in `chunk_size` pieces."""
+
+    def __init__(self, vault, raw, chunk_size=CHUNK_SIZE, on_close=None):
+        self.vault = vault
+        self.raw = raw
+        self.chunk_size = chunk_size
+        self.on_close = on_close
+        self._buf = bytearray()
+        self._index = 0
+        raw.write(_HEADER.pack(MAGIC, chunk_size))
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buf += data
+        # hold back the final chunk until close() so it can be flagged as last
+        while len(self._buf) > self.chunk_size:
+            self._emit(self._buf[:self.chunk_size], False)
+            del self._buf[:self.chunk_size]
+        return len(data)
+
+    def _emit(self, chunk, last):
+        token = self.vault.encrypt(_CHUNK.pack(self._index, last) + bytes(chunk))
+        self.raw.write(_LEN.pack(len(token)))
+        self.raw.write(token)
+        self._index += 1
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self._emit(self._buf, True)
+            self.raw.close()
+        finally:
+            super().close()
+        if self.on_close:
+            self.on_close()
+
+    def abort(self):
+        """Discard everything written; the stored blob (if any) is left as it was."""
+        if self.closed:
+            return
+        try:
+            self.raw.abort()
+        finally:
+            super().close()
+
+    def __exit__(self, exc_type, exc, tb):
+        # an exception inside `with` must not commit a partial blob
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+
+class ChunkReader(io.RawIOBase):
+    """Seekable read-only file object over a stream blob.
+
+    `raw` must provide `size` and `pread(offset, n)`.
+    """
+
+    def __init__(self, vault, raw):
+        self.vault = vault
+        self.raw = raw
+        magic, self.chunk_size = _HEADER.unpack(bytes(raw.pread(0, _HEADER.size)))
+        if magic != MAGIC:
+            raise ValueError('not a stream blob')
+        first_len, = _LEN.unpack(bytes(raw.pread(_HEADER.size, _LEN.size)))
+        self._stride = _LEN.size + first_len
+        self._nchunks = -(-(raw.size - _HEADER.size) // self._stride)
+        self._cached = (None, b'')
+        last = self._chunk(self._nchunks - 1)
+        self.size = (self._nchunks - 1) * self.chunk_size + len(last)
+        self._pos = 0
+
+    def _chunk(self, i):
+        if self._cached[0] == i:
+            return self._cached[1]
+        off = _HEADER.size + i * self._stride
+        length, = _LEN.unpack(bytes(self.raw.pread(off, _LEN.size)))
+        plain = self.vault.decrypt(self.raw.pread(off + _LEN.size, length))
+        index, last = _CHUNK.unpack_from(plain)
+        if index != i or bool(last) != (i == self._nchunks - 1):
+            raise ValueError('stream chunk out of order or truncated')
+        data = plain[_CHUNK.size:]
+        self._cached = (i, data)
+        return data
+
+    def pread(self, offset, length):
+        """Return up to `length` bytes at `offset`, decrypting only the chunks needed."""
+        end = min(self.size, offset + length)
+        out = []
+        while offset < end:
+            i, skip = divmod(offset, self.chunk_size)
+            data = self._chunk(i)[skip:skip + end - offset]
+            out.append(data)
+            offset += len(data)
+        return b''.join(out)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, n=-1):
+        if n is None or n < 0:
+            n = self.size - self._pos
+        data = self.pread(self._pos, n)
+        self._pos += len(data)
+        return data
+
+    def readall(self):
+        return self.read()
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self._pos = max(0, offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        if not self.closed:
+            self.raw.close()
+        super().close()
+
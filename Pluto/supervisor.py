@@ -1,115 +1,612 @@
 """
 Simple Supervisor: launch/monitor/restart services (userland service manager).
+
+All services share one `Monitor` thread: a `selectors` loop over each child's
+stdout pipe and a pidfd per child (Linux 5.3+), so exits are seen as soon as
+they happen and the thread count does not grow with the number of services.
+Where pidfds are unavailable the loop polls its children every
+`Monitor.POLL_INTERVAL` seconds instead.
+Output is kept per service in a `ServiceLog` ring buffer; with `log_dir` it is
+also spilled to compressed segments that `get_logs` can search.
+Crashed services are restarted per their `RestartPolicy` (exponential backoff
+with jitter, at most `max_restarts` per `window` before the service is marked
+'failed'). `start_all`/`stop_all` walk the `depends_on` graph in stages: every
+service in a stage is started on a bounded thread pool (or sent SIGTERM) at
+once, and each stage gets its own timeout. The supervisor lock is only held
+to snapshot the service table, never across process operations.
+Every `sample_interval` seconds the monitor thread samples each service's
+/proc counters into a `ResourceSeries`; optional `Limits` are applied with
+prlimit as soon as the child is spawned, and limit hits show up in `status()` (see
+`Pluto.resources`). With `zygote=True`, `python -m` services are forked from a
+pre-warmed helper process instead of exec'ing a new interpreter (see
+`Pluto.zygote`).
 """
+import heapq
+import itertools
+import os
+import random
+import selectors
 import subprocess
 import threading
 import time
 import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
 from typing import Dict
+from Pluto.servicelog import ServiceLog
+from Pluto.resources import HAS_PRLIMIT, Limits, ResourceSeries, read_proc
+from Pluto.zygote import Zygote, is_module_cmd
+
+
+class Monitor:
+    """Single event-loop thread that reads service output and detects exits."""
+
+    POLL_INTERVAL = 0.1  # exit polling period when pidfds are not available
+
+    def __init__(self):
+        self._sel = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self._sel.register(self._wake_r, selectors.EVENT_READ, None)
+        self._lock = threading.Lock()
+        self._calls = []
+        self._timers = []  # heap of (deadline, seq, fn)
+        self._seq = itertools.count()
+        self._polled = {}  # pid -> (process, on_exit) without a pidfd
+        self._thread = None
+        self._closed = False
+        self._use_pidfd = hasattr(os, 'pidfd_open')
+
+    # -- thread-safe API --------------------------------------------------
+
+    def call_soon(self, fn):
+        with self._lock:
+            if self._closed:
+                return
+            self._calls.append(fn)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='pluto-monitor', daemon=True)
+                self._thread.start()
+        self._wake()
+
+    def call_later(self, delay, fn):
+        deadline = time.monotonic() + delay
+        self.call_soon(lambda: heapq.heappush(self._timers, (deadline, next(self._seq), fn)))
+
+    def watch(self, process, on_line, on_exit):
+        """Feed `process.stdout` lines to `on_line` and call `on_exit(returncode)` once it exits."""
+        self.call_soon(lambda: self._add(process, on_line, on_exit))
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+        self._wake()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=2)
+
+    # -- loop thread ------------------------------------------------------
+
+    def _wake(self):
+        try:
+            os.write(self._wake_w, b'\0')
+        except (BlockingIOError, OSError):
+            pass  # pipe full (a wakeup is already pending) or closed
+
+    def _add(self, process, on_line, on_exit):
+        if process.stdout is not None:
+            fd = process.stdout.fileno()
+            os.set_blocking(fd, False)
+            self._sel.register(fd, selectors.EVENT_READ, ('out', process, on_line, bytearray()))
+        if hasattr(process, 'add_exit_callback'):
+            # not our child (e.g. forked by the zygote): its owner reports the exit
+            process.add_exit_callback(lambda rc: self.call_soon(lambda: on_exit(rc)))
+            return
+        pidfd = None
+        if self._use_pidfd:
+            try:
+                pidfd = os.pidfd_open(process.pid)
+            except OSError:
+                pidfd = None  # already reaped, or kernel without pidfd support
+        if pidfd is not None:
+            self._sel.register(pidfd, selectors.EVENT_READ, ('exit', process, on_exit))
+        else:
+            self._polled[process.pid] = (process, on_exit)
+
+    def _read(self, key):
+        _, process, on_line, buf = key.data
+        try:
+            chunk = os.read(key.fd, 65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            chunk = b''
+        if chunk:
+            buf += chunk
+            *lines, rest = buf.split(b'\n')
+            buf[:] = rest
+            for line in lines:
+                on_line(line.decode('utf-8', 'replace'))
+            return
+        if buf:
+            on_line(buf.decode('utf-8', 'replace'))
+        self._sel.unregister(key.fd)
+        process.stdout.close()
+
+    def _exited(self, key):
+        _, process, on_exit = key.data
+        rc = process.poll()
+        if rc is None:
+            return
+        self._sel.unregister(key.fd)
+        os.close(key.fd)
+        on_exit(rc)
+
+    def _poll_children(self):
+        for pid, (process, on_exit) in list(self._polled.items()):
+            rc = process.poll()
+            if rc is not None:
+                del self._polled[pid]
+                on_exit(rc)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                calls, self._calls = self._calls, []
+                closed = self._closed
+            if closed:
+                break
+            for fn in calls:
+                self._safe(fn)
+            now = time.monotonic()
+            while self._timers and self._timers[0][0] <= now:
+                self._safe(heapq.heappop(self._timers)[2])
+            timeout = self._timers[0][0] - now if self._timers else None
+            if self._polled:
+                timeout = self.POLL_INTERVAL if timeout is None else min(timeout, self.POLL_INTERVAL)
+            for key, _ in self._sel.select(timeout):
+                if key.data is None:
+                    try:
+                        while os.read(self._wake_r, 4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                elif key.data[0] == 'out':
+                    self._safe(self._read, key)
+                else:
+                    self._safe(self._exited, key)
+            if self._polled:
+                self._poll_children()
+        for key in list(self._sel.get_map().values()):
+            if key.data is not None and key.data[0] == 'exit':
+                os.close(key.fd)
+        self._sel.close()
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+
+    @staticmethod
+    def _safe(fn, *args):
+        try:
+            fn(*args)
+        except Exception as e:
+            # a faulty callback must not take the whole monitor down
+            print(f"[supervisor] monitor callback failed: {e!r}", file=sys.stderr)
+
+
+_shared_monitor = None
+
+
+def _default_monitor():
+    global _shared_monitor
+    if _shared_monitor is None:
+        _shared_monitor = Monitor()
+    return _shared_monitor
+
+
+class RestartPolicy:
+    """When and how fast a crashed service is restarted.
+
+    The n-th consecutive restart waits `backoff * factor**n` seconds (capped at
+    `max_backoff`, +/- `jitter` as a fraction). A run that lasted `reset_after`
+    seconds resets the sequence. More than `max_restarts` restarts within
+    `window` seconds means a crash loop: the service goes to 'failed' until it
+    is started again by hand. `restart_on` is 'always' or 'failure' (non-zero
+    exit codes only).
+    """
+
+    def __init__(self, backoff=0.1, factor=2.0, max_backoff=30.0, jitter=0.1,
+                 max_restarts=5, window=60.0, reset_after=10.0, restart_on='always'):
+        if restart_on not in ('always', 'failure'):
+            raise ValueError(f"restart_on must be 'always' or 'failure', not {restart_on!r}")
+        self.backoff = backoff
+        self.factor = factor
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.max_restarts = max_restarts
+        self.window = window
+        self.reset_after = reset_after
+        self.restart_on = restart_on
+
+    def delay(self, attempt):
+        base = min(self.max_backoff, self.backoff * self.factor ** attempt)
+        return max(0.0, base * (1 + random.uniform(-self.jitter, self.jitter)))
+
+    def wants_restart(self, rc):
+        return self.restart_on == 'always' or rc != 0
 
 
 class Service:
-    def __init__(self, name: str, cmd, restart: bool = True):
+    # states reported by status(): stopped, running, backoff, exited, failed
+    def __init__(self, name: str, cmd, restart: bool = True, monitor: Monitor = None,
+                 policy: RestartPolicy = None, depends_on=(), log_lines: int = 1000, log_dir: str = None,
+                 limits: Limits = None, history: int = 720, zygote: Zygote = None):
         self.name = name
         self.cmd = cmd
         self.restart = restart
+        self.policy = policy or RestartPolicy()
+        self.depends_on = tuple(depends_on)
+        self.monitor = monitor or _default_monitor()
         self.process = None
-        self._monitor_thread = None
+        self.state = 'stopped'
+        self.restarts = 0
+        self.last_exit_code = None
+        self._attempt = 0
+        self._recent = deque()  # monotonic times of recent restarts
+        self._started_at = None
         self._stop = threading.Event()
-        self._log_lines = []
-        self._log_lock = threading.Lock()
+        self.log = ServiceLog(log_lines, spill_dir=os.path.join(log_dir, name) if log_dir else None)
+        self._proc_lock = threading.Lock()
+        self.limits = limits if limits else None
+        self.zygote = zygote if zygote is not None and is_module_cmd(cmd) else None
+        self.resources = ResourceSeries(history)
+        self.limit_events = deque(maxlen=50)  # (time, kind, detail)
+        self._last_sample = None  # newest sample of the current process
+        self._warned = set()      # '-near' kinds already reported for the current process
 
     def start(self):
-        if self.process and self.process.poll() is None:
-            return
-        self._stop.clear()
-        # capture stdout/stderr for logs
-        self.process = subprocess.Popen(self.cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
-        # start a thread to read process output
-        threading.Thread(target=self._read_output, daemon=True).start()
-        self._monitor_thread = threading.Thread(target=self._monitor, daemon=True)
-        self._monitor_thread.start()
-
-    def _read_output(self):
-        if not self.process or not self.process.stdout:
+        """Start the service (a manual start also clears a crash-loop 'failed' state)."""
+        with self._proc_lock:
+            if self.process and self.process.poll() is None:
+                return
+            self._stop.clear()
+            self._attempt = 0
+            self._recent.clear()
+            self._spawn()
+
+    def _spawn(self):
+        # capture stdout/stderr for logs; the monitor thread reads the pipe
+        process = None
+        if self.zygote is not None:
+            try:
+                process = self.zygote.spawn(self.cmd, self.limits)
+            except OSError as e:
+                self._append_log(f"[supervisor] zygote spawn failed, falling back to exec: {e}")
+        if process is None:
+            # preexec_fn is not safe with start_all's threads; only used without prlimit
+            preexec = self.limits.apply if self.limits and not HAS_PRLIMIT else None
+            process = subprocess.Popen(self.cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                       preexec_fn=preexec)
+            if self.limits and HAS_PRLIMIT:
+                try:
+                    self.limits.apply(process.pid)
+                except ProcessLookupError:
+                    pass  # already exited; the monitor reports it
+        self.process = process
+        self._last_sample = None
+        self._warned = set()
+        self.state = 'running'
+        self._started_at = time.monotonic()
+        self.monitor.watch(process, self._append_log, lambda rc: self._on_exit(process, rc))
+
+    def _append_log(self, line):
+        self.log.append(line)
+
+    def _on_exit(self, process, rc):
+        # runs on the monitor thread; ignore stale processes and exits we caused
+        with self._proc_lock:
+            if process is not self.process:
+                return
+            self.last_exit_code = rc
+            if self.limits:
+                event = self.limits.exit_event(rc, self._last_sample)
+                if event:
+                    self._limit_event(*event)
+            if self._stop.is_set():
+                return
+            if not self.restart or not self.policy.wants_restart(rc):
+                self.state = 'exited'
+                return
+            now = time.monotonic()
+            if now - self._started_at >= self.policy.reset_after:
+                self._attempt = 0
+            while self._recent and now - self._recent[0] > self.policy.window:
+                self._recent.popleft()
+            if self.policy.max_restarts is not None and len(self._recent) >= self.policy.max_restarts:
+                self.state = 'failed'
+                msg = (f"[supervisor] {self.name} crash loop: {len(self._recent)} restarts in "
+                       f"{self.policy.window:g}s, last exit code {rc}; not restarting")
+            else:
+                delay = self.policy.delay(self._attempt)
+                self._attempt += 1
+                self._recent.append(now)
+                self.state = 'backoff'
+                msg = None
+        if msg:
+            self._append_log(msg)
             return
-        for line in self.process.stdout:
-            with self._log_lock:
-                self._log_lines.append(line.rstrip('\n'))
-                # keep last N lines
-                if len(self._log_lines) > 1000:
-                    self._log_lines.pop(0)
-
-    def _monitor(self):
-        while not self._stop.is_set():
-            if self.process is None:
-                break
-            rc = self.process.poll()
-            if rc is not None:
-                # process exited
-                if self.restart:
-                    time.sleep(0.5)
-                    self.start()
-                else:
-                    break
-            time.sleep(0.5)
+        self.monitor.call_later(delay, lambda: self._restart(process))
+
+    def _restart(self, process):
+        with self._proc_lock:
+            if self._stop.is_set() or process is not self.process:
+                return
+            try:
+                self._spawn()
+                self.restarts += 1
+                return
+            except OSError as e:
+                msg = f"[supervisor] restart failed: {e}"
+        self._append_log(msg)
+        self._on_exit(process, process.returncode)  # count it and back off again
 
-    def stop(self):
+    def stop(self, timeout: float = 2):
+        self._finish_stop(self._begin_stop(), time.monotonic() + timeout)
+
+    def _begin_stop(self):
+        """Cancel restarts and send SIGTERM; returns the process to wait for."""
         self._stop.set()
-        if self.process:
+        with self._proc_lock:
+            process, self.process = self.process, None
+            self.state = 'stopped'
+        if process:
+            try:
+                process.terminate()
+            except OSError:
+                pass  # already gone
+        return process
+
+    def _finish_stop(self, process, deadline):
+        """Wait for `process` until `deadline`, then SIGKILL it; True if it had to be killed."""
+        killed = False
+        if process:
             try:
-                self.process.terminate()
-                self.process.wait(timeout=2)
-            except Exception:
+                process.wait(timeout=max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                killed = True
                 try:
-                    self.process.kill()
-                except Exception:
+                    process.kill()
+                except OSError:
                     pass
-        self.process = None
+        self.log.flush()
+        return killed
 
-    def get_logs(self, tail: int = 50):
-        with self._log_lock:
-            return list(self._log_lines[-tail:])
+    def _limit_event(self, kind, detail):
+        self.limit_events.append((time.time(), kind, detail))
+        self._append_log(f"[supervisor] {self.name} limit {kind}: {detail}")
+
+    def sample(self):
+        """Record one resource sample of the running process (monitor thread)."""
+        process = self.process
+        if process is None or process.returncode is not None:
+            return
+        sample = read_proc(process.pid)
+        if sample is None:
+            return
+        self.resources.add(time.time(), sample)
+        self._last_sample = sample
+        if self.limits:
+            for kind, detail in self.limits.sample_events(sample):
+                if kind not in self._warned:
+                    self._warned.add(kind)
+                    self._limit_event(kind, detail)
+
+    def is_running(self):
+        process = self.process
+        return process is not None and process.poll() is None
+
+    def get_logs(self, tail: int = 50, since: float = None, grep: str = None, regex=None):
+        """Last `tail` lines (None for all) newer than `since`, containing `grep` / matching `regex`."""
+        return self.log.query(tail, since=since, grep=grep, regex=regex)
 
 
 class Supervisor:
-    def __init__(self):
+    def __init__(self, log_dir: str = None, log_lines: int = 1000, parallel: int = None,
+                 start_timeout: float = 10.0, stop_timeout: float = 2.0, sample_interval: float = 5.0,
+                 zygote: bool = False, zygote_preload=None):
         self.services: Dict[str, Service] = {}
         self.lock = threading.Lock()
+        self.monitor = Monitor()
+        self.log_dir = log_dir
+        self.log_lines = log_lines
+        self.parallel = parallel or min(32, (os.cpu_count() or 1) * 4)
+        self.start_timeout = start_timeout
+        self.stop_timeout = stop_timeout
+        self.last_boot = None      # report of the last start_all()
+        self.last_shutdown = None  # report of the last stop_all()
+        self.sample_interval = sample_interval
+        self._sampling = False
+        self.zygote = Zygote(*([zygote_preload] if zygote_preload is not None else [])) if zygote else None
 
-    def register_service(self, name: str, cmd, restart: bool = True):
+    def register_service(self, name: str, cmd, restart: bool = True, policy: RestartPolicy = None, depends_on=(),
+                         limits: Limits = None):
         with self.lock:
-            svc = Service(name, cmd, restart=restart)
+            svc = Service(name, cmd, restart=restart, monitor=self.monitor, policy=policy, depends_on=depends_on,
+                          log_lines=self.log_lines, log_dir=self.log_dir, limits=limits, zygote=self.zygote)
             self.services[name] = svc
 
+    def _start_order(self, names):
+        """`names` and everything they depend on, dependencies first."""
+        order, state = [], {}
+
+        def visit(name, path):
+            if state.get(name) == 'done':
+                return
+            if state.get(name) == 'visiting':
+                raise ValueError('dependency cycle: ' + ' -> '.join(path + [name]))
+            svc = self.services.get(name)
+            if svc is None:
+                raise KeyError(name if not path else f"{name} (required by {path[-1]})")
+            state[name] = 'visiting'
+            for dep in svc.depends_on:
+                visit(dep, path + [name])
+            state[name] = 'done'
+            order.append(svc)
+        for name in names:
+            visit(name, [])
+        return order
+
+    @staticmethod
+    def _stages(order):
+        """Group a dependencies-first order into stages whose members only depend on earlier stages."""
+        level, stages = {}, []
+        for svc in order:
+            n = 1 + max((level[d] for d in svc.depends_on), default=-1)
+            level[svc.name] = n
+            if n == len(stages):
+                stages.append([])
+            stages[n].append(svc)
+        return stages
+
+    def _start_sampling(self, services):
+        """Sample the just started `services` now, and every service every `sample_interval`."""
+        if not self.sample_interval:
+            return
+        with self.lock:
+            first, self._sampling = not self._sampling, True
+        if first:
+            self.monitor.call_soon(self._sample_all)
+            return
+        for svc in services:
+            self.monitor.call_soon(svc.sample)
+
+    def _sample_all(self):
+        # runs on the monitor thread and reschedules itself
+        with self.lock:
+            services = list(self.services.values())
+        for svc in services:
+            svc.sample()
+        self.monitor.call_later(self.sample_interval, self._sample_all)
+
+    def resource_history(self, name: str, since: float = None):
+        """Resource samples of `name`, oldest first."""
+        return self.services[name].resources.samples(since)
+
     def start_service(self, name: str):
+        """Start `name`, first starting any of its dependencies that are not running."""
         with self.lock:
-            svc = self.services.get(name)
-            if not svc:
-                raise KeyError(name)
-            svc.start()
+            order = self._start_order([name])
+        try:
+            for svc in order:
+                svc.start()
+        finally:
+            self._start_sampling(order)
 
     def stop_service(self, name: str):
         with self.lock:
             svc = self.services.get(name)
-            if not svc:
-                return
-            svc.stop()
+        if svc:
+            svc.stop(self.stop_timeout)
+
+    def start_all(self, parallel: int = None, timeout: float = None):
+        """Start every service, stage by stage, up to `parallel` at a time.
 
-    def start_all(self):
+        A service whose dependency failed to start is skipped. A start still
+        running after `timeout` seconds counts as failed; should it finish
+        later, the service is stopped again. Returns (and keeps in
+        `last_boot`) a report with the elapsed seconds and failures.
+        """
+        timeout = self.start_timeout if timeout is None else timeout
+        t0 = time.monotonic()
         with self.lock:
-            for svc in list(self.services.values()):
-                svc.start()
+            stages = self._stages(self._start_order(list(self.services)))
+        started, failed = 0, {}
+        # a start that outlives its timeout is reported failed, so it must not
+        # leave a process behind: whichever of boot() and start_all decides
+        # first under `gate` wins
+        gate, outcome = threading.Lock(), {}
 
-    def stop_all(self):
+        def boot(svc):
+            with gate:
+                if outcome.get(svc.name) == 'abandoned':
+                    return
+            svc.start()
+            with gate:
+                if outcome.setdefault(svc.name, 'started') == 'started':
+                    return
+            svc.stop(self.stop_timeout)
+
+        pool = ThreadPoolExecutor(parallel or self.parallel, thread_name_prefix='supervisor-start')
+        try:
+            for stage in stages:
+                futures = {}
+                for svc in stage:
+                    bad = [d for d in svc.depends_on if d in failed]
+                    if bad:
+                        failed[svc.name] = f"dependency {bad[0]} failed"
+                    else:
+                        futures[pool.submit(boot, svc)] = svc
+                done, pending = wait(futures, timeout=timeout)
+                for fut in done:
+                    if fut.exception() is not None:
+                        failed[futures[fut].name] = repr(fut.exception())
+                    else:
+                        started += 1
+                with gate:
+                    for fut in pending:
+                        name = futures[fut].name
+                        if outcome.setdefault(name, 'abandoned') == 'started':
+                            started += 1  # finished just now
+                        else:
+                            fut.cancel()
+                            failed[name] = f"start timed out after {timeout:g}s"
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+        self._start_sampling([svc for stage in stages for svc in stage])
+        self.last_boot = {'seconds': time.monotonic() - t0, 'stages': len(stages),
+                          'started': started, 'failed': failed}
+        return self.last_boot
+
+    def stop_all(self, timeout: float = None):
+        """Stop every service, dependents first; each stage gets SIGTERM at once and
+        `timeout` seconds in total before the rest are killed. Returns (and keeps
+        in `last_shutdown`) a report with the elapsed seconds.
+        """
+        timeout = self.stop_timeout if timeout is None else timeout
+        t0 = time.monotonic()
         with self.lock:
-            for svc in list(self.services.values()):
-                svc.stop()
+            try:
+                stages = self._stages(self._start_order(list(self.services)))
+            except (KeyError, ValueError):
+                stages = [list(self.services.values())]  # broken dependency graph: stop everything anyway
+        stopped, killed = 0, []
+        for stage in reversed(stages):
+            procs = [(svc, svc._begin_stop()) for svc in stage]
+            deadline = time.monotonic() + timeout
+            for svc, process in procs:
+                if svc._finish_stop(process, deadline):
+                    killed.append(svc.name)
+                stopped += process is not None
+        if self.zygote is not None:
+            self.zygote.close()  # started again by the next spawn
+        self.last_shutdown = {'seconds': time.monotonic() - t0, 'stages': len(stages),
+                              'stopped': stopped, 'killed': killed}
+        return self.last_shutdown
+
+    def close(self, timeout: float = None):
+        """Stop every service, the zygote helper and the monitor thread; the supervisor is unusable afterwards."""
+        report = self.stop_all(timeout)
+        self.monitor.close()
+        return report
 
     def status(self):
         out = {}
         with self.lock:
-            for name, svc in self.services.items():
-                running = (svc.process is not None and svc.process.poll() is None)
-                out[name] = {'running': running, 'pid': getattr(svc.process, 'pid', None), 'logs_tail': svc.get_logs(10)}
+            services = list(self.services.items())
+        for name, svc in services:
+            out[name] = {'running': svc.is_running(), 'pid': getattr(svc.process, 'pid', None),
+                         'state': svc.state, 'restarts': svc.restarts, 'last_exit_code': svc.last_exit_code,
+                         'depends_on': list(svc.depends_on), 'resources': svc.resources.latest(),
+                         'limits': svc.limits.as_dict() if svc.limits else None,
+                         'limit_events': [{'time': t, 'kind': k, 'detail': d} for t, k, d in svc.limit_events],
+                         'logs_tail': svc.get_logs(10)}
         return out
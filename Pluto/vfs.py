@@ -1,57 +1,146 @@
 """
 Virtual File System (VFS) for Pluto userland. Stores files encrypted using PrivacyVault.
 """
-import os
-from pathlib import Path
+from collections import deque
+
 from Pluto.privacy import PrivacyVault
+from Pluto.pathindex import PathIndex
 
 
 class VFS:
-    def __init__(self, storage_dir='vault/vfs', key_path='vault/key.key'):
+    def __init__(self, storage_dir='vault/vfs', key_path='vault/key.key', backend='file', cache_bytes=0,
+                 durability='none', dedup=False, compression=None, compression_rules=None):
+        """Options are passed on to `PrivacyVault`; `compression_rules` maps
+        path prefixes to codecs here, e.g. `{'/logs/': ('lzma', 6)}`.
+        Listings come from a persistent sorted path index (see `Pluto.pathindex`).
+        """
         self.storage_dir = storage_dir
-        os.makedirs(self.storage_dir, exist_ok=True)
-        self.vault = PrivacyVault(key_path=key_path, storage_dir=self.storage_dir)
+        self.vault = PrivacyVault(key_path=key_path, storage_dir=self.storage_dir, backend=backend,
+                                  cache_bytes=cache_bytes, durability=durability, dedup=dedup,
+                                  compression=compression,
+                                  compression_rules={self._blob_prefix(k): v
+                                                     for k, v in (compression_rules or {}).items()})
+        self.index = PathIndex(self.storage_dir, self._stored_paths,
+                               getattr(self.vault.backend, 'generation', None))
 
     def _blob_name(self, path: str) -> str:
         # simple mapping: sanitize path
         p = path.strip('/').replace('/', '__') or 'root'
         return p
 
-    def write(self, path: str, data: bytes):
+    def _blob_prefix(self, prefix: str) -> str:
+        return prefix.lstrip('/').replace('/', '__')
+
+    def _display(self, name: str) -> str:
+        # normalize display: replace __ -> / and strip trailing .dat if present
+        display = name.replace('__', '/')
+        if display.endswith('.dat'):
+            display = display[:-4]
+        return display
+
+    def _stored_paths(self):
+        return [self._display(n) for n in self.vault.names()]
+
+    def write(self, path: str, data: bytes, compression=None):
+        """Store `data` at `path`; `compression` overrides the codec for this file."""
+        name = self._blob_name(path)
+        self.vault.store(name, data, compression=compression)
+        self.index.add(self._display(name))
+
+    def read(self, path: str, offset: int = 0, length: int = None) -> bytes:
         name = self._blob_name(path)
-        self.vault.store(name, data)
+        if offset == 0 and length is None:
+            return self.vault.retrieve(name)
+        return self.vault.retrieve_range(name, offset, length)
+
+    def open_write(self, path: str, chunk_size: int = None):
+        """Writable file object; content is encrypted chunk by chunk.
 
-    def read(self, path: str) -> bytes:
+        The file is listed once it is closed; `abort()` (or an exception
+        inside `with`) discards it.
+        """
         name = self._blob_name(path)
-        return self.vault.retrieve(name)
+        kwargs = {'chunk_size': chunk_size} if chunk_size else {}
+        return self.vault.open_writer(name, on_commit=lambda: self.index.add(self._display(name)), **kwargs)
+
+    def open_read(self, path: str):
+        """Seekable file object; range reads are cheap for files written with `open_write`."""
+        return self.vault.open_reader(self._blob_name(path))
+
+    def write_many(self, items, workers: int = None, batch: int = 1024):
+        """Write `(path, data)` pairs in parallel, yielding paths as they are stored.
+
+        A path given more than once is written in order, so the last data wins.
+        """
+        names = {}  # blob name -> paths stored under it but not yet yielded
+
+        def _named():
+            for path, data in items:
+                name = self._blob_name(path)
+                names.setdefault(name, deque()).append(path)
+                yield name, data
+        done = []
+        for name in self.vault.store_many(_named(), workers=workers):
+            done.append(name)
+            if len(done) >= batch:
+                yield from self._index_batch(done, names)
+                done = []
+        yield from self._index_batch(done, names)
+
+    def _index_batch(self, done, names):
+        self.index.add_many(self._display(n) for n in done)
+        out = []
+        for n in done:
+            paths = names[n]
+            out.append(paths.popleft())
+            if not paths:
+                del names[n]
+        return out
+
+    def read_many(self, paths, workers: int = None):
+        """Read files in parallel, yielding `(path, data)` as they complete.
+
+        A file requested more than once while it is being read is read once
+        and yielded for each request.
+        """
+        names = {}  # blob name -> paths waiting for it
+
+        def _named():
+            for path in paths:
+                name = self._blob_name(path)
+                if name in names:
+                    names[name].append(path)
+                else:
+                    names[name] = [path]
+                    yield name
+        for name, data in self.vault.retrieve_many(_named(), workers=workers):
+            for path in names.pop(name):
+                yield path, data
 
     def ls(self, prefix: str = ''):
-        # list stored blobs that match prefix
-        pfx = prefix.strip('/').replace('/', '__')
-        files = []
-        for f in Path(self.storage_dir).glob('*.dat'):
-            n = f.stem
-            # normalize display: replace __ -> / and strip trailing .dat if present
-            display = n.replace('__', '/')
-            if display.endswith('.dat'):
-                display = display[:-4]
-            if pfx == '' or n.startswith(pfx):
-                files.append(display)
-        # deduplicate and return
-        seen = []
-        for x in files:
-            if x not in seen:
-                seen.append(x)
-        return seen
+        """List stored paths that start with `prefix` (sorted)."""
+        return self.index.ls(prefix.strip('/').replace('__', '/'))
+
+    def listdir(self, path: str = ''):
+        """Immediate children of directory `path`; sub-directories end with '/'."""
+        return self.index.listdir(path)
 
     def rm(self, path: str):
         name = self._blob_name(path)
-        # Try removing common variants created by past bugs: name.dat and name.dat.dat
-        removed = False
-        for candidate in (f"{name}.dat", f"{name}.dat.dat"):
-            full = os.path.join(self.storage_dir, candidate)
-            if os.path.exists(full):
-                os.remove(full)
-                removed = True
-        if not removed:
+        try:
+            self.vault.delete(name)
+        except KeyError:
             raise FileNotFoundError(path)
+        finally:
+            self.index.remove(self._display(name))
+
+    def cache_stats(self):
+        return self.vault.cache_stats()
+
+    def dedup_stats(self):
+        """Savings from storing identical file contents once (with `dedup=True`)."""
+        return self.vault.dedup_stats()
+
+    def close(self):
+        self.index.close()
+        self.vault.close()
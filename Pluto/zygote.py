@@ -0,0 +1,323 @@
+"""
+Preforked "zygote" launcher for Python services (Linux/Unix only).
+
+Starting a service with `python -m module` pays interpreter startup and every
+import again. A `Zygote` keeps one helper process that has already imported
+`preload` and forks each service from it: the fork is ready in a few ms and
+shares the preloaded pages copy-on-write.
+
+The supervisor side talks to the helper over a SOCK_SEQPACKET socketpair, one
+JSON message per packet. A spawn request carries the write end of the
+service's stdout pipe as an SCM_RIGHTS fd (`socket.send_fds`); the helper
+forks, the child dup2()s it onto stdout/stderr, applies its rlimits and runs
+the module with `runpy`. The children belong to the helper, so the helper
+reaps them and reports exit codes back; `ZygoteProcess` wraps all of this in
+the part of the `Popen` interface the Supervisor uses.
+"""
+import json
+import os
+import selectors
+import signal
+import socket
+import subprocess
+import sys
+import threading
+
+DEFAULT_PRELOAD = ('Pluto.privacy', 'Pluto.vfs', 'Pluto.kernel', 'Pluto.collab',
+                   'cryptography.fernet', 'argparse', 'json')
+_MAX_MSG = 65536
+
+
+def is_module_cmd(cmd):
+    """Module name if `cmd` is `[python, '-m', module, ...]` for this interpreter, else None."""
+    if (isinstance(cmd, (list, tuple)) and len(cmd) >= 3 and cmd[1] == '-m'
+            and os.path.realpath(cmd[0]) == os.path.realpath(sys.executable)):
+        return cmd[2]
+    return None
+
+
+class ZygoteProcess:
+    """Popen-like handle for a service forked by the zygote."""
+
+    def __init__(self, pid, args, stdout):
+        self.pid = pid
+        self.args = args
+        self.stdout = stdout
+        self.returncode = None
+        self._done = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def _exited(self, rc):
+        with self._lock:
+            self.returncode = rc
+            callbacks, self._callbacks = self._callbacks, []
+        self._done.set()
+        for fn in callbacks:
+            fn(rc)
+
+    def add_exit_callback(self, fn):
+        """Call `fn(returncode)` once the process has exited (immediately if it already has)."""
+        with self._lock:
+            if self.returncode is None:
+                self._callbacks.append(fn)
+                return
+        fn(self.returncode)
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise subprocess.TimeoutExpired(self.args, timeout)
+        return self.returncode
+
+    def send_signal(self, sig):
+        if self.returncode is None:
+            try:
+                os.kill(self.pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+
+class Zygote:
+    """Supervisor-side handle of the helper process; started on first `spawn`."""
+
+    def __init__(self, preload=DEFAULT_PRELOAD, python=None):
+        self.preload = tuple(preload)
+        self.python = python or sys.executable
+        self.helper = None
+        self._sock = None
+        self._reader = None
+        self._request_lock = threading.Lock()  # one request in flight at a time
+        self._lock = threading.Lock()          # guards the fields below
+        self._procs = {}                # pid -> ZygoteProcess
+        self._early_exits = {}          # exits reported before the spawn reply was handled
+        self._reply = None
+        self._reply_ready = threading.Condition(self._lock)
+
+    def _ensure_started(self):
+        if self.helper is not None and self.helper.poll() is None:
+            return
+        ours, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        try:
+            self.helper = subprocess.Popen(
+                [self.python, '-m', 'Pluto.zygote', str(theirs.fileno()), ','.join(self.preload)],
+                pass_fds=[theirs.fileno()], stdin=subprocess.DEVNULL)
+        finally:
+            theirs.close()
+        self._sock = ours
+        self._reader = threading.Thread(target=self._read_loop, args=(ours,), name='pluto-zygote', daemon=True)
+        self._reader.start()
+        # wait for the helper to finish preloading
+        self._reply = None
+        while self._reply is None:
+            self._reply_ready.wait()
+        if 'ready' not in self._reply:
+            raise OSError(f"zygote failed to start: {self._reply}")
+
+    def _read_loop(self, sock):
+        while True:
+            try:
+                data = sock.recv(_MAX_MSG)
+            except OSError:
+                data = b''
+            if not data:
+                break
+            msg = json.loads(data)
+            if 'exit' in msg:
+                with self._lock:
+                    proc = self._procs.pop(msg['exit'], None)
+                    if proc is None:
+                        self._early_exits[msg['exit']] = msg['rc']
+                if proc is not None:
+                    proc._exited(msg['rc'])
+            else:
+                with self._lock:
+                    self._reply = msg
+                    self._reply_ready.notify_all()
+        # helper gone: its children can no longer be reaped or reported
+        with self._lock:
+            procs, self._procs = self._procs, {}
+            self._reply = {'error': 'zygote exited'}
+            self._reply_ready.notify_all()
+        for proc in procs.values():
+            proc._exited(-signal.SIGKILL)
+
+    def spawn(self, cmd, limits=None):
+        """Fork `cmd` (`[python, '-m', module, *argv]`) from the zygote; returns a `ZygoteProcess`."""
+        module = is_module_cmd(cmd)
+        if module is None:
+            raise ValueError(f"not a '{sys.executable} -m module' command: {cmd!r}")
+        read_fd, write_fd = os.pipe()
+        request = {'module': module, 'argv': list(cmd[3:]), 'cwd': os.getcwd(),
+                   'limits': limits.as_dict() if limits else None}
+        try:
+            with self._request_lock, self._lock:
+                self._ensure_started()
+                self._reply = None
+                socket.send_fds(self._sock, [json.dumps(request).encode()], [write_fd])
+                while self._reply is None:
+                    self._reply_ready.wait()
+                reply = self._reply
+                if 'pid' in reply:
+                    proc = ZygoteProcess(reply['pid'], list(cmd), os.fdopen(read_fd, 'rb'))
+                    rc = self._early_exits.pop(proc.pid, None)
+                    if rc is None:
+                        self._procs[proc.pid] = proc
+        except BaseException:
+            os.close(read_fd)
+            raise
+        finally:
+            os.close(write_fd)
+        if 'pid' not in reply:
+            os.close(read_fd)
+            raise OSError(f"zygote spawn of {module} failed: {reply.get('error')}")
+        if rc is not None:
+            proc._exited(rc)
+        return proc
+
+    def close(self):
+        """Stop the helper (it exits on EOF; running services keep going).
+
+        Services it forked can no longer be reported once it is gone, so stop
+        them first. A later `spawn` starts a new helper.
+        """
+        with self._request_lock:
+            if self._sock is not None:
+                try:
+                    self._sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            if self.helper is not None:
+                try:
+                    self.helper.wait(timeout=2)
+                except subprocess.TimeoutExpired:
+                    self.helper.kill()
+                    self.helper.wait()
+            # the reader must be done before a new helper reuses our state
+            if self._reader is not None:
+                self._reader.join(timeout=2)
+                self._reader = None
+            if self._sock is not None:
+                self._sock.close()
+                self._sock = None
+
+
+# -- helper process ---------------------------------------------------------
+
+def _child(sock, request, fd, inherited):
+    """Runs in the forked service: never returns."""
+    code = 1
+    try:
+        sock.close()
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        signal.set_wakeup_fd(-1)
+        for f in inherited:
+            os.close(f)
+        os.dup2(fd, 1)
+        os.dup2(fd, 2)
+        os.close(fd)
+        null = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(null, 0)
+        os.close(null)
+        os.setsid()
+        os.chdir(request['cwd'])
+        if request.get('limits'):
+            from Pluto.resources import Limits
+            Limits(**request['limits']).apply()
+        import random
+        random.seed()  # do not share the zygote's random state
+        import runpy
+        sys.argv = [request['module']] + request['argv']
+        try:
+            runpy.run_module(request['module'], run_name='__main__', alter_sys=True)
+            code = 0
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+            if not isinstance(e.code, (int, type(None))):
+                print(e.code, file=sys.stderr)
+        except BaseException:
+            import traceback
+            traceback.print_exc()
+            code = 1
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(code)
+
+
+def _send(sock, msg):
+    sock.send(json.dumps(msg).encode())
+
+
+def _reap(sock):
+    while True:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if pid == 0:
+            return
+        _send(sock, {'exit': pid, 'rc': os.waitstatus_to_exitcode(status)})
+
+
+def _helper_main(fd, preload):
+    sock = socket.socket(fileno=fd)
+    for name in filter(None, preload.split(',')):
+        try:
+            __import__(name)
+        except Exception:
+            pass  # optional modules (e.g. cryptography) may be missing
+    wake_r, wake_w = os.pipe()
+    os.set_blocking(wake_r, False)
+    os.set_blocking(wake_w, False)
+    signal.set_wakeup_fd(wake_w)
+    signal.signal(signal.SIGCHLD, lambda *a: None)
+    sel = selectors.DefaultSelector()
+    sel.register(sock, selectors.EVENT_READ)
+    sel.register(wake_r, selectors.EVENT_READ)
+    _send(sock, {'ready': os.getpid()})
+    while True:
+        for key, _ in sel.select():
+            if key.fileobj == wake_r:
+                try:
+                    while os.read(wake_r, 4096):
+                        pass
+                except BlockingIOError:
+                    pass
+                _reap(sock)
+                continue
+            try:
+                data, fds, _, _ = socket.recv_fds(sock, _MAX_MSG, 1)
+            except InterruptedError:
+                continue
+            if not data:
+                return  # supervisor went away
+            request = json.loads(data)
+            try:
+                pid = os.fork()
+            except OSError as e:
+                for f in fds:
+                    os.close(f)
+                _send(sock, {'error': str(e)})
+                continue
+            if pid == 0:
+                sel.close()
+                _child(sock, request, fds[0], (wake_r, wake_w))
+            for f in fds:
+                os.close(f)
+            _send(sock, {'pid': pid})
+        _reap(sock)
+
+
+if __name__ == '__main__':
+    _helper_main(int(sys.argv[1]), sys.argv[2] if len(sys.argv) > 2 else '')
@@ -0,0 +1,87 @@
+import asyncio
+import time
+
+from Pluto.aio import AsyncCollabClient, AsyncCollabServer
+from Pluto.collab import CollabClient, CollabServer
+
+
+async def until(pred, timeout=5):
+    for _ in range(int(timeout / 0.01)):
+        if pred():
+            return True
+        await asyncio.sleep(0.01)
+    return pred()
+
+
+def count_writes(client):
+    writes = []
+    real = client._writer.write
+
+    def write(data):
+        writes.append(len(data))
+        real(data)
+    client._writer.write = write
+    return writes
+
+
+def test_batch_delay_and_batch_bytes():
+    async def run():
+        server = AsyncCollabServer(port=0)
+        await server.start()
+        sender = AsyncCollabClient(port=server.port, batch_delay=0.05, batch_bytes=1000)
+        receiver = AsyncCollabClient(port=server.port)
+        batches = []
+        receiver.on_messages = batches.append
+        await sender.connect()
+        await receiver.connect()
+        await until(lambda: len(server.clients) == 2)
+        writes = count_writes(sender)
+
+        for i in range(10):
+            sender.send(f"m{i}")
+        assert writes == []  # held until batch_delay passes
+        await until(lambda: writes)
+        assert len(writes) == 1
+
+        sender.send('x' * 2000)  # over batch_bytes: written at once
+        assert len(writes) == 2
+        sender.send_many(['a', b'b', 'c'])
+        await sender.drain()
+        assert len(writes) == 3
+
+        received = lambda: [m for batch in batches for m in batch]
+        await until(lambda: len(received()) == 14)
+        assert received() == [f"m{i}" for i in range(10)] + ['x' * 2000, 'a', b'b', 'c']
+        assert len(batches) < 14  # whole reads are handed over as lists
+        await sender.close()
+        await receiver.close()
+        await server.stop()
+    asyncio.run(run())
+
+
+def test_wrapper_batch_keeps_order_with_room_sends():
+    server = CollabServer(port=0)
+    server.start()
+    sender = CollabClient(port=server.port, name='s', batch_delay=10)
+    receiver = CollabClient(port=server.port, name='r')
+    got = []
+    receiver.on_message = got.append
+    receiver.on_room_message = lambda room, who, msg: got.append((room, msg))
+    try:
+        sender.connect()
+        receiver.connect()
+        receiver.join('room')
+        deadline = time.monotonic() + 5
+        while server.members('room') != ['r'] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        for i in range(5):
+            sender.send(f"b{i}")  # batched on the calling side
+        sender.send_to_room('room', 'after')
+        deadline = time.monotonic() + 5
+        while len(got) < 6 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert got == [f"b{i}" for i in range(5)] + [('room', 'after')]
+    finally:
+        sender.close()
+        receiver.close()
+        server.stop()
@@ -0,0 +1,175 @@
+import hashlib
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from Pluto.blobstore import FileStore, GroupCommitter, PackStore
+
+BACKENDS = {'file': FileStore, 'pack': PackStore}
+
+# writes unique names from several threads and prints each name once put() returned
+CRASH_CHILD = r'''
+import hashlib, itertools, os, sys, threading
+from Pluto.blobstore import FileStore, GroupCommitter, PackStore
+store = {'file': FileStore, 'pack': PackStore}[sys.argv[2]](sys.argv[1], durability='group')
+counter = itertools.count()
+out = threading.Lock()
+
+def loop(t):
+    while True:
+        name = f"t{t}-{next(counter)}"
+        body = os.urandom(1 + next(counter) % 50000)
+        store.put(name, hashlib.sha256(body).digest() + body)
+        with out:
+            sys.stdout.write(name + "\n")
+            sys.stdout.flush()
+
+for t in range(4):
+    threading.Thread(target=loop, args=(t,), daemon=True).start()
+threading.Event().wait()
+'''
+
+
+def valid(blob):
+    blob = bytes(blob)
+    return hashlib.sha256(blob[32:]).digest() == blob[:32]
+
+
+@pytest.mark.parametrize('backend', ['file', 'pack'])
+def test_group_commit_survives_killed_writer(tmp_path, backend):
+    root = str(tmp_path / 'data')
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    child = subprocess.Popen([sys.executable, '-c', CRASH_CHILD, root, backend], cwd=repo,
+                             stdout=subprocess.PIPE)
+    acked = []
+    deadline = time.monotonic() + 10
+    while len(acked) < 200 and time.monotonic() < deadline:
+        line = child.stdout.readline()
+        if not line:
+            break
+        acked.append(line.decode().strip())
+    child.send_signal(signal.SIGKILL)
+    child.wait()
+    child.stdout.close()
+    assert len(acked) >= 200
+
+    store = BACKENDS[backend](root)
+    names = set(store.names())
+    missing = [n for n in acked if n not in names]
+    torn = [n for n in names if not valid(store.get(n))]
+    store.close()
+    assert not missing
+    assert not torn
+    assert not [f for f in os.listdir(root) if f.endswith('.tmp') and f.startswith('t')]
+
+
+@pytest.mark.parametrize('backend', ['file', 'pack'])
+@pytest.mark.parametrize('durability', ['none', 'fsync', 'group'])
+def test_put_get_delete(tmp_path, backend, durability):
+    store = BACKENDS[backend](str(tmp_path), durability=durability)
+    store.put('a', b'one')
+    store.put('a', b'two')
+    store.put('b', b'x' * 100000)
+    w = store.open_writer('c')
+    w.write(b'streamed')
+    w.close()
+    assert bytes(store.get('a')) == b'two'
+    assert bytes(store.get('c')) == b'streamed'
+    store.delete('b')
+    with pytest.raises(KeyError):
+        store.get('b')
+    with pytest.raises(KeyError):
+        store.delete('b')
+    assert sorted(store.names()) == ['a', 'c']
+    store.close()
+    store = BACKENDS[backend](str(tmp_path))
+    assert sorted(store.names()) == ['a', 'c']
+    store.close()
+
+
+def test_pack_compaction_keeps_concurrent_writes(tmp_path):
+    store = PackStore(str(tmp_path), segment_size=4096, auto_compact=False)
+    for i in range(200):
+        store.put(f"k{i}", b'old' * 100)
+    for i in range(0, 200, 2):
+        store.delete(f"k{i}")
+    stop = threading.Event()
+    written = []
+
+    def writer():
+        i = 0
+        while not stop.is_set():
+            store.put(f"k{i % 200}", f"new {i}".encode())
+            written.append(i)
+            i += 1
+    t = threading.Thread(target=writer)
+    t.start()
+    while not written:
+        time.sleep(0.001)
+    store.compact()
+    stop.set()
+    t.join()
+
+    expect = {f"k{i}": b'old' * 100 for i in range(1, 200, 2)}
+    expect.update({f"k{i % 200}": f"new {i}".encode() for i in written})
+    assert {n: bytes(store.get(n)) for n in store.names()} == expect
+    assert 0 <= store.dead_bytes <= store.total_bytes
+    store.close()
+    os.remove(os.path.join(str(tmp_path), PackStore.INDEX_FILE))
+    store = PackStore(str(tmp_path))  # rescans every segment
+    assert {n: bytes(store.get(n)) for n in store.names()} == expect
+    store.close()
+
+
+def test_pack_corrupt_record_in_sealed_segment_is_skipped(tmp_path):
+    store = PackStore(str(tmp_path), segment_size=1)  # one record per segment
+    for name in 'abc':
+        store.put(name, name.encode() * 100)
+    store.close()
+    os.remove(os.path.join(str(tmp_path), PackStore.INDEX_FILE))
+    first = os.path.join(str(tmp_path), 'seg-000000.pack')
+    size = os.path.getsize(first)
+    with open(first, 'r+b') as f:
+        f.seek(size - 10)
+        f.write(b'X')
+
+    store = PackStore(str(tmp_path))
+    assert sorted(store.names()) == ['b', 'c']
+    assert bytes(store.get('c')) == b'c' * 100
+    assert os.path.getsize(first) == size  # not truncated
+    store.close()
+
+
+def test_group_committer_batches_writers_arriving_during_a_flush():
+    batches = []
+    release = threading.Event()
+
+    def flush(batch):
+        batches.append(batch)
+        if len(batches) == 1:
+            release.wait(5)  # a slow fsync
+    committer = GroupCommitter(flush)
+    first = threading.Thread(target=committer.commit, args=(0,))
+    first.start()
+    while not batches:
+        time.sleep(0.001)
+    others = [threading.Thread(target=committer.commit, args=(i,)) for i in range(1, 6)]
+    for t in others:
+        t.start()
+    while len(committer._pending) < 5:
+        time.sleep(0.001)
+    release.set()
+    for t in [first] + others:
+        t.join()
+    assert batches[0] == [0]  # flushed at once, nobody waited for company
+    assert sorted(batches[1]) == [1, 2, 3, 4, 5] and len(batches) == 2
+    committer.commit(6)  # an idle writer flushes in its own thread
+    assert batches[-1] == [6]
+    committer.close()
+    with pytest.raises(ValueError):
+        committer.commit(7)
@@ -0,0 +1,64 @@
+import importlib.util
+
+import pytest
+
+from Pluto.ciphers import CIPHERS, FALLBACK_KEY, XorCipher, available
+from Pluto.privacy import PrivacyVault
+
+SIZES = [0, 1, 20, 21, 1 << 20, (1 << 20) + 7, 3 * (1 << 20) + 1]
+
+
+def needs(name):
+    module = {'fernet': 'cryptography', 'xor-numpy': 'numpy'}.get(name)
+    if module and importlib.util.find_spec(module) is None:
+        pytest.skip(f"{module} not installed")
+
+
+def old_xor(data, key):
+    # the original per-byte fallback from PrivacyVault._xor
+    return bytes(b ^ key[i % len(key)] for i, b in enumerate(data))
+
+
+@pytest.mark.parametrize('name', sorted(CIPHERS))
+@pytest.mark.parametrize('size', SIZES)
+def test_round_trip(name, size):
+    needs(name)
+    cls = CIPHERS[name]
+    cipher = cls(cls.generate_key())
+    data = bytes(range(256)) * (size // 256) + bytes(size % 256)
+    token = cipher.encrypt(data)
+    assert cipher.decrypt(token) == data
+    assert cipher.decrypt(memoryview(token)) == data  # pack store reads
+
+
+@pytest.mark.parametrize('name', ['xor', 'xor-numpy'])
+@pytest.mark.parametrize('size', SIZES)
+@pytest.mark.parametrize('key', [FALLBACK_KEY, b'k', b'seven b'])
+def test_xor_matches_original_fallback(name, size, key):
+    needs(name)
+    data = bytes((i * 7 + 3) % 256 for i in range(min(size, 4096))) * (size // 4096 + 1)
+    data = data[:size]
+    assert CIPHERS[name](key).encrypt(data) == old_xor(data, key)
+
+
+def test_xor_into_works_in_place():
+    buf = bytearray(b'hello world')
+    XorCipher(FALLBACK_KEY).xor_into(buf)
+    assert bytes(buf) == old_xor(b'hello world', FALLBACK_KEY)
+
+
+def test_available_lists_usable_backends():
+    names = available()
+    assert names[-1] == 'xor'
+    for name in names:
+        needs(name)
+        assert name in CIPHERS
+
+
+@pytest.mark.parametrize('name', sorted(CIPHERS))
+def test_vault_with_each_cipher(tmp_path, name):
+    needs(name)
+    vault = PrivacyVault(key_path=str(tmp_path / 'key.key'), storage_dir=str(tmp_path / 'data'), cipher=name)
+    vault.store('a', b'secret' * 1000)
+    assert vault.retrieve('a') == b'secret' * 1000
+    vault.close()
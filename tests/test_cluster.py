@@ -0,0 +1,166 @@
+import asyncio
+import json
+
+import pytest
+
+from Pluto.aio import AsyncCollabClient
+from Pluto.cluster import AsyncClusterNode
+from Pluto.protocol import AUTH, NODE, ROOM, encode_frame, encode_routed, forward_frame
+
+
+async def until(pred, timeout=5):
+    for _ in range(int(timeout / 0.01)):
+        if pred():
+            return True
+        await asyncio.sleep(0.01)
+    return pred()
+
+
+def collector(client):
+    got = []
+    client.on_room_message = lambda room, sender, msg: got.append((room, sender, msg))
+    client.on_message = got.append
+    return got
+
+
+async def node(**kw):
+    n = AsyncClusterNode(port=0, cluster_port=0, **kw)
+    await n.start()
+    return n
+
+
+def test_room_messages_are_forwarded_only_to_nodes_with_members():
+    async def run():
+        a = await node(node_id='a')
+        b = await node(node_id='b', seeds=[a.addr])
+        c = await node(node_id='c', seeds=[b.addr])
+        assert await until(lambda: all(len(n.nodes) == 2 for n in (a, b, c)))
+        sender = AsyncCollabClient(port=a.port, name='s')
+        member = AsyncCollabClient(port=b.port, name='m')
+        got = collector(member)
+        for cl in (sender, member):
+            await cl.connect()
+        member.join('r')
+        assert await until(lambda: a.members('r') == ['m'])
+        sender.send_to_room('r', 'hi')
+        assert await until(lambda: got == [('r', 's', 'hi')])
+        assert c.received == 0  # no member there, nothing forwarded
+        for cl in (sender, member):
+            await cl.close()
+        for n in (a, b, c):
+            await n.stop()
+    asyncio.run(run())
+
+
+def test_congested_link_resyncs_membership():
+    async def run():
+        a = await node(node_id='a', link_queue_bytes=64 << 10)
+        b = await node(node_id='b', seeds=[a.addr])
+        assert await until(lambda: a.nodes and b.nodes)
+        sender = AsyncCollabClient(port=a.port, name='s')
+        late = AsyncCollabClient(port=a.port, name='t')
+        member = AsyncCollabClient(port=b.port, name='m')
+        for cl in (sender, late, member):
+            await cl.connect()
+        member.join('r')
+        assert await until(lambda: a.members('r') == ['m'])
+        stalled = b.nodes['a'].link.transport
+        stalled.pause_reading()
+        for _ in range(2000):
+            if a.slow_disconnects or a.dropped:
+                break
+            sender.send_to_room('r', 'x' * 32768)
+            await asyncio.sleep(0)
+        assert await until(lambda: a.slow_disconnects or a.dropped)
+        late.join('r2')  # announced while the link is congested
+        assert await until(lambda: a.members('r2') == ['t'])
+        stalled.resume_reading()
+        assert await until(lambda: b.members('r2') == ['t'], timeout=10)
+        assert a.dropped == 0
+        for cl in (sender, late, member):
+            await cl.close()
+        for n in (a, b):
+            await n.stop()
+    asyncio.run(run())
+
+
+def test_duplicate_forwards_are_dropped():
+    async def run():
+        a = await node(node_id='a')
+        client = AsyncCollabClient(port=a.port)
+        got = collector(client)
+        await client.connect()
+        assert await until(lambda: a.clients)
+        frame = forward_frame(2, 'x/1', 7, '', encode_frame(2, b'once'))[5:]
+        a._forwarded(frame)
+        a._forwarded(frame)
+        assert await until(lambda: got == ['once'])
+        assert a.duplicates == 1
+        await client.close()
+        await a.stop()
+    asyncio.run(run())
+
+
+def test_open_mesh_refused_when_clients_authenticate():
+    with pytest.raises(ValueError):
+        AsyncClusterNode(port=0, cluster_port=0, auth_token='tok', cluster_token='')
+    # defaults to the client token
+    assert AsyncClusterNode(port=0, cluster_port=0, auth_token='tok').cluster_token == 'tok'
+
+
+@pytest.mark.parametrize('token', [None, b'wrong'])
+def test_unauthenticated_link_cannot_deliver(token):
+    async def run():
+        a = await node(node_id='a', auth_token='tok')
+        client = AsyncCollabClient(port=a.port, token='tok', name='victim')
+        got = collector(client)
+        await client.connect()
+        client.join('r')
+        assert await until(lambda: a.members('r') == ['victim'])
+        reader, writer = await asyncio.open_connection(*a.addr)
+        if token:
+            writer.write(encode_frame(AUTH, token))
+        writer.write(encode_frame(NODE, json.dumps({'id': 'evil', 'addr': ['127.0.0.1', 1]}).encode()))
+        data = encode_routed(ROOM, 'r', 'injected', sender='evil')
+        writer.write(forward_frame(ROOM, 'evil/1', 1, 'r', data))
+        writer.write(forward_frame(2, 'evil/1', 2, '', encode_frame(2, b'injected')))
+        await writer.drain()
+        await asyncio.wait_for(reader.read(), 5)  # the node hangs up
+        await asyncio.sleep(0.1)
+        assert got == []
+        assert 'evil' not in a.nodes
+        writer.close()
+        await client.close()
+        await a.stop()
+    asyncio.run(run())
+
+
+def test_links_use_tls_when_the_node_does(tmp_path):
+    pytest.importorskip('cryptography')
+    tls = dict(use_ssl=True, certfile=str(tmp_path / 'cert.pem'), keyfile=str(tmp_path / 'key.pem'),
+               auth_token='tok')
+
+    async def run():
+        a = await node(node_id='a', **tls)
+        b = await node(node_id='b', seeds=[a.addr], **tls)
+        assert await until(lambda: a.nodes and b.nodes)
+        # a plain TCP dialer gets nowhere
+        reader, writer = await asyncio.open_connection(*a.addr)
+        writer.write(encode_frame(AUTH, b'tok'))
+        await writer.drain()
+        assert await asyncio.wait_for(reader.read(), 5) == b''
+        writer.close()
+        sender = AsyncCollabClient(port=a.port, use_ssl=True, token='tok')
+        member = AsyncCollabClient(port=b.port, use_ssl=True, token='tok')
+        got = collector(member)
+        for cl in (sender, member):
+            await cl.connect()
+        member.join('r')
+        assert await until(lambda: len(a.members('r')) == 1)
+        sender.send_to_room('r', 'secure')
+        assert await until(lambda: [m for _, _, m in got] == ['secure'])
+        for cl in (sender, member):
+            await cl.close()
+        for n in (a, b):
+            await n.stop()
+    asyncio.run(run())
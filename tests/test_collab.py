@@ -0,0 +1,67 @@
+import threading
+import time
+
+import pytest
+
+from Pluto.aio import LoopThread
+from Pluto.collab import CollabClient, CollabServer
+
+
+def wait_for(pred, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if pred():
+            return True
+        time.sleep(0.01)
+    return pred()
+
+
+def test_loop_thread_run_on_own_thread_raises():
+    lt = LoopThread('test-loop')
+    try:
+        async def inner():
+            return 42
+
+        async def outer():
+            with pytest.raises(RuntimeError, match='own loop thread'):
+                lt.run(inner())
+            return lt.run_sync(lambda: 'direct')
+        assert lt.run(outer()) == 'direct'
+        assert lt.run(inner()) == 42
+        assert lt.run_sync(sum, [1, 2]) == 3
+    finally:
+        lt.close()
+
+
+def test_wrapper_calls_from_a_callback():
+    server = CollabServer(port=0)
+    server.start()
+    a = CollabClient(port=server.port, name='a')
+    b = CollabClient(port=server.port, name='b')
+    seen, errors, done = [], [], threading.Event()
+
+    def on_message(msg):
+        # runs on the background loop thread
+        seen.append((msg, server.members('lobby'), server.stats()['clients']))
+        a.send('echo: ' + msg)
+        try:
+            a.reconnect()
+        except RuntimeError as e:
+            errors.append(e)
+        done.set()
+    echoes = []
+    try:
+        a.connect()
+        b.connect()
+        a.join('lobby')
+        b.on_message = echoes.append
+        a.on_message = on_message
+        b.send('hi')
+        assert done.wait(5)
+        assert seen == [('hi', ['a'], 2)]
+        assert len(errors) == 1
+        assert wait_for(lambda: echoes == ['echo: hi'])
+    finally:
+        a.close()
+        b.close()
+        server.stop()
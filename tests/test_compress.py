@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+from Pluto import compress
+from Pluto.privacy import PrivacyVault
+
+TEXT = b'the quick brown fox jumps over the lazy dog\n' * 500
+
+
+@pytest.fixture(params=['xor', 'fernet'])
+def vault(tmp_path, request):
+    if request.param == 'fernet':
+        pytest.importorskip('cryptography')
+    v = PrivacyVault(key_path=str(tmp_path / 'key.key'), storage_dir=str(tmp_path / 'data'),
+                     cipher=request.param, compression='zlib')
+    yield v
+    v.close()
+
+
+@pytest.mark.parametrize('data', [b'', b'short', TEXT, os.urandom(4096)])
+def test_legacy_uncompressed_blobs_still_read(vault, data):
+    # what the vault wrote before the PLZ1 header existed: the bare token
+    vault.backend.put('legacy', vault.encrypt(data))
+    assert vault.retrieve('legacy') == data
+    with vault.open_reader('legacy') as f:
+        assert f.read() == data
+
+
+def test_new_blobs_carry_the_header_only_when_compressed(vault):
+    vault.store('text', TEXT)
+    vault.store('small', b'tiny')
+    vault.store('random', os.urandom(4096))
+    vault.store('plain', TEXT, compression='none')
+    assert bytes(vault.backend.get('text')[:4]) == compress.MAGIC
+    for name in ('small', 'random', 'plain'):
+        assert bytes(vault.backend.get(name)[:4]) != compress.MAGIC
+    assert len(vault.backend.get('text')) < len(vault.backend.get('plain'))
+    for name, data in (('text', TEXT), ('small', b'tiny'), ('plain', TEXT)):
+        assert vault.retrieve(name) == data
+
+
+@pytest.mark.parametrize('spec', ['zlib', 'lzma', ('zlib', 9), ('lzma', 1)])
+def test_codecs_round_trip(spec):
+    cid, packed = compress.compress(TEXT, spec)
+    assert cid != 0 and len(packed) < len(TEXT)
+    blob = compress.header(cid) + packed
+    assert compress.decompress(*compress.split_header(blob)) == TEXT
+
+
+def test_split_header_leaves_headerless_blobs_alone():
+    assert compress.split_header(b'gAAAAAB-token') == (0, b'gAAAAAB-token')
+    assert compress.split_header(compress.MAGIC) == (0, compress.MAGIC)  # too short for a header
+    with pytest.raises(ValueError):
+        compress.decompress(99, b'')
+    with pytest.raises(ValueError):
+        compress.parse_spec('brotli')
+
+
+def test_policy_longest_prefix_wins():
+    policy = compress.CompressionPolicy('zlib', {'logs/': 'lzma', 'logs/raw/': 'none'})
+    assert policy.for_name('docs/a') == 'zlib'
+    assert policy.for_name('logs/a') == 'lzma'
+    assert policy.for_name('logs/raw/a') == 'none'
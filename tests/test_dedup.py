@@ -0,0 +1,75 @@
+import pytest
+
+from Pluto import dedup as cas
+from Pluto.privacy import PrivacyVault
+
+
+@pytest.fixture(params=['file', 'pack'])
+def vault(tmp_path, request):
+    v = PrivacyVault(key_path=str(tmp_path / 'key.key'), storage_dir=str(tmp_path / 'data'),
+                     backend=request.param, dedup=True)
+    yield v
+    v.close()
+
+
+def objects(vault):
+    return [n for n in vault.backend.names() if n.startswith(cas.CAS_PREFIX)]
+
+
+def test_identical_contents_stored_once(vault):
+    vault.store('a', b'same' * 1000)
+    vault.store('b', b'same' * 1000)
+    vault.store('c', b'other')
+    assert vault.retrieve('a') == vault.retrieve('b') == b'same' * 1000
+    assert len(objects(vault)) == 2
+    stats = vault.dedup_stats()
+    assert (stats['objects'], stats['references']) == (2, 3)
+    assert stats['saved_bytes'] == 4000
+    assert sorted(vault.names()) == ['a', 'b', 'c']
+
+
+def test_overwrite_and_delete_release_objects(vault):
+    vault.store('a', b'one')
+    vault.store('b', b'one')
+    vault.store('a', b'two')
+    assert len(objects(vault)) == 2
+    vault.delete('b')
+    assert len(objects(vault)) == 1
+    assert vault.retrieve('a') == b'two'
+    vault.store('a', b'two')  # unchanged content: nothing to do
+    assert vault.dedup_stats()['references'] == 1
+
+
+def test_store_many_same_name_keeps_counts_consistent(vault):
+    items = [(f"n{i % 3}", str(i % 7).encode()) for i in range(300)]
+    assert len(list(vault.store_many(items, workers=8))) == 300
+    for k in range(3):
+        assert vault.retrieve(f"n{k}") == str((297 + k) % 7).encode()
+    assert vault.dedup_stats()['references'] == 3
+    assert vault.dedup_gc() == 0
+
+
+def test_concurrent_overwrites_never_lose_shared_objects(vault):
+    n = 200
+    contents = [f"content {i}".encode() for i in range(n)]
+    list(vault.store_many([(f"n{i}", contents[i]) for i in range(n)], workers=16))
+    for shift in range(1, 11):
+        # every name takes another's content while that name releases it
+        items = [(f"n{i}", contents[(i + shift) % n]) for i in range(n)]
+        list(vault.store_many(items, workers=16))
+        for i in range(n):
+            assert vault.retrieve(f"n{i}") == contents[(i + shift) % n]
+    assert vault.dedup_stats()['references'] == n
+    assert len(objects(vault)) == n
+
+
+def test_gc_removes_orphaned_objects(vault):
+    vault.store('a', b'kept')
+    # what a crash between writing an object and its pointer leaves behind
+    digest = cas.content_digest(vault._dedup_key, b'orphan')
+    vault.backend.put(cas.object_name(digest), vault._seal('x', b'orphan'))
+    vault.refs.incr(digest, 6)
+    assert len(objects(vault)) == 2
+    assert vault.dedup_gc() == 1
+    assert objects(vault) == [cas.object_name(cas.content_digest(vault._dedup_key, b'kept'))]
+    assert vault.dedup_stats()['references'] == 1
@@ -0,0 +1,56 @@
+import pytest
+
+from Pluto.journal import EventJournal
+from Pluto.kernel import Kernel
+
+EVENTS = [
+    {'topic': 'svc.state', 'pid': 42, 'ok': True, 'load': 0.5, 'note': None},
+    {'topic': 'svc.pair', 'pair': (1, 'a'), 'nested': [(2, 3), {'x': (4,)}]},
+    {'topic': 'svc.map', 'by_pid': {1: 'init', 2.5: 'half', (3, 4): 'tuple', None: 'none'}},
+    {'topic': 'svc.raw', 'blob': b'\x00\xffbytes'},
+    {'topic': 'svc.tag', '__tuple__': 'looks like a tag'},
+    ('a', 'tuple', 'event'),
+]
+
+
+def test_replay_equals_live_delivery(tmp_path):
+    live, replayed = [], []
+    kernel = Kernel(journal=str(tmp_path / 'journal'))
+    kernel.register_service('live', live.append)
+    kernel.start()
+    for ev in EVENTS:
+        kernel.emit_event(ev)
+    assert kernel.join(timeout=5)
+    kernel.register_service('late', replayed.append, replay_from='earliest')
+    assert kernel.join(timeout=5)
+    kernel.stop()
+    kernel.journal.close()
+    assert live == EVENTS
+    assert replayed == EVENTS
+    assert [type(e) for e in replayed] == [type(e) for e in EVENTS]
+
+
+def test_unsupported_event_raises_before_append(tmp_path):
+    kernel = Kernel(journal=str(tmp_path / 'journal'))
+    kernel.register_service('svc', lambda ev: None)
+    with pytest.raises(TypeError, match='set'):
+        kernel.emit_event({'topic': 'x', 'ids': {1, 2}})
+    with pytest.raises(TypeError, match='object'):
+        kernel.emit_many([{'topic': 'x'}, object()])
+    assert kernel.journal.next_offset == 0
+    assert kernel.emit_event({'topic': 'x'}) == 1  # the emit lock was not left held
+    kernel.journal.close()
+
+
+def test_reopen_keeps_offsets_and_commits(tmp_path):
+    path = str(tmp_path / 'journal')
+    j = EventJournal(path, segment_bytes=200)
+    for i in range(20):
+        j.append({'n': i}, 'topic')
+    j.commit('c', 7)
+    j.close()
+    j = EventJournal(path)
+    assert j.next_offset == 20
+    assert j.committed('c') == 7
+    assert [ev['n'] for _, _, _, ev in j.read(15)] == [15, 16, 17, 18, 19]
+    j.close()
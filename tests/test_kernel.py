@@ -0,0 +1,136 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from Pluto.aio import AsyncKernel
+from Pluto.kernel import Kernel, ServiceQueue
+
+
+def test_default_queue_is_unbounded_before_start():
+    seen = []
+    kernel = Kernel()
+    kernel.register_service('sink', seen.append)
+    for i in range(5000):
+        assert kernel.emit_event(i) == 1
+    kernel.start()
+    assert kernel.join(timeout=5)
+    kernel.stop()
+    assert seen == list(range(5000))
+
+
+@pytest.mark.parametrize('policy, kept', [
+    ('drop-new', [0, 1, 2]),
+    ('drop-oldest', [7, 8, 9]),
+    ('block', [0, 1, 2]),  # no worker yet: dropped rather than waiting forever
+])
+def test_bounded_policies_before_start(policy, kept):
+    seen = []
+    kernel = Kernel(queue_size=3, backpressure=policy)
+    kernel.register_service('sink', seen.append)
+    accepted = sum(kernel.emit_event(i) for i in range(10))
+    kernel.start()
+    assert kernel.join(timeout=5)
+    kernel.stop()
+    assert seen == kept
+    assert kernel.metrics()['sink']['dropped'] == 7
+    assert accepted == (10 if policy == 'drop-oldest' else 3)
+
+
+def test_emit_many_block_before_start_drops():
+    kernel = Kernel(queue_size=3, backpressure='block')
+    kernel.register_service('sink', lambda ev: None)
+    assert kernel.emit_many(list(range(10))) == 3
+    assert kernel.metrics()['sink']['dropped'] == 7
+
+
+def test_block_waits_for_running_worker():
+    release = threading.Event()
+    seen = []
+
+    def slow(ev):
+        release.wait()
+        seen.append(ev)
+    kernel = Kernel(queue_size=2, backpressure='block')
+    kernel.register_service('slow', slow)
+    kernel.start()
+    producer = threading.Thread(target=lambda: [kernel.emit_event(i) for i in range(20)])
+    producer.start()
+    producer.join(timeout=0.2)
+    assert producer.is_alive()  # blocked on the full queue
+    release.set()
+    producer.join(timeout=5)
+    assert kernel.join(timeout=5)
+    kernel.stop()
+    assert seen == list(range(20))
+    assert kernel.metrics()['slow']['dropped'] == 0
+
+
+def test_block_handler_emitting_to_own_full_queue_does_not_deadlock():
+    kernel = Kernel(queue_size=1, backpressure='block')
+    seen = []
+
+    def echo(ev):
+        seen.append(ev)
+        if ev < 3:
+            for _ in range(3):
+                kernel.emit_event(ev + 1)
+    kernel.register_service('echo', echo)
+    kernel.start()
+    kernel.emit_event(0)
+    assert kernel.join(timeout=5)
+    kernel.stop()
+    assert kernel.metrics()['echo']['dropped'] > 0
+
+
+def test_stopped_queue_rejects():
+    sq = ServiceQueue('q', None, maxsize=1, backpressure='block')
+    sq.reopen()
+    sq.close()
+    assert sq.put(1) is False
+
+
+def test_async_block_before_start_and_from_own_worker():
+    async def main():
+        kernel = AsyncKernel(queue_size=2, backpressure='block')
+        seen = []
+
+        async def echo(ev):
+            seen.append(ev)
+            if ev == 0:
+                await kernel.emit_many([1, 1, 1, 1])
+        kernel.register_service('echo', echo)
+        assert await kernel.emit_many([0, 9, 9]) == 2
+        await kernel.start()
+        assert await kernel.join(timeout=5)
+        await kernel.stop()
+        assert seen[:2] == [0, 9]
+        assert kernel.metrics()['echo']['dropped'] >= 1
+    asyncio.run(main())
+
+
+def test_consumer_commits_low_water_mark_with_several_workers(tmp_path):
+    started, release = threading.Event(), threading.Event()
+
+    def handler(ev):
+        if ev == 0:
+            started.set()
+            release.wait(5)
+    kernel = Kernel(journal=str(tmp_path / 'journal'))
+    kernel.register_service('svc', handler, workers=4, consumer='c')
+    kernel.start()
+    kernel.emit_event(0)
+    assert started.wait(5)
+    for i in range(1, 200):
+        kernel.emit_event(i)
+    deadline = time.monotonic() + 5
+    while kernel.metrics()['svc']['delivered'] < 199 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert kernel.metrics()['svc']['delivered'] == 199
+    assert kernel.journal.committed('c', 0) == 0  # event 0 is still in flight
+    release.set()
+    assert kernel.join(timeout=5)
+    kernel.stop()
+    assert kernel.journal.committed('c') == 200
+    kernel.journal.close()
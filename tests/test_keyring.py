@@ -0,0 +1,67 @@
+import os
+import threading
+
+from Pluto import keyring
+from Pluto.ciphers import XorCipher
+from Pluto.privacy import PrivacyVault
+
+
+class CountingCipher(XorCipher):
+    name = 'xor-counting'
+    built = 0
+
+    def __init__(self, key):
+        CountingCipher.built += 1
+        super().__init__(key)
+
+    @staticmethod
+    def generate_key():
+        return os.urandom(16)
+
+
+def test_cipher_shared_per_key_file(tmp_path):
+    keyring.clear()
+    CountingCipher.built = 0
+    path = str(tmp_path / 'key.key')
+    key, cipher = keyring.get(path, CountingCipher)
+    again = keyring.get(os.path.join(str(tmp_path), '.', 'key.key'), CountingCipher)  # same real path
+    assert again == (key, cipher)
+    assert CountingCipher.built == 1
+    other = keyring.get(str(tmp_path / 'other.key'), CountingCipher)
+    assert other[0] != key and CountingCipher.built == 2
+    # the same file under another cipher is a separate entry
+    assert keyring.get(path, XorCipher)[1] is not cipher
+
+
+def test_replaced_key_file_is_reloaded(tmp_path):
+    keyring.clear()
+    path = str(tmp_path / 'key.key')
+    key, cipher = keyring.get(path, CountingCipher)
+    with open(path + '.new', 'wb') as f:
+        f.write(b'a different key!')
+    os.replace(path + '.new', path)
+    new_key, new_cipher = keyring.get(path, CountingCipher)
+    assert new_key == b'a different key!' and new_cipher is not cipher
+
+
+def test_concurrent_first_use_creates_one_key(tmp_path):
+    keyring.clear()
+    path = str(tmp_path / 'sub' / 'key.key')
+    keys = []
+    threads = [threading.Thread(target=lambda: keys.append(keyring.get(path, CountingCipher)[0]))
+               for _ in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    with open(path, 'rb') as f:
+        assert set(keys) == {f.read()}
+
+
+def test_vaults_on_one_key_file_share_the_cipher(tmp_path):
+    key_path = str(tmp_path / 'key.key')
+    a = PrivacyVault(key_path=key_path, storage_dir=str(tmp_path / 'a'), cipher='xor')
+    b = PrivacyVault(key_path=key_path, storage_dir=str(tmp_path / 'b'), cipher='xor')
+    assert a.cipher is b.cipher
+    a.close()
+    b.close()
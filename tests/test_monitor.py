@@ -0,0 +1,102 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from Pluto.supervisor import Monitor
+
+pidfd = pytest.param(True, marks=pytest.mark.skipif(not hasattr(os, 'pidfd_open'), reason='needs pidfd_open'))
+
+
+@pytest.fixture(params=[pidfd, False], ids=['pidfd', 'polling'])
+def monitor(request):
+    mon = Monitor()
+    mon._use_pidfd = request.param
+    yield mon
+    mon.close()
+
+
+def watch(monitor, code):
+    lines, exited = [], threading.Event()
+    rc = []
+    process = subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    monitor.watch(process, lines.append, lambda r: (rc.append(r), exited.set()))
+    assert exited.wait(5)
+    return process, lines, rc
+
+
+def test_exit_code_and_output(monitor):
+    process, lines, rc = watch(monitor, "print('one'); print('two', end=''); raise SystemExit(3)")
+    assert rc == [3]
+    assert monitor._polled == {}
+    # the last line has no newline; it is flushed at EOF
+    deadline = time.monotonic() + 5
+    while lines != ['one', 'two'] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert lines == ['one', 'two']
+
+
+def test_exit_reported_once(monitor):
+    _, _, rc = watch(monitor, 'pass')
+    done = threading.Event()
+    monitor.call_later(monitor.POLL_INTERVAL * 3, done.set)
+    assert done.wait(5)
+    assert rc == [0]
+
+
+def test_polling_used_when_pidfd_fails(monkeypatch):
+    mon = Monitor()
+    mon._use_pidfd = True
+
+    def refuse(pid):
+        raise OSError('no pidfd here')
+    monkeypatch.setattr(os, 'pidfd_open', refuse, raising=False)
+    seen = []
+    try:
+        process = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(0.2)'])
+        exited = threading.Event()
+        mon.watch(process, seen.append, lambda rc: exited.set())
+        registered = threading.Event()
+        mon.call_soon(registered.set)
+        assert registered.wait(5)
+        assert process.pid in mon._polled
+        assert exited.wait(5)
+    finally:
+        mon.close()
+
+
+def test_foreign_process_reports_through_its_owner():
+    class Forked:
+        stdout = None
+
+        def add_exit_callback(self, cb):
+            self.cb = cb
+    mon = Monitor()
+    proc, rc = Forked(), []
+    exited = threading.Event()
+    try:
+        mon.watch(proc, print, lambda r: (rc.append(r), exited.set()))
+        added = threading.Event()
+        mon.call_soon(added.set)
+        assert added.wait(5)
+        proc.cb(9)  # e.g. the zygote reader thread
+        assert exited.wait(5) and rc == [9]
+        assert mon._polled == {}
+    finally:
+        mon.close()
+
+
+def test_timers_run_in_deadline_order_and_close_stops_the_thread():
+    mon = Monitor()
+    order, done = [], threading.Event()
+    mon.call_later(0.05, lambda: (order.append('late'), done.set()))
+    mon.call_later(0.01, lambda: order.append('early'))
+    assert done.wait(5)
+    assert order == ['early', 'late']
+    mon.close()
+    assert not mon._thread.is_alive()
+    mon.call_soon(lambda: order.append('after close'))  # ignored
+    assert order == ['early', 'late']
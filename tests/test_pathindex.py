@@ -0,0 +1,88 @@
+import pytest
+
+from Pluto.pathindex import PathIndex
+from Pluto.privacy import PrivacyVault
+from Pluto.vfs import VFS
+
+
+@pytest.fixture
+def rebuilds(monkeypatch):
+    calls = []
+    real = PathIndex._rebuild
+
+    def counting(self):
+        calls.append(self.storage_dir)
+        real(self)
+    monkeypatch.setattr(PathIndex, '_rebuild', counting)
+    return calls
+
+
+def open_vfs(tmp_path, backend):
+    return VFS(storage_dir=str(tmp_path / 'vfs'), key_path=str(tmp_path / 'key.key'), backend=backend)
+
+
+@pytest.mark.parametrize('backend', ['file', 'pack'])
+def test_reopen_does_not_rebuild(tmp_path, rebuilds, backend):
+    fs = open_vfs(tmp_path, backend)
+    fs.write('/docs/a.txt', b'a')
+    fs.write('/docs/b.txt', b'b')
+    fs.write('/docs/a.txt', b'overwrite')
+    fs.rm('/docs/b.txt')
+    if backend == 'pack':
+        fs.vault.backend.compact()
+    fs.close()
+    assert len(rebuilds) == 1  # the first open of an empty vault
+
+    fs = open_vfs(tmp_path, backend)
+    assert fs.ls() == ['docs/a.txt']
+    fs.write('/docs/c.txt', b'c')
+    fs.close()
+    fs = open_vfs(tmp_path, backend)
+    assert fs.ls('docs') == ['docs/a.txt', 'docs/c.txt']
+    fs.close()
+    assert len(rebuilds) == 1
+
+
+@pytest.mark.parametrize('backend', ['file', 'pack'])
+def test_foreign_write_rebuilds(tmp_path, rebuilds, backend):
+    fs = open_vfs(tmp_path, backend)
+    fs.write('/a', b'a')
+    fs.close()
+    vault = PrivacyVault(key_path=str(tmp_path / 'key.key'), storage_dir=str(tmp_path / 'vfs'), backend=backend)
+    vault.store('b', b'b')
+    vault.close()
+
+    fs = open_vfs(tmp_path, backend)
+    assert fs.ls() == ['a', 'b']
+    fs.close()
+    assert len(rebuilds) == 2
+
+
+def test_writer_open_before_index_is_not_hidden(tmp_path, rebuilds):
+    # FileStore: PackStore keeps its index in memory, one instance per directory
+    fs = open_vfs(tmp_path, 'file')
+    fs.write('/a', b'a')
+    fs.close()
+    # a second writer that already wrote before the index opened
+    vault = PrivacyVault(key_path=str(tmp_path / 'key.key'), storage_dir=str(tmp_path / 'vfs'), backend='file')
+    vault.store('b', b'b')
+    fs = open_vfs(tmp_path, 'file')
+    assert fs.ls() == ['a', 'b']
+    vault.store('c', b'c')
+    fs.close()
+    vault.close()
+
+    fs = open_vfs(tmp_path, 'file')
+    assert fs.ls() == ['a', 'b', 'c']
+    fs.close()
+
+
+def test_crash_before_close_rebuilds(tmp_path, rebuilds):
+    fs = open_vfs(tmp_path, 'file')
+    fs.write('/a', b'a')
+    fs.close()
+    fs = open_vfs(tmp_path, 'file')
+    fs.vault.store('b', b'b')  # written, but never indexed: the process dies here
+    fs = open_vfs(tmp_path, 'file')
+    assert fs.ls() == ['a', 'b']
+    assert len(rebuilds) == 2
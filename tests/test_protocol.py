@@ -0,0 +1,61 @@
+import random
+
+import pytest
+
+from Pluto.protocol import (BINARY, DIRECT, ROOM, TEXT, FrameDecoder, ProtocolError, encode_frame,
+                            encode_message, encode_routed, forward_frame, parse_forward, parse_routed)
+
+MESSAGES = ['hello', 'ünïcödé ✓', '', b'\x00\x01binary', b'', 'x' * 100000]
+
+
+def expected(msg):
+    return (TEXT, msg.encode('utf-8')) if isinstance(msg, str) else (BINARY, msg)
+
+
+def test_frames_survive_any_split():
+    stream = b''.join(encode_message(m) for m in MESSAGES)
+    rng = random.Random(7)
+    for _ in range(50):
+        decoder, frames, pos = FrameDecoder(), [], 0
+        while pos < len(stream):
+            step = rng.choice((1, 2, 5, 7, 4096, 65536))
+            frames += decoder.feed(stream[pos:pos + step])
+            pos += step
+        assert frames == [expected(m) for m in MESSAGES]
+        assert decoder.pending() == 0
+
+
+def test_partial_frame_is_buffered():
+    frame = encode_message('abcdef')
+    decoder = FrameDecoder()
+    assert decoder.feed(frame[:3]) == []
+    assert decoder.feed(frame[3:-1]) == []
+    assert decoder.pending() == len(frame) - 1
+    assert decoder.feed(frame[-1:] + frame) == [(TEXT, b'abcdef')] * 2
+
+
+def test_oversized_frame_rejected():
+    decoder = FrameDecoder(max_frame=10)
+    assert decoder.feed(encode_frame(TEXT, b'x' * 10)) == [(TEXT, b'x' * 10)]
+    with pytest.raises(ProtocolError):
+        decoder.feed(encode_frame(TEXT, b'x' * 11)[:5])
+
+
+def test_routed_and_forward_round_trip():
+    [(ftype, payload)] = FrameDecoder().feed(encode_routed(ROOM, 'lobby', 'hi', sender='peer-1'))
+    assert ftype == ROOM
+    assert parse_routed(payload) == (TEXT, 'lobby', 'peer-1', b'hi')
+    [(_, payload)] = FrameDecoder().feed(encode_routed(DIRECT, 'peer-2', b'\xff'))
+    assert parse_routed(payload) == (BINARY, 'peer-2', '', b'\xff')
+
+    inner = encode_routed(ROOM, 'lobby', 'hi', sender='a')
+    [(_, payload)] = FrameDecoder().feed(forward_frame(ROOM, 'node-a', 2 ** 40, 'lobby', inner))
+    assert parse_forward(payload) == (ROOM, 'node-a', 2 ** 40, 'lobby', inner)
+
+
+@pytest.mark.parametrize('payload', [b'', b'\x02\x00', b'\x02\x00\x09\x00\x00short'])
+def test_truncated_routing_header(payload):
+    with pytest.raises(ProtocolError):
+        parse_routed(payload)
+    with pytest.raises(ProtocolError):
+        parse_forward(payload)
@@ -0,0 +1,71 @@
+import pytest
+
+from Pluto.privacy import PrivacyVault
+from Pluto.readcache import ReadCache
+
+
+def test_lru_eviction_by_bytes():
+    cache = ReadCache(10)
+    cache.put('a', 1, b'aaaa')
+    cache.put('b', 1, b'bbbb')
+    assert cache.get('a', 1) == b'aaaa'  # a is now the most recent
+    cache.put('c', 1, b'cccc')
+    assert cache.get('b', 1) is None
+    assert cache.get('a', 1) == b'aaaa' and cache.get('c', 1) == b'cccc'
+    cache.put('huge', 1, b'x' * 11)  # over the whole budget: not cached
+    assert cache.get('huge', 1) is None
+    stats = cache.stats()
+    assert (stats['entries'], stats['bytes'], stats['evictions']) == (2, 8, 1)
+
+
+def test_stale_stamp_is_a_miss_and_zeroes_the_entry():
+    cache = ReadCache(100)
+    cache.put('a', 'v1', b'secret')
+    buf = cache._entries['a'][1]
+    assert cache.get('a', 'v2') is None
+    assert buf == bytearray(6)
+    assert 'a' not in cache._entries
+    assert cache.stats()['invalidations'] == 1
+
+    cache.put('b', 'v1', b'secret')
+    buf = cache._entries['b'][1]
+    cache.invalidate('b')
+    cache.invalidate('b')  # already gone: not counted again
+    assert buf == bytearray(6) and cache.get('b', 'v1') is None
+    assert cache.stats()['invalidations'] == 2
+
+
+def test_entries_kept_when_zeroing_is_off():
+    cache = ReadCache(100, zero_on_evict=False)
+    cache.put('a', 1, b'secret')
+    buf = cache._entries['a'][1]
+    cache.invalidate('a')
+    assert buf == b'secret'
+
+
+@pytest.mark.parametrize('backend', ['file', 'pack'])
+def test_vault_invalidates_on_store_and_delete(tmp_path, backend):
+    vault = PrivacyVault(key_path=str(tmp_path / 'key.key'), storage_dir=str(tmp_path / 'data'),
+                         backend=backend, cache_bytes=1 << 20)
+    vault.store('a', b'one')
+    assert vault.retrieve('a') == vault.retrieve('a') == b'one'
+    assert vault.cache.stats()['hits'] == 1
+    vault.store('a', b'two')
+    assert vault.retrieve('a') == b'two'
+    vault.delete('a')
+    with pytest.raises(KeyError):
+        vault.retrieve('a')
+    vault.close()
+
+
+def test_file_stamp_catches_writes_from_another_vault(tmp_path):
+    kw = dict(key_path=str(tmp_path / 'key.key'), storage_dir=str(tmp_path / 'data'))
+    reader = PrivacyVault(cache_bytes=1 << 20, **kw)
+    writer = PrivacyVault(**kw)
+    writer.store('a', b'one')
+    assert reader.retrieve('a') == b'one'
+    writer.store('a', b'changed behind the cache')
+    assert reader.retrieve('a') == b'changed behind the cache'
+    assert reader.cache.stats()['invalidations'] == 1
+    writer.close()
+    reader.close()
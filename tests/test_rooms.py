@@ -0,0 +1,110 @@
+import asyncio
+
+from Pluto.aio import AsyncCollabClient, AsyncCollabServer
+
+
+async def until(pred, timeout=5):
+    for _ in range(int(timeout / 0.01)):
+        if pred():
+            return True
+        await asyncio.sleep(0.01)
+    return pred()
+
+
+def recorder(client):
+    got = {'room': [], 'direct': [], 'presence': [], 'broadcast': [], 'error': []}
+    client.on_room_message = lambda room, sender, msg: got['room'].append((room, sender, msg))
+    client.on_direct_message = lambda sender, msg: got['direct'].append((sender, msg))
+    client.on_presence = got['presence'].append
+    client.on_message = got['broadcast'].append
+    client.on_error = got['error'].append
+    return got
+
+
+async def connected(server, name=None, rooms=()):
+    client = AsyncCollabClient(port=server.port, name=name)
+    got = recorder(client)
+    await client.connect()
+    assert await until(lambda: client.peer_id is not None)
+    for room in rooms:
+        client.join(room)
+    await client.drain()
+    return client, got
+
+
+def test_rooms_direct_and_presence():
+    async def run():
+        server = AsyncCollabServer(port=0)
+        await server.start()
+        alice, a = await connected(server, 'alice', ['lobby'])
+        bob, b = await connected(server, 'bob', ['lobby'])
+        carol, c = await connected(server, None)
+        assert await until(lambda: server.members('lobby') == ['alice', 'bob'])
+        assert carol.peer_id.startswith('peer')
+
+        alice.send_to_room('lobby', 'hi room')
+        alice.send_direct(carol.peer_id, b'psst')
+        alice.send_direct('nobody', 'lost')
+        await alice.drain()
+        assert await until(lambda: b['room'] and c['direct'] and a['error'])
+        assert b['room'] == [('lobby', 'alice', 'hi room')]
+        assert a['room'] == [] and c['room'] == []  # not echoed, not leaked
+        assert c['direct'] == [('alice', b'psst')]
+        assert a['error'] == ['no such peer: nobody']
+        assert {'event': 'members', 'room': 'lobby', 'peers': ['alice', 'bob']} in b['presence']
+        assert {'event': 'join', 'room': 'lobby', 'peer': 'bob'} in a['presence']
+
+        await bob.close()
+        assert await until(lambda: {'event': 'leave', 'room': 'lobby', 'peer': 'bob'} in a['presence'])
+        assert server.members('lobby') == ['alice']
+        alice.leave('lobby')
+        await alice.drain()
+        assert await until(lambda: 'lobby' not in server.rooms)
+        await alice.close()
+        await carol.close()
+        await server.stop()
+    asyncio.run(run())
+
+
+def test_taken_name_is_refused():
+    async def run():
+        server = AsyncCollabServer(port=0)
+        await server.start()
+        first, _ = await connected(server, 'same')
+        second, got = await connected(server, 'same')
+        assert await until(lambda: got['error'])
+        assert got['error'] == ['peer name taken: same']
+        assert second.peer_id != 'same'
+        await first.close()
+        await second.close()
+        await server.stop()
+    asyncio.run(run())
+
+
+def test_receive_loop_errors_surface_as_disconnect(caplog):
+    async def run():
+        server = AsyncCollabServer(port=0)
+        await server.start()
+        sender, _ = await connected(server, 'sender')
+        victim, _ = await connected(server, 'victim')
+        quiet, _ = await connected(server, 'quiet')
+        ends = {'sender': [], 'victim': [], 'quiet': []}
+        for client in (sender, victim, quiet):
+            client.on_disconnect = ends[client.name].append
+
+        def broken(sender, msg):
+            raise RuntimeError('callback bug')
+        victim.on_direct_message = broken
+        sender.send_direct('victim', 'boom')
+        await sender.drain()
+        assert await until(lambda: ends['victim'])
+        assert isinstance(ends['victim'][0], RuntimeError) and victim.recv_error is ends['victim'][0]
+        assert 'receive loop stopped' in caplog.text
+
+        await sender.close()  # closing ourselves is not reported
+        await server.stop()  # the server going away is a clean disconnect
+        assert await until(lambda: ends['quiet'] == [None])
+        assert quiet.recv_error is None and ends['sender'] == []
+        for client in (victim, quiet):
+            await client.close()
+    asyncio.run(run())
@@ -0,0 +1,67 @@
+import pytest
+
+from Pluto.kernel import Kernel, compile_pattern
+
+
+@pytest.mark.parametrize('pattern, kind', [
+    ('*', 'all'), ('vfs.write', 'exact'), ('vfs.*', 'prefix'), ('svc.*.crash', 'glob'), ('svc.?', 'glob'),
+])
+def test_compile_pattern(pattern, kind):
+    assert compile_pattern(pattern)[0] == kind
+
+
+def kernel_with(subscriptions):
+    kernel = Kernel()
+    for name, topics in subscriptions.items():
+        kernel.register_service(name, lambda ev: None, topics=topics)
+    return kernel
+
+
+def test_routes_by_exact_prefix_and_glob():
+    kernel = kernel_with({'all': None, 'exact': ['vfs.write'], 'prefix': ['vfs.*'],
+                          'glob': ['svc.*.crash'], 'both': ['vfs.*', 'vfs.write']})
+    assert kernel.routes('vfs.write') == ['all', 'exact', 'prefix', 'both']
+    assert kernel.routes('vfs.read') == ['all', 'prefix', 'both']
+    assert kernel.routes('svc.web.crash') == ['all', 'glob']
+    assert kernel.routes('svc.crash') == ['all']
+    assert kernel.routes(None) == ['all']
+
+
+def test_subscribe_and_unsubscribe_invalidate_cached_routes():
+    kernel = kernel_with({'s': ['a']})
+    assert kernel.routes('b') == []
+    kernel.subscribe('s', 'b')
+    assert kernel.routes('b') == ['s']
+    kernel.unsubscribe('s', 'a')
+    kernel.unsubscribe('s', 'b')
+    assert kernel.routes('a') == kernel.routes('b') == []
+    kernel.register_service('late', lambda ev: None)
+    assert kernel.routes('a') == ['late']
+
+
+def test_route_from_old_table_does_not_poison_new_cache():
+    kernel = kernel_with({'s': ['a']})
+    old = kernel._routing
+    kernel.subscribe('s', 'b')  # a rebuild while a lookup is still using `old`
+    assert kernel._route('b', old) == ()
+    assert kernel.routes('b') == ['s']
+
+
+def test_delivery_follows_event_topics():
+    got = {'vfs': [], 'svc': []}
+    kernel = Kernel()
+    kernel.register_service('vfs', got['vfs'].append, topics=['vfs.*'])
+    kernel.register_service('svc', got['svc'].append, topics=['svc.*'])
+    kernel.start()
+
+    class Ev:
+        topic = 'svc.obj'
+    obj = Ev()
+    events = [{'topic': 'vfs.write', 'n': 1}, {'topic': 'svc.up', 'n': 2}, {'topic': 'other'}, obj]
+    assert kernel.emit_many(events) == 3
+    assert kernel.emit_event('plain', topic='vfs.read') == 1
+    assert kernel.emit_many(['x', 'y'], topic='svc.batch') == 2
+    assert kernel.join(timeout=5)
+    kernel.stop()
+    assert got['vfs'] == [events[0], 'plain']
+    assert got['svc'] == [events[1], obj, 'x', 'y']
@@ -0,0 +1,36 @@
+from Pluto.servicelog import ServiceLog
+
+
+def test_multiline_appends_keep_seq_across_spill(tmp_path):
+    log = ServiceLog(max_lines=2, spill_dir=str(tmp_path), segment_lines=3)
+    lines = ['one', 'two\nlines', 'back\\slash \\n literal', 'three\nmore\nlines', 'last', 'tail\n']
+    for line in lines:
+        log.append(line)
+    log.flush()
+    assert log.query(tail=None) == lines
+    assert log.query(tail=2) == lines[-2:]
+    assert log.query(tail=None, grep='more\nlines') == ['three\nmore\nlines']
+    assert log.query(tail=None, grep='\\n') == ['back\\slash \\n literal']
+    seqs = [seq for seq, _, _ in log._newest_first(None)]
+    assert seqs == list(range(len(lines)))[::-1]
+
+
+def test_reopen_continues_sequence(tmp_path):
+    log = ServiceLog(max_lines=10, spill_dir=str(tmp_path), segment_lines=2)
+    for i in range(5):
+        log.append(f"line {i}")
+    log.flush()
+    log = ServiceLog(max_lines=10, spill_dir=str(tmp_path), segment_lines=2)
+    log.append('after restart')
+    log.flush()
+    assert log.query(tail=None) == [f"line {i}" for i in range(5)] + ['after restart']
+
+
+def test_retention_and_since(tmp_path):
+    log = ServiceLog(max_lines=1, spill_dir=str(tmp_path), segment_lines=10, max_segments=2)
+    for i in range(50):
+        log.append(f"l{i}", ts=float(i))
+    log.flush()
+    assert log.query(tail=None) == [f"l{i}" for i in range(30, 50)]
+    assert log.query(tail=None, since=45.0) == [f"l{i}" for i in range(45, 50)]
+    assert log.query(tail=None, regex=r'l4[02]$') == ['l40', 'l42']
@@ -0,0 +1,90 @@
+import pytest
+
+from Pluto.aio import AsyncCollabServer, _Peer
+
+
+class Transport:
+    """Stands in for a peer whose socket buffer is already full."""
+
+    def __init__(self):
+        self.written = []
+        self.aborted = False
+
+    def is_closing(self):
+        return self.aborted
+
+    def get_write_buffer_size(self):
+        return 1 << 30
+
+    def write(self, data):
+        self.written.append(data)
+
+    def abort(self):
+        self.aborted = True
+
+
+class Writer:
+    def __init__(self):
+        self.transport = Transport()
+
+    def get_extra_info(self, name):
+        return ('127.0.0.1', 1)
+
+
+def stalled(server, policy=None, limit=10):
+    return _Peer(Writer(), 'p', limit, policy or server.slow_consumer)
+
+
+def frames(peer):
+    return list(peer.queue)
+
+
+def test_drop_discards_new_frames():
+    server = AsyncCollabServer(slow_consumer='drop')
+    peer = stalled(server)
+    for msg in (b'aaaa', b'bbbb', b'cccc', b'dd'):
+        server._deliver(peer, msg)
+    assert frames(peer) == [b'aaaa', b'bbbb', b'dd']  # cccc did not fit
+    assert (peer.queued, peer.dropped, server.dropped) == (10, 1, 1)
+
+
+def test_coalesce_discards_oldest_frames():
+    server = AsyncCollabServer(slow_consumer='coalesce')
+    peer = stalled(server)
+    for msg in (b'aaaa', b'bbbb', b'cccc', b'dddddd'):
+        server._deliver(peer, msg)
+    assert frames(peer) == [b'cccc', b'dddddd']  # skipped ahead to the latest
+    assert (peer.queued, peer.dropped) == (10, 2)
+
+
+def test_disconnect_aborts_the_peer():
+    server = AsyncCollabServer(slow_consumer='disconnect')
+    peer = stalled(server)
+    server._deliver(peer, b'aaaaaaaa')
+    server._deliver(peer, b'bbbb')
+    assert peer.transport.aborted and server.slow_disconnects == 1
+    server._deliver(peer, b'cc')  # closing: nothing more is queued
+    assert frames(peer) == [b'aaaaaaaa'] and peer.dropped == 0
+
+
+def test_policy_is_per_peer():
+    server = AsyncCollabServer(slow_consumer='drop')
+    client, link = stalled(server), stalled(server, 'disconnect')
+    for peer in (client, link):
+        server._deliver(peer, b'x' * 8)
+        server._deliver(peer, b'y' * 8)
+    assert not client.transport.aborted and client.dropped == 1
+    assert link.transport.aborted and link.dropped == 0
+
+
+def test_idle_peer_is_written_directly():
+    server = AsyncCollabServer()
+    peer = stalled(server)
+    peer.transport.get_write_buffer_size = lambda: 0
+    server._deliver(peer, b'x' * 100)  # over the queue limit, but nothing is queued
+    assert peer.transport.written == [b'x' * 100] and not peer.queue
+
+
+def test_unknown_policy_rejected():
+    with pytest.raises(ValueError):
+        AsyncCollabServer(slow_consumer='block')
@@ -0,0 +1,154 @@
+import os
+import sys
+import time
+
+import pytest
+
+from Pluto.resources import Limits
+from Pluto.supervisor import RestartPolicy, Supervisor
+
+SLEEPER = [sys.executable, '-c', 'import time; time.sleep(30)']
+
+
+def until(pred, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if pred():
+            return True
+        time.sleep(0.01)
+    return pred()
+
+
+def proc_limit(pid, label):
+    with open(f"/proc/{pid}/limits") as f:
+        for row in f:
+            if row.startswith(label):
+                return row[len(label):].split()[:2]
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/limits'), reason='needs /proc')
+def test_limits_applied_to_parallel_starts():
+    sup = Supervisor(parallel=4)
+    for i in range(4):
+        sup.register_service(f"s{i}", SLEEPER, restart=False, limits=Limits(nofile=77, cpu=100))
+    try:
+        sup.start_all()
+        for svc in sup.services.values():
+            assert proc_limit(svc.process.pid, 'Max open files') == ['77', '77']
+            assert proc_limit(svc.process.pid, 'Max cpu time') == ['100', '101']
+    finally:
+        sup.stop_all(timeout=2)
+
+
+def test_restart_policy_backoff():
+    policy = RestartPolicy(backoff=0.1, factor=2.0, max_backoff=1.0, jitter=0)
+    assert [policy.delay(n) for n in range(5)] == [0.1, 0.2, 0.4, 0.8, 1.0]
+    jittered = RestartPolicy(backoff=1.0, jitter=0.1)
+    assert all(0.9 <= jittered.delay(0) <= 1.1 for _ in range(100))
+    assert RestartPolicy(restart_on='failure').wants_restart(0) is False
+    assert RestartPolicy(restart_on='failure').wants_restart(1) is True
+    with pytest.raises(ValueError):
+        RestartPolicy(restart_on='sometimes')
+
+
+def test_clean_exit_not_restarted_on_failure_policy():
+    sup = Supervisor()
+    sup.register_service('once', [sys.executable, '-c', 'pass'],
+                         policy=RestartPolicy(backoff=0.01, restart_on='failure'))
+    try:
+        sup.start_service('once')
+        assert until(lambda: sup.status()['once']['last_exit_code'] == 0)
+        time.sleep(0.1)
+        assert sup.status()['once']['restarts'] == 0
+    finally:
+        sup.stop_all(timeout=2)
+
+
+def test_dependency_stages_and_cycles():
+    sup = Supervisor()
+    for name, deps in (('db', ()), ('cache', ()), ('api', ('db', 'cache')), ('web', ('api',))):
+        sup.register_service(name, SLEEPER, depends_on=deps)
+    stages = sup._stages(sup._start_order(['web']))
+    assert [sorted(s.name for s in stage) for stage in stages] == [['cache', 'db'], ['api'], ['web']]
+    sup.register_service('a', SLEEPER, depends_on=('b',))
+    sup.register_service('b', SLEEPER, depends_on=('a',))
+    with pytest.raises(ValueError, match='cycle'):
+        sup._start_order(['a'])
+    sup.register_service('c', SLEEPER, depends_on=('missing',))
+    with pytest.raises(KeyError):
+        sup._start_order(['c'])
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/stat'), reason='needs /proc')
+def test_first_resource_sample_right_after_start():
+    sup = Supervisor(sample_interval=60)
+    sup.register_service('a', SLEEPER, restart=False)
+    sup.register_service('b', SLEEPER, restart=False)
+    try:
+        sup.start_all()
+        assert until(lambda: sup.status()['a']['resources'] is not None, timeout=2)
+        sup.stop_service('b')
+        sup.start_service('b')  # sampling already running: b gets its own first sample
+        assert until(lambda: sup.services['b']._last_sample is not None, timeout=2)
+    finally:
+        sup.close(timeout=2)
+
+
+def test_start_all_stages_and_timeouts(monkeypatch):
+    sup = Supervisor(parallel=8)
+    for name, deps in (('db', ()), ('api', ('db',)), ('web', ('api',)), ('slow', ()), ('after', ('slow',))):
+        sup.register_service(name, SLEEPER, restart=False, depends_on=deps)
+    spawned = []
+    slow = sup.services['slow']
+    real_spawn = slow._spawn
+
+    def slow_spawn():
+        time.sleep(1)  # e.g. a hung zygote
+        real_spawn()
+    monkeypatch.setattr(slow, '_spawn', slow_spawn)
+    for svc in sup.services.values():
+        spawn = svc._spawn
+        monkeypatch.setattr(svc, '_spawn', lambda svc=svc, spawn=spawn: (spawn(), spawned.append(svc.name)))
+    try:
+        report = sup.start_all(timeout=0.2)
+        assert report['stages'] == 3 and report['started'] == 3
+        assert report['failed'] == {'slow': 'start timed out after 0.2s', 'after': 'dependency slow failed'}
+        assert spawned == ['db', 'api', 'web']
+        # the abandoned start finishes later, but does not leave slow running
+        assert until(lambda: 'slow' in spawned)
+        assert until(lambda: not slow.is_running() and slow.state == 'stopped')
+        assert not sup.services['after'].is_running()
+    finally:
+        sup.stop_all(timeout=2)
+
+
+def test_crashing_service_is_restarted_then_marked_failed():
+    sup = Supervisor()
+    sup.register_service('crash', [sys.executable, '-c', 'raise SystemExit(3)'],
+                         policy=RestartPolicy(backoff=0.01, max_backoff=0.01, max_restarts=3, window=60))
+    try:
+        sup.start_service('crash')
+        assert until(lambda: sup.status()['crash']['state'] == 'failed')
+    finally:
+        sup.stop_all(timeout=2)
+
+
+def test_stop_all_and_close_shut_down_the_zygote():
+    server = [sys.executable, '-m', 'http.server', '0', '--bind', '127.0.0.1']
+    sup = Supervisor(zygote=True, zygote_preload=('json',))
+    sup.register_service('web', server, restart=False)
+    sup.start_all()
+    helper = sup.zygote.helper
+    assert type(sup.services['web'].process).__name__ == 'ZygoteProcess'
+    assert helper.poll() is None
+    sup.stop_all(timeout=2)
+    assert helper.poll() is not None
+    with pytest.raises(ProcessLookupError):
+        os.kill(helper.pid, 0)
+
+    sup.start_all()  # a fresh helper is started on demand
+    helper = sup.zygote.helper
+    assert helper.poll() is None and sup.services['web'].is_running()
+    sup.close(timeout=2)
+    assert helper.poll() is not None
+    assert not sup.monitor._thread.is_alive()
@@ -0,0 +1,58 @@
+import pytest
+
+from Pluto.vfs import VFS
+
+
+@pytest.fixture(params=['file', 'pack'])
+def fs(tmp_path, request):
+    fs = VFS(storage_dir=str(tmp_path / 'vfs'), key_path=str(tmp_path / 'key.key'), backend=request.param)
+    yield fs
+    fs.close()
+
+
+def test_write_many_duplicates_last_write_wins(fs):
+    items = [(f"/d/{i % 5}", str(i).encode()) for i in range(200)]
+    stored = list(fs.write_many(items, workers=8, batch=7))
+    assert sorted(stored) == sorted(p for p, _ in items)
+    for k in range(5):
+        assert fs.read(f"/d/{k}") == str(195 + k).encode()
+    assert fs.ls('d') == [f"d/{k}" for k in range(5)]
+
+
+def test_write_many_equivalent_paths(fs):
+    stored = list(fs.write_many([('/a/b', b'1'), ('a/b', b'2'), ('/a/b/', b'3')]))
+    assert sorted(stored) == ['/a/b', '/a/b/', 'a/b']
+    assert fs.read('a/b') == b'3'
+
+
+def test_read_many_duplicates(fs):
+    fs.write('/x', b'x')
+    fs.write('/y', b'y')
+    got = sorted(fs.read_many(['/x', '/y', '/x', 'x', '/y'], workers=4))
+    assert got == [('/x', b'x'), ('/x', b'x'), ('/y', b'y'), ('/y', b'y'), ('x', b'x')]
+
+
+def test_open_write_listed_only_after_close(fs):
+    f = fs.open_write('/big/file', chunk_size=1024)
+    f.write(b'x' * 5000)
+    assert fs.ls('big') == []
+    f.close()
+    assert fs.ls('big') == ['big/file']
+    assert fs.read('/big/file') == b'x' * 5000
+
+
+def test_aborted_open_write_is_not_listed(fs):
+    with pytest.raises(RuntimeError):
+        with fs.open_write('/big/new', chunk_size=1024) as f:
+            f.write(b'partial' * 1000)
+            raise RuntimeError('writer failed')
+    assert fs.ls('big') == []
+    with pytest.raises(KeyError):
+        fs.read('/big/new')
+
+    fs.write('/big/old', b'keep me')
+    f = fs.open_write('/big/old')
+    f.write(b'replacement')
+    f.abort()
+    assert fs.ls('big') == ['big/old']
+    assert fs.read('/big/old') == b'keep me'